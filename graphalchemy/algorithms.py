@@ -0,0 +1,252 @@
+"""
+Graph algorithms:
+
+    whole-graph analytics over a :class:`~graphalchemy.csr.CSRGraph`
+    snapshot, with results returned as {node_id: value} dicts and optionally
+    written back to a column of the node table in one executemany.
+
+All of these treat the graph as *undirected* and simple (edge direction,
+self loops and parallel edges are ignored), like networkx does for
+`nx.Graph`.
+"""
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("Must have NumPy installed to use algorithms")
+import json
+import sqlalchemy as sqla
+from graphalchemy.csr import CSRGraph
+
+# below this many requested ids, triangles/clustering ask the database
+# directly instead of snapshotting the whole graph
+SQL_THRESHOLD = 100
+
+def undirected_snapshot(session, Node, Edge):
+    """ simple, undirected :class:`CSRGraph` of the whole graph """
+    return CSRGraph.from_session(session, Node, Edge, direction="both", simple=True)
+
+def store_results(session, Node, values, column):
+    """ write {node_id: value} into `column` of the node table with a single
+    executemany UPDATE (the session is not committed) """
+    table = Node.__table__
+    if values:
+        session.execute(table.update().where(table.c.id == sqla.bindparam("node_id")
+            ).values({column: sqla.bindparam("value")}),
+            [dict(node_id=k, value=v) for k, v in values.items()])
+
+def _gather(ptr, idx, nodes):
+    """ concatenation of the adjacency slices of `nodes`, and the index
+    into `nodes` each entry came from """
+    starts = ptr[nodes]
+    lengths = ptr[nodes + 1] - starts
+    total = lengths.sum()
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return idx[offsets + np.arange(total)], np.repeat(np.arange(len(nodes)), lengths)
+
+def triangle_counts(csr, block=4000000):
+    """ triangles through each position of a simple, undirected `csr`.
+
+    Uses the degree-ordered ("forward") algorithm: every edge is oriented
+    from its lower- to its higher-ranked end (ranking by degree), so each
+    triangle u -> v -> w is found exactly once, from its lowest-ranked
+    corner, by checking the wedges u -> v -> w against the forward edge
+    u -> w. That's O(m^1.5) worst case, done in vectorized blocks of about
+    `block` wedges.
+
+        :returns: array of triangle counts by position
+    """
+    n = len(csr)
+    degree = csr.degree()
+    rank = np.empty(n, dtype=np.int64)
+    rank[np.lexsort((np.arange(n), degree))] = np.arange(n)
+    sources = csr.sources()
+    forward = rank[sources] < rank[csr.indices]
+    fwd_src = sources[forward]
+    fwd_idx = csr.indices[forward]
+    fwd_ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(fwd_src, minlength=n), out=fwd_ptr[1:])
+    # forward edges as sorted u * n + w keys, for membership tests
+    keys = fwd_src * n + fwd_idx
+    counts = np.zeros(n, dtype=np.int64)
+    wedges = np.cumsum(fwd_ptr[fwd_idx + 1] - fwd_ptr[fwd_idx])
+    start = 0
+    while start < len(fwd_idx):
+        stop = max(np.searchsorted(wedges, wedges[start] - 1 + block, side="right"), start + 1)
+        us, vs = fwd_src[start:stop], fwd_idx[start:stop]
+        ws, which = _gather(fwd_ptr, fwd_idx, vs)
+        if len(ws):
+            wanted = us[which] * n + ws
+            found = np.searchsorted(keys, wanted)
+            found[found >= len(keys)] = 0
+            hit = keys[found] == wanted
+            which, ws = which[hit], ws[hit]
+            counts += np.bincount(us[which], minlength=n)
+            counts += np.bincount(vs[which], minlength=n)
+            counts += np.bincount(ws, minlength=n)
+        start = stop
+    return counts
+
+def _sql_neighbors(Edge, node_id):
+    """ select of the distinct neighbors of `node_id`, ignoring self loops """
+    table = Edge.__table__
+    return sqla.union(
+        sqla.select([table.c.target_id], sqla.and_(table.c.source_id == node_id,
+            table.c.target_id != node_id)),
+        sqla.select([table.c.source_id], sqla.and_(table.c.target_id == node_id,
+            table.c.source_id != node_id)))
+
+def _sql_triangles(session, Edge, node_id):
+    """ (triangles, degree) for one node, via a self-join on the edge table """
+    table = Edge.__table__
+    neighbors = [row[0] for row in session.execute(_sql_neighbors(Edge, node_id))]
+    if len(neighbors) < 2:
+        return 0, len(neighbors)
+    # distinct unordered pairs of neighbors that are joined by an edge
+    low = sqla.func.min(table.c.source_id, table.c.target_id)
+    high = sqla.func.max(table.c.source_id, table.c.target_id)
+    pairs = sqla.select([low, high], sqla.and_(
+        table.c.source_id.in_(_sql_neighbors(Edge, node_id)),
+        table.c.target_id.in_(_sql_neighbors(Edge, node_id)),
+        table.c.source_id != table.c.target_id)).distinct().alias()
+    count = session.execute(sqla.select([sqla.func.count()]).select_from(pairs)).scalar()
+    return count, len(neighbors)
+
+def _local(session, Node, Edge, ids, method, snapshot, compute):
+    """ run `compute(triangles, degree)` for the requested ids with either
+    method, returns {node_id: value} """
+    if method not in ("auto", "numpy", "sql"):
+        raise ValueError("method must be 'auto', 'numpy' or 'sql', not %r" % (method,))
+    if ids is not None:
+        ids = [getattr(i, "id", i) for i in ids]
+    if method == "sql" or (method == "auto" and snapshot is None and ids is not None
+            and len(ids) <= SQL_THRESHOLD):
+        if ids is None:
+            ids = [row[0] for row in session.execute(sqla.select([Node.__table__.c.id]))]
+        return dict((node_id, compute(*_sql_triangles(session, Edge, node_id)))
+                for node_id in ids)
+    csr = snapshot if snapshot is not None else undirected_snapshot(session, Node, Edge)
+    counts = triangle_counts(csr)
+    degree = csr.degree()
+    if ids is None:
+        positions = np.arange(len(csr))
+    else:
+        positions = csr.positions(ids)
+    values = compute(counts[positions], degree[positions])
+    return dict(zip(csr.ids[positions].tolist(), np.asarray(values).tolist()))
+
+def triangles(session, Node, Edge, ids=None, method="auto", snapshot=None, column=None):
+    """ number of triangles through each node.
+
+        :param ids: (optional) node ids (or nodes) to report, default all
+        :param method: 'numpy' counts over a snapshot of the whole graph,
+                       'sql' runs a self-join per node, 'auto' uses SQL for
+                       up to `SQL_THRESHOLD` ids and numpy otherwise
+        :param snapshot: (optional) simple undirected :class:`CSRGraph` to
+                         reuse (see :func:`undirected_snapshot`)
+        :param column: (optional) node column to write the results into
+        :returns: dict of {node_id: triangles}
+    """
+    results = _local(session, Node, Edge, ids, method, snapshot,
+            lambda count, degree: count)
+    if column:
+        store_results(session, Node, results, column)
+    return results
+
+def _clustering(count, degree):
+    possible = degree * (degree - 1)
+    if np.ndim(possible):
+        result = np.zeros(len(possible), dtype=np.float64)
+        np.divide(2.0 * count, possible, out=result, where=possible > 0)
+        return result
+    return 2.0 * count / possible if possible else 0.0
+
+def clustering(session, Node, Edge, ids=None, method="auto", snapshot=None, column=None):
+    """ local clustering coefficient of each node: the fraction of pairs of
+    its neighbors that are themselves connected (0 for degree < 2). Same
+    parameters as :func:`triangles`.
+
+        :returns: dict of {node_id: coefficient}
+    """
+    results = _local(session, Node, Edge, ids, method, snapshot, _clustering)
+    if column:
+        store_results(session, Node, results, column)
+    return results
+
+def core_number_array(csr):
+    """ core number of each position of a simple, undirected `csr`: the
+    largest k such that the node is in a subgraph where every node has
+    degree >= k.
+
+    Uses the O(n + m) bucket algorithm of Batagelj and Zaversnik: nodes are
+    kept sorted by current degree in one array, with the start of each
+    degree's bucket in another, and are peeled off in that order; removing
+    a node moves each of its higher-degree neighbors one bucket down with
+    a single swap.
+
+        :returns: array of core numbers by position
+    """
+    n = len(csr)
+    degree = csr.degree().tolist()
+    indptr = csr.indptr.tolist()
+    indices = csr.indices.tolist()
+    counts = np.bincount(degree, minlength=1) if n else np.zeros(1, dtype=np.int64)
+    # first slot of each degree's bucket in `order`
+    bucket = np.concatenate([[0], np.cumsum(counts)[:-1]]).tolist()
+    order = np.argsort(degree, kind="mergesort").tolist()
+    position = [0] * n
+    for i, node in enumerate(order):
+        position[node] = i
+    for node in order:
+        node_degree = degree[node]
+        for neighbor in indices[indptr[node]:indptr[node + 1]]:
+            neighbor_degree = degree[neighbor]
+            if neighbor_degree > node_degree:
+                # swap the neighbor to the front of its bucket, then shrink it
+                first = bucket[neighbor_degree]
+                other = order[first]
+                if other != neighbor:
+                    here = position[neighbor]
+                    order[first], order[here] = neighbor, other
+                    position[neighbor], position[other] = first, here
+                bucket[neighbor_degree] += 1
+                degree[neighbor] = neighbor_degree - 1
+    return np.array(degree, dtype=np.int64)
+
+def core_numbers(session, Node, Edge, snapshot=None, column=None):
+    """ core number of every node (see :func:`core_number_array`), from one
+    scan of the node and edge tables.
+
+        :param snapshot: (optional) simple undirected :class:`CSRGraph` to
+                         reuse (see :func:`undirected_snapshot`)
+        :param column: (optional) node column to write the results into
+        :returns: dict of {node_id: core number}
+    """
+    csr = snapshot if snapshot is not None else undirected_snapshot(session, Node, Edge)
+    results = dict(zip(csr.ids.tolist(), core_number_array(csr).tolist()))
+    if column:
+        store_results(session, Node, results, column)
+    return results
+
+def prune_to_kcore(session, Node, Edge, k, snapshot=None, table=None):
+    """ ids of the nodes in the `k`-core: what's left after repeatedly
+    removing every node of degree < `k`, computed in one pass with
+    :func:`core_number_array` instead of one round of deletes per pass.
+
+    With `table`, the ids also come as a selectable of that name with one
+    `id` column, so downstream queries can join against the core, e.g.
+    ``session.query(Node).filter(Node.id.in_(sqla.select([core.c.id])))``.
+    It reads the ids from a single bound JSON array with SQLite's
+    ``json_each``, so no table is created and the session's transaction
+    is left alone.
+
+        :param int k: minimum degree within the core
+        :param snapshot: (optional) simple undirected :class:`CSRGraph`
+        :param table: (optional) name for the selectable of the core ids
+        :returns: set of node ids, or (set, selectable) with `table`
+    """
+    csr = snapshot if snapshot is not None else undirected_snapshot(session, Node, Edge)
+    ids = set(csr.ids[core_number_array(csr) >= k].tolist())
+    if table is None:
+        return ids
+    values = sqla.func.json_each(json.dumps(sorted(ids)))
+    return ids, sqla.select([sqla.literal_column("value").label("id")], from_obj=[values]).alias(table)
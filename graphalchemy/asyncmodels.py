@@ -0,0 +1,129 @@
+"""
+Asyncio facade:
+
+    lets asyncio code query graphs built with
+    :func:`graphalchemy.sqlmodels.create_base_classes` without blocking the
+    event loop.
+
+SQLAlchemy's ORM is blocking, so every call is handed to a bounded thread
+pool and comes back to the loop as an awaitable. Each call runs in its own
+session, so any number of traversals can be in flight at once, while at most
+`max_workers` of them hold a database connection. Example::
+
+    >>> graph = AsyncGraph(engine, Node, Edge, max_workers=8)
+    >>> node = await graph.get(1)
+    >>> neighbors = await graph.neighbors(node)
+    >>> within_two = await graph.k_hop(node, 2)
+    >>> await graph.bulk_connect([(1, 2), (2, 3)], weight=1.0)
+
+NOTE: results come back *detached* from their session. Columns are already
+loaded, but relationships (`in_edges`, `out_edges`, ...) that weren't touched
+in the worker can't be lazy-loaded afterwards. Use an on-disk database: an
+in-memory SQLite database is private to the thread that opened it.
+"""
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # without them, pass both `loop` and `executor`
+    asyncio = ThreadPoolExecutor = None
+import threading
+import sqlalchemy.orm as orm
+from graphalchemy import traversal
+
+class AsyncGraph(object):
+    """ runs graph queries for one Node/Edge pair on a thread pool.
+
+        :param engine: SQLAlchemy engine to bind sessions to
+        :param Node: mapped node class
+        :param Edge: mapped edge class
+        :param int max_workers: maximum number of queries touching the
+                                database at once (the rest wait their turn)
+        :param loop: (optional) event loop, defaults to the running loop
+        :param sessionmaker: (optional) must take `bind=engine` and
+                             `expire_on_commit`, like :func:`sqlalchemy.orm.sessionmaker`
+        :param executor: (optional) executor to hand calls to with
+                         ``loop.run_in_executor``, defaults to a thread pool
+                         of `max_workers` threads (shut down by :meth:`close`)
+    """
+    def __init__(self, engine, Node, Edge, max_workers=4, loop=None, sessionmaker=None,
+            executor=None):
+        sessionmaker = sessionmaker or orm.sessionmaker
+        # keep attributes loaded after commit, since callers only ever
+        # see the objects after their session is closed
+        self.Session = sessionmaker(bind=engine, expire_on_commit=False)
+        self.Node = Node
+        self.Edge = Edge
+        if asyncio is None and (loop is None or executor is None):
+            raise ImportError("Must have asyncio (Python 3.4+) to use asyncmodels")
+        self.loop = loop
+        self.owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.executor = executor
+        # also caps a shared executor that has more threads
+        self.slots = threading.BoundedSemaphore(max_workers)
+
+    def run(self, fn, *args, **kwargs):
+        """ call ``fn(session, *args, **kwargs)`` on the thread pool with a
+        fresh session, committing on success and rolling back on error.
+
+        :returns: awaitable for the return value of `fn`
+        """
+        loop = self.loop or asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, self._call, fn, args, kwargs)
+
+    def _call(self, fn, args, kwargs):
+        with self.slots:
+            session = self.Session()
+            try:
+                result = fn(session, *args, **kwargs)
+                session.commit()
+                return result
+            except:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+    def get(self, node_id):
+        """ awaitable for the node with id `node_id` (or None) """
+        return self.run(lambda session: session.query(self.Node).get(node_id))
+
+    def neighbors(self, node):
+        """ awaitable for a list of the neighbors of `node` (instance or id),
+        in the same order as :attr:`~graphalchemy.basemodels.BaseNode.neighbors`.
+        Fails with KeyError if there's no such node. """
+        node_id = getattr(node, "id", node)
+        def _neighbors(session):
+            found = session.query(self.Node).get(node_id)
+            if found is None:
+                raise KeyError("Unknown node id: %r" % (node_id,))
+            return list(found.neighbors)
+        return self.run(_neighbors)
+
+    def k_hop(self, node, k, direction="both"):
+        """ awaitable for :func:`graphalchemy.traversal.k_hop` """
+        return self.run(traversal.k_hop, self.Edge, node, k, direction)
+
+    def bulk_connect(self, pairs, **kwargs):
+        """ awaitable that inserts one edge per `(source_id, target_id)` in
+        `pairs` with a single executemany. `kwargs` are set on every edge.
+
+        :returns: number of edges inserted
+        """
+        if getattr(self.Edge, "undirected", False):
+            # stored low id first, as the CHECK constraint requires
+            pairs = [(min(pair), max(pair)) for pair in pairs]
+        rows = [dict(kwargs, source_id=source_id, target_id=target_id)
+                for source_id, target_id in pairs]
+        def _bulk_connect(session):
+            if rows:
+                session.execute(self.Edge.__table__.insert(), rows)
+            return len(rows)
+        return self.run(_bulk_connect)
+
+    def close(self, wait=True):
+        """ shut down the thread pool (unless it was passed in) """
+        if self.owns_executor:
+            self.executor.shutdown(wait=wait)
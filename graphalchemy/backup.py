@@ -0,0 +1,290 @@
+"""
+Backup:
+
+    page-level copies of a whole SQLite graph database, for forking a graph
+    (e.g. for a what-if simulation) in seconds instead of copying rows
+    through the ORM::
+
+        >>> snapshot(engine, "/tmp/fork.db")        # consistent on-disk copy
+        >>> mem_engine, session = clone_to_memory(engine)
+        >>> ...                                     # work in RAM
+        >>> restore(engine, mem_engine)             # write it back
+
+Where Python's sqlite3 has the online backup API (Python 3.7+) it is used,
+copying `pages` pages per step so other connections can keep reading the
+source between steps. Otherwise files are written with ``VACUUM INTO``
+(SQLite 3.27+) and in-memory copies are made by ATTACHing the source and
+copying every table with ``INSERT ... SELECT``; both run in one read
+transaction, so the copy is consistent and readers are never blocked.
+
+A :class:`Checkpointer` writes an in-memory working database back to its
+file every so many commits or seconds (see `in_memory` in
+:func:`~graphalchemy.sqlmodels.sqlite_connect`).
+"""
+import logging
+import os
+import tempfile
+import time
+import sqlalchemy as sqla
+import sqlalchemy.orm as orm
+logger = logging.getLogger("graphalchemy")
+
+def _raw(engine):
+    """ (pooled connection, sqlite3 connection) checked out from `engine` """
+    pooled = engine.raw_connection()
+    return pooled, pooled.connection
+
+def _database_path(engine):
+    """ absolute path of `engine`'s database file, or None if in memory """
+    database = engine.url.database
+    if not database or database == ":memory:":
+        return None
+    return os.path.abspath(database)
+
+def _has_backup(connection):
+    return hasattr(connection, "backup")
+
+def _backup(source, target, pages, progress):
+    """ sqlite3 online backup from connection `source` into `target` """
+    source.commit()
+    target.commit()
+    source.backup(target, pages=pages, progress=progress)
+
+def snapshot(engine, dest, pages=-1, progress=None):
+    """ write a consistent copy of `engine`'s database to the file `dest`
+    (which must not exist yet).
+
+        :param engine: SQLite engine (file or in-memory)
+        :param dest: path of the copy
+        :param int pages: pages copied per backup step (-1: all at once); only
+                          used with the backup API
+        :param progress: (optional) `progress(status, remaining, total)`
+                         called after each backup step
+        :returns: absolute path of the copy
+    """
+    dest = os.path.abspath(dest)
+    if os.path.exists(dest):
+        raise ValueError("Destination already exists: %s" % dest)
+    pooled, connection = _raw(engine)
+    try:
+        if _has_backup(connection):
+            import sqlite3
+            target = sqlite3.connect(dest)
+            try:
+                _backup(connection, target, pages, progress)
+            finally:
+                target.close()
+        else:
+            connection.commit()
+            connection.execute("VACUUM INTO ?", (dest,))
+    finally:
+        pooled.close()
+    logger.info("Snapshot written to %r" % dest)
+    return dest
+
+def memory_engine(**kwargs):
+    """ engine on a new in-memory database that keeps its single connection
+    (so the data lives as long as the engine) and can be shared between
+    threads """
+    return sqla.create_engine("sqlite://", poolclass=sqla.pool.StaticPool,
+            connect_args={"check_same_thread": False}, **kwargs)
+
+def clone_to_memory(engine, pages=-1, progress=None, sessionmaker=None, **kwargs):
+    """ copy `engine`'s database into a new in-memory database.
+
+        :param engine: SQLite engine to copy (file or in-memory)
+        :param sessionmaker: (optional) must take `bind=engine`
+        :param kwargs: passed on to `create_engine` (e.g. `echo`)
+        :returns: (engine, session) for the copy, like
+                  :func:`~graphalchemy.sqlmodels.sqlite_connect`
+    """
+    sessionmaker = sessionmaker or orm.sessionmaker
+    clone = memory_engine(**kwargs)
+    _copy(engine, clone, pages, progress)
+    return clone, sessionmaker(bind=clone)()
+
+def restore(engine, source, pages=-1, progress=None):
+    """ replace the contents of `engine`'s database with a copy of `source`
+    (a path or another engine, e.g. from :func:`clone_to_memory`). Other
+    connections to `engine`'s database must not be writing meanwhile, and
+    sessions bound to it should be expired or closed afterwards.
+
+        :returns: `engine`
+    """
+    if isinstance(source, sqla.engine.base.Engine):
+        _copy(source, engine, pages, progress)
+        return engine
+    if not os.path.exists(source):
+        raise ValueError("Path does not exist: %s" % source)
+    source = sqla.create_engine("sqlite:///" + os.path.abspath(source))
+    try:
+        _copy(source, engine, pages, progress)
+    finally:
+        source.dispose()
+    return engine
+
+def _copy(source, target, pages, progress):
+    """ make `target`'s database a copy of `source`'s """
+    source_pooled, source_connection = _raw(source)
+    target_pooled, target_connection = _raw(target)
+    try:
+        if _has_backup(source_connection):
+            _backup(source_connection, target_connection, pages, progress)
+            return
+        path = _database_path(source)
+        temporary = None
+        if path is None:
+            # in-memory databases can't be attached from another connection
+            fd, temporary = tempfile.mkstemp(suffix=".db")
+            os.close(fd)
+            os.remove(temporary)
+            source_connection.commit()
+            source_connection.execute("VACUUM INTO ?", (temporary,))
+            path = temporary
+        try:
+            _attach_copy(target_connection, path)
+        finally:
+            if temporary:
+                os.remove(temporary)
+    finally:
+        source_pooled.close()
+        target_pooled.close()
+
+def _attach_copy(connection, path):
+    """ replace everything in `connection`'s main database with the schema
+    and rows of the database file at `path`, in one transaction """
+    isolation_level = connection.isolation_level
+    connection.commit()
+    connection.isolation_level = None
+    # tables are dropped and refilled in no particular order
+    foreign_keys = connection.execute("PRAGMA foreign_keys").fetchone()[0]
+    connection.execute("PRAGMA foreign_keys = OFF")
+    connection.execute("ATTACH DATABASE ? AS graphalchemy_source", (path,))
+    try:
+        connection.execute("BEGIN")
+        try:
+            _drop_everything(connection)
+            schema = connection.execute("SELECT type, name, sql FROM graphalchemy_source.sqlite_master "
+                    "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid").fetchall()
+            virtual = [name for kind, name, sql in schema
+                    if kind == "table" and sql.upper().startswith("CREATE VIRTUAL TABLE")]
+            for kind, name, sql in schema:
+                if kind == "table" and not _exists(connection, name):
+                    connection.execute(sql)
+            for kind, name, sql in schema:
+                if kind == "table" and name not in virtual:
+                    # OR REPLACE: shadow tables of virtual tables start with rows
+                    connection.execute('INSERT OR REPLACE INTO main."%s" SELECT * FROM '
+                            'graphalchemy_source."%s"' % (name, name))
+            # indexes and views, then triggers (which mustn't fire while copying)
+            for wanted in (("index", "view"), ("trigger",)):
+                for kind, name, sql in schema:
+                    if kind in wanted:
+                        connection.execute(sql)
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        connection.execute("DETACH DATABASE graphalchemy_source")
+        connection.execute("PRAGMA foreign_keys = %d" % foreign_keys)
+        connection.isolation_level = isolation_level
+
+def _exists(connection, name):
+    return connection.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+            (name,)).fetchone() is not None
+
+def _drop_everything(connection):
+    """ drop every view, trigger and table in the main database """
+    rows = connection.execute("SELECT type, name, sql FROM main.sqlite_master "
+            "WHERE type IN ('view', 'trigger', 'table') AND name NOT LIKE 'sqlite_%'").fetchall()
+    # virtual tables drop their own shadow tables
+    for kind, name, sql in sorted(rows, key=lambda row: not (row[2] or "").upper().startswith(
+            "CREATE VIRTUAL TABLE")):
+        if kind == "table" and not _exists(connection, name):
+            continue
+        connection.execute('DROP %s IF EXISTS main."%s"' % (kind.upper(), name))
+
+class Checkpointer(object):
+    """ periodically copies an in-memory working database to `dbpath`.
+
+    Checking happens after each commit of a session from `Session`: once
+    `commits` commits or `interval` seconds have passed since the last
+    checkpoint, the database is written to ``dbpath + ".checkpoint"``,
+    fsync'ed, and renamed over `dbpath`. Crash consistency: the rename is
+    atomic, so after a crash (even one in the middle of a checkpoint)
+    `dbpath` holds exactly the last completed checkpoint -- a consistent
+    database -- and every commit since then is lost. Nothing runs while the
+    process is idle; call :meth:`checkpoint` (or :meth:`close`) before
+    exiting to save the latest commits. A checkpoint that fails after a
+    commit (disk full, permissions...) is logged rather than raised from
+    `commit()`, whose in-memory commit did succeed; the commits stay
+    pending and the checkpoint is retried at the next commit.
+
+        :param engine: in-memory engine (see :func:`memory_engine`)
+        :param dbpath: file to keep up to date
+        :param Session: (optional) session class or sessionmaker whose
+                        commits are counted (default: every session)
+        :param int commits: (optional) checkpoint every `commits` commits
+        :param float interval: (optional) checkpoint after a commit once
+                               `interval` seconds have passed
+    """
+    def __init__(self, engine, dbpath, Session=orm.Session, commits=None, interval=None):
+        self.engine = engine
+        self.dbpath = os.path.abspath(dbpath)
+        self.commits = commits
+        self.interval = interval
+        self.pending = 0
+        self.checkpoints = 0
+        self.failures = 0
+        self.last = time.time()
+        self.active = True
+        sqla.event.listen(Session, "after_commit", self._after_commit)
+
+    def _after_commit(self, session):
+        if not self.active or session.bind is not self.engine:
+            return
+        self.pending += 1
+        if ((self.commits and self.pending >= self.commits) or
+                (self.interval is not None and time.time() - self.last >= self.interval)):
+            try:
+                self.checkpoint()
+            except Exception:
+                self.failures += 1
+                logger.exception("Checkpoint to %r failed, %d commits pending" %
+                        (self.dbpath, self.pending))
+
+    def checkpoint(self):
+        """ write the database to `dbpath` now (atomically) """
+        temporary = self.dbpath + ".checkpoint"
+        if os.path.exists(temporary):
+            # left over from a checkpoint that didn't complete
+            os.remove(temporary)
+        snapshot(self.engine, temporary)
+        with open(temporary, "rb+") as f:
+            os.fsync(f.fileno())
+        os.rename(temporary, self.dbpath)
+        _fsync_directory(os.path.dirname(self.dbpath))
+        logger.debug("Checkpointed %d commits to %r" % (self.pending, self.dbpath))
+        self.pending = 0
+        self.checkpoints += 1
+        self.last = time.time()
+
+    def close(self):
+        """ checkpoint anything pending and stop checkpointing """
+        if self.active and self.pending:
+            self.checkpoint()
+        self.active = False
+
+def _fsync_directory(path):
+    """ make a rename in directory `path` durable (where that's possible) """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,183 @@
+"""
+Bloom filters:
+
+    fast "does this edge already exist?" checks for ingest, where most
+    candidate edges are new. An :class:`EdgeIndex` keeps a Bloom filter
+    over (source_id, target_id) built from one scan of the edge table:
+    pairs the filter rules out are answered in memory, and only the
+    possible positives are looked up, in batches, on the source_id index::
+
+        >>> index = EdgeIndex(session, Edge)
+        >>> existing = index.existing(candidates)
+        >>> session.add_all([Edge(source_id=s, target_id=t)
+        ...     for s, t in candidates if (s, t) not in existing])
+        >>> session.flush()    # the new edges are added to the filter
+
+A Bloom filter has no false negatives, and every possible positive is
+checked against the database, so answers are always exact; deleted edges
+and rolled back flushes only leave bits set that cost an extra lookup.
+Edges written with set-based statements (`Edge.bulk_upsert`, the loaders
+in :mod:`graphalchemy.io`...) bypass the flush: pass them to :meth:`add`
+or call :meth:`rebuild`.
+"""
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("Must have NumPy installed to use bloom filters")
+import math
+import weakref
+import sqlalchemy as sqla
+import sqlalchemy.orm as orm
+from graphalchemy.traversal import chunked
+
+# candidate pairs per lookup statement (three bound parameters each)
+LOOKUP_CHUNKSIZE = 300
+
+_U32 = np.uint64(32)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+def _mix(z):
+    """ splitmix64 finalizer over a uint64 array """
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+class BloomFilter(object):
+    """ Bloom filter over pairs of non-negative integers (below 2 ** 32),
+    in a packed bit array, with double hashing for the `hashes` probes.
+
+        :param int capacity: number of pairs it's sized for
+        :param float error_rate: false positive rate at `capacity`
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(float(self.size) / capacity * math.log(2))), 1)
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, sources, targets):
+        keys = (np.asarray(sources, dtype=np.uint64) << _U32) ^ np.asarray(targets, dtype=np.uint64)
+        first = _mix(keys)
+        second = _mix(keys ^ _GOLDEN) | np.uint64(1)
+        size = np.uint64(self.size)
+        return [((first + np.uint64(i) * second) % size).astype(np.int64)
+                for i in range(self.hashes)]
+
+    def add(self, sources, targets):
+        """ add the pairs from parallel arrays `sources` and `targets` """
+        for positions in self._positions(sources, targets):
+            np.bitwise_or.at(self.bits, positions >> 3,
+                    (1 << (positions & 7)).astype(np.uint8))
+        self.count += len(sources)
+
+    def might_contain(self, sources, targets):
+        """ boolean array: False where a pair is certainly absent """
+        found = np.ones(len(sources), dtype=bool)
+        for positions in self._positions(sources, targets):
+            found &= ((self.bits[positions >> 3] >> (positions & 7)) & 1).astype(bool)
+        return found
+
+class EdgeIndex(object):
+    """ exact edge-existence checks for many (source_id, target_id) pairs,
+    with a :class:`BloomFilter` in front of the edge table. New edges are
+    added to the filter after every flush of a `target` session; once the
+    filter holds more than its capacity it is rebuilt twice the size. Pairs
+    flushed in transactions that haven't committed yet are kept aside and
+    added back after the rebuild, since its scan can't see them.
+    With `undirected` edge classes, pairs are compared in canonical order.
+
+        :param session: SQLAlchemy session for the scan and lookups
+        :param Edge: mapped edge class
+        :param float error_rate: false positive rate to size the filter for
+        :param target: session class, sessionmaker or session whose flushes
+                       update the filter (default: every session)
+    """
+    def __init__(self, session, Edge, error_rate=0.01, target=orm.Session, chunk=100000):
+        self.session = session
+        self.Edge = Edge
+        self.error_rate = error_rate
+        self.chunk = chunk
+        self.undirected = getattr(Edge, "undirected", False)
+        # pairs answered without (or with) a database lookup
+        self.negatives = 0
+        self.lookups = 0
+        self.active = True
+        # pairs flushed in each session's open transaction
+        self.uncommitted = weakref.WeakKeyDictionary()
+        self.rebuild()
+        sqla.event.listen(target, "after_flush", self._after_flush)
+        sqla.event.listen(target, "after_commit", self._after_commit)
+
+    def rebuild(self, capacity=None):
+        """ rebuild the filter from one scan of the edge table """
+        table = self.Edge.__table__
+        if capacity is None:
+            capacity = 2 * self.session.execute(sqla.select([sqla.func.count()],
+                from_obj=[table])).scalar()
+        self.filter = BloomFilter(max(capacity, 1024), self.error_rate)
+        result = self.session.execute(sqla.select([table.c.source_id, table.c.target_id]))
+        for rows in iter(lambda: result.fetchmany(self.chunk), []):
+            self.filter.add(*zip(*rows))
+        for pairs in list(self.uncommitted.values()):
+            self.filter.add(*zip(*pairs))
+
+    def _canonical(self, pairs):
+        if self.undirected:
+            return [(min(s, t), max(s, t)) for s, t in pairs]
+        return [tuple(pair) for pair in pairs]
+
+    def add(self, pairs):
+        """ add (source_id, target_id) pairs written behind the session's
+        back to the filter """
+        pairs = self._canonical(pairs)
+        if self.filter.count + len(pairs) > self.filter.capacity:
+            self.rebuild(2 * (self.filter.count + len(pairs)))
+        if pairs:
+            self.filter.add(*zip(*pairs))
+
+    def close(self):
+        """ stop following flushes """
+        self.active = False
+        self.uncommitted.clear()
+
+    def _after_flush(self, session, flush_context):
+        if not self.active:
+            return
+        pairs = [(obj.source_id, obj.target_id) for obj in list(session.new) + list(session.dirty)
+                if isinstance(obj, self.Edge)]
+        if pairs:
+            self.add(pairs)
+            self.uncommitted.setdefault(session, []).extend(self._canonical(pairs))
+
+    def _after_commit(self, session):
+        # releasing a savepoint commits nothing yet; rolled back pairs are
+        # kept until the next commit, which only costs lookups
+        if session.transaction is None or not session.transaction.nested:
+            self.uncommitted.pop(session, None)
+
+    def existing(self, pairs):
+        """ set of the (source_id, target_id) pairs in `pairs` that are
+        edges, looking up only those the filter can't rule out """
+        pairs = set(self._canonical(pairs))
+        if not pairs:
+            return set()
+        ordered = list(pairs)
+        maybe = self.filter.might_contain(*zip(*ordered))
+        candidates = [pair for pair, hit in zip(ordered, maybe) if hit]
+        self.negatives += len(ordered) - len(candidates)
+        self.lookups += len(candidates)
+        table = self.Edge.__table__
+        found = set()
+        for chunk in chunked(candidates, LOOKUP_CHUNKSIZE):
+            # the IN on source_id lets SQLite seek its index
+            query = sqla.select([table.c.source_id, table.c.target_id], sqla.and_(
+                table.c.source_id.in_(set(s for s, t in chunk)),
+                sqla.tuple_(table.c.source_id, table.c.target_id).in_(chunk))).distinct()
+            found.update(tuple(row) for row in self.session.execute(query))
+        return found
+
+    def __contains__(self, pair):
+        return bool(self.existing([pair]))
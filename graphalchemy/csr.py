@@ -0,0 +1,138 @@
+"""
+CSR snapshots:
+
+    read-only, array-backed copies of a graph (compressed sparse row, as in
+    scipy.sparse) built from *one* scan of the node table and one scan of the
+    edge table. Whole-graph algorithms run against these instead of issuing a
+    query per node.
+
+Nodes are numbered by *position* 0..n-1 in order of node id; `ids` maps
+positions back to node ids, and the neighbors of position `p` are
+``indices[indptr[p]:indptr[p + 1]]`` (positions too, sorted).
+"""
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("Must have NumPy installed to use csr snapshots")
+import sqlalchemy as sqla
+from graphalchemy.traversal import check_direction
+
+class CSRGraph(object):
+    """ compressed sparse row adjacency over node positions.
+
+        :param ids: sorted array of node ids (position -> id)
+        :param indptr: array of n + 1 offsets into `indices`
+        :param indices: neighbor positions, sorted within each node
+        :param weights: (optional) edge weights parallel to `indices`
+        :param edge_ids: (optional) id of the edge behind each entry of `indices`
+    """
+    def __init__(self, ids, indptr, indices, weights=None, edge_ids=None):
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.edge_ids = edge_ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    def degree(self):
+        """ array of out-degrees by position """
+        return np.diff(self.indptr)
+
+    def positions(self, node_ids):
+        """ positions for an array of node ids, raising KeyError for unknown ids """
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if not len(self.ids):
+            if len(node_ids):
+                raise KeyError("Unknown node ids: %r" % (node_ids[:10].tolist(),))
+            return node_ids
+        found = np.searchsorted(self.ids, node_ids)
+        found[found >= len(self.ids)] = 0
+        if len(node_ids) and (self.ids[found] != node_ids).any():
+            missing = node_ids[self.ids[found] != node_ids]
+            raise KeyError("Unknown node ids: %r" % (missing[:10].tolist(),))
+        return found
+
+    def neighbors(self, position):
+        """ neighbor positions of the node at `position` """
+        return self.indices[self.indptr[position]:self.indptr[position + 1]]
+
+    def sources(self):
+        """ source position of every entry in `indices` """
+        return np.repeat(np.arange(len(self.ids), dtype=np.int64), self.degree())
+
+    @classmethod
+    def from_arrays(cls, ids, sources, targets, weights=None, direction="out", simple=False,
+            edge_ids=None):
+        """ build from parallel arrays of source and target *ids* (and
+        optionally `weights` and `edge_ids`).
+
+            :param direction: 'out' keeps edges as they are, 'in' reverses
+                              them, 'both' stores each edge both ways round
+            :param bool simple: drop self loops and parallel edges (keeping
+                                the first weight), e.g. for undirected algorithms
+        """
+        check_direction(direction)
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        snapshot = cls(ids, None, None)
+        sources = snapshot.positions(sources)
+        targets = snapshot.positions(targets)
+        # per-entry arrays that follow the edges around
+        extras = [weights if weights is None else np.asarray(weights, dtype=np.float64),
+                edge_ids if edge_ids is None else np.asarray(edge_ids, dtype=np.int64)]
+        if direction == "in":
+            sources, targets = targets, sources
+        elif direction == "both":
+            sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+            extras = [e if e is None else np.concatenate([e, e]) for e in extras]
+        order = np.lexsort((targets, sources))
+        sources, targets = sources[order], targets[order]
+        extras = [e if e is None else e[order] for e in extras]
+        if simple:
+            keep = sources != targets
+            keep[1:] &= (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+            sources, targets = sources[keep], targets[keep]
+            extras = [e if e is None else e[keep] for e in extras]
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(ids)), out=indptr[1:])
+        return cls(ids, indptr, targets, *extras)
+
+    @classmethod
+    def from_session(cls, session, Node, Edge, direction="out", weighted=False,
+            default_weight=1.0, simple=False, chunk=100000):
+        """ snapshot the whole graph: one scan of the node ids, one of the edges.
+
+            :param session: SQLAlchemy session (or anything with `execute`)
+            :param Node: mapped node class
+            :param Edge: mapped edge class
+            :param bool weighted: also load `weight` (NULL -> `default_weight`)
+            :param int chunk: rows fetched per round trip
+
+        See :meth:`from_arrays` for `direction` and `simple`.
+        """
+        nodes = Node.__table__
+        edges = Edge.__table__
+        ids = _fetch_columns(session, sqla.select([nodes.c.id]), 1, chunk)[0]
+        columns = [edges.c.source_id, edges.c.target_id]
+        if weighted:
+            columns.append(edges.c.weight)
+        fetched = _fetch_columns(session, sqla.select(columns), len(columns), chunk)
+        weights = None
+        if weighted:
+            weights = np.array([default_weight if w is None else w for w in fetched[2]],
+                    dtype=np.float64)
+        return cls.from_arrays(ids, fetched[0], fetched[1], weights, direction, simple)
+
+def _fetch_columns(session, query, width, chunk):
+    """ run `query` and return one list per column """
+    result = session.execute(query)
+    columns = [[] for _ in range(width)]
+    for rows in iter(lambda: result.fetchmany(chunk), []):
+        for i, values in enumerate(zip(*rows)):
+            columns[i].extend(values)
+    return columns
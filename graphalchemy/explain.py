@@ -0,0 +1,141 @@
+"""
+Explain:
+
+    check that the queries graphalchemy emits still use the indexes, by
+    running SQLite's ``EXPLAIN QUERY PLAN`` on each query shape against a
+    real database and flagging every full scan of the edge table (or of
+    the node table it's joined to), including automatic indexes built from
+    one, and every search of one of their indexes constrained only by a
+    range. Use it interactively::
+
+        >>> print(report(check_queries(engine, Node, Edge)))
+
+    or as a test assertion, so a schema change that drops an index fails
+    loudly instead of slowing traversals down::
+
+        >>> assert_indexed(engine, Node, Edge)
+
+The shapes are the relationship lazy loads (`out_edges`/`in_edges`), the
+frontier expansion behind :func:`~graphalchemy.traversal.expand_frontier`
+and :func:`~graphalchemy.traversal.k_hop` (plain, and joined to the node
+table for `where=` filters), the adjacency lists behind
+:func:`~graphalchemy.traversal.dijkstra`, and per-node degree counts.
+Pass a :func:`~graphalchemy.traversal.scoped` edge class to check the
+shapes scoped helpers run (e.g. one graph of a `multi_graph` schema).
+"""
+import collections
+import re
+import sqlalchemy as sqla
+import sqlalchemy.orm as orm
+from graphalchemy.traversal import _frontier_queries, _adjacency_queries
+
+# ids bound into the sample queries (the values don't change the plan)
+SAMPLE_IDS = [1, 2, 3]
+_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+_SEARCH = re.compile(r"^SEARCH (?:TABLE )?(\w+) USING (?:COVERING )?INDEX \w+ \(([^)]*)\)")
+# SQLite built a transient index, reading the whole table, for one query
+_AUTOMATIC = re.compile(r"^SEARCH (?:TABLE )?(\w+) USING AUTOMATIC ")
+
+class QueryPlan(collections.namedtuple("QueryPlan", ["name", "sql", "details", "scans"])):
+    """ the plan of one query: `details` are the lines of ``EXPLAIN QUERY
+    PLAN``, `scans` the ones that read a whole table (or index) of interest,
+    including index searches constrained only by a range (e.g.
+    ``(source_id>?)``), which can read the whole index, and searches of an
+    AUTOMATIC index, which SQLite builds from a full scan.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return not self.scans
+
+def _connection(bind):
+    if isinstance(bind, orm.Session):
+        return bind.connection()
+    return bind
+
+def explain(bind, query, name=None, tables=()):
+    """ run ``EXPLAIN QUERY PLAN`` for `query`.
+
+        :param bind: engine, connection or session on a SQLite database
+        :param query: SQLAlchemy select (its bound values are used) or SQL string
+        :param name: (optional) name for the :class:`QueryPlan`
+        :param tables: names of the tables whose full scans are flagged
+        :returns: :class:`QueryPlan`
+    """
+    connection = _connection(bind)
+    if isinstance(query, sqla.sql.expression.ClauseElement):
+        compiled = query.compile(dialect=connection.dialect)
+        sql = str(compiled)
+        params = [compiled.params[key] for key in compiled.positiontup]
+    else:
+        sql, params = query, []
+    rows = connection.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    details = [tuple(row)[-1] for row in rows]
+    scans = []
+    for detail in details:
+        found = _SCAN.match(detail) or _AUTOMATIC.match(detail)
+        if found and found.group(1) in tables:
+            scans.append(detail)
+            continue
+        found = _SEARCH.match(detail)
+        if found and found.group(1) in tables and "=" not in found.group(2):
+            scans.append(detail)
+    return QueryPlan(name, sql, details, scans)
+
+def query_shapes(Node, Edge, direction="both"):
+    """ list of (name, select) for the queries graphalchemy runs against
+    the edge table of `Node`/`Edge`, with :data:`SAMPLE_IDS` bound.
+
+        :param Node: mapped node class
+        :param Edge: mapped edge class, or a :func:`scoped` one
+        :param direction: 'out', 'in' or 'both'
+    """
+    table = Edge.__table__
+    ends = [end for end in ("out", "in") if direction in (end, "both")]
+    shapes = []
+    # lazy loads of the relationships go through the mapped class
+    mapped = getattr(Edge, "mapped", Edge)
+    sample = Node(id=SAMPLE_IDS[0])
+    if getattr(Node, "multi_graph", False):
+        sample.graph_id = 1
+    for end in ends:
+        relationship = "out_edges" if end == "out" else "in_edges"
+        shapes.append(("lazy_%s" % relationship,
+            orm.Query(mapped).with_parent(sample, relationship).statement))
+    for end, query in zip(ends, _frontier_queries(table, SAMPLE_IDS, direction)):
+        shapes.append(("frontier_%s" % end, query))
+    # a where= filter on the neighbors. It mustn't constrain the id, which
+    # SQLite would carry over to the edge table's far end as a range
+    where = Node.__table__.c.label == u"x"
+    for end, query in zip(ends, _frontier_queries(table, SAMPLE_IDS, direction, Node, where)):
+        shapes.append(("frontier_%s_where" % end, query))
+    for end, query in zip(ends, _adjacency_queries(table, SAMPLE_IDS, direction)):
+        shapes.append(("adjacency_%s" % end, query))
+    for end in ends:
+        column = table.c.source_id if end == "out" else table.c.target_id
+        shapes.append(("degree_%s" % end, sqla.select([column, sqla.func.count()],
+            column.in_(SAMPLE_IDS)).group_by(column)))
+    return shapes
+
+def check_queries(bind, Node, Edge, direction="both"):
+    """ :class:`QueryPlan` of every shape in :func:`query_shapes`, with full
+    scans of the edge table (or of the node table, which the `where` shapes
+    join to) flagged """
+    tables = set([getattr(Edge, "mapped", Edge).__table__.name, Node.__table__.name])
+    return [explain(bind, query, name, tables) for name, query in query_shapes(Node, Edge, direction)]
+
+def report(plans):
+    """ readable summary of a list of :class:`QueryPlan` """
+    lines = []
+    for plan in plans:
+        lines.append("%s %s" % ("ok  " if plan.ok else "SCAN", plan.name))
+        lines.extend("        %s" % detail for detail in plan.details)
+    return "\n".join(lines)
+
+def assert_indexed(bind, Node, Edge, direction="both"):
+    """ raise AssertionError (with a :func:`report` of the offending plans)
+    if any query shape scans the edge (or node) table """
+    bad = [plan for plan in check_queries(bind, Node, Edge, direction) if not plan.ok]
+    if bad:
+        raise AssertionError("Queries scan the edge or node table:\n" + report(bad))
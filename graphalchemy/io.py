@@ -0,0 +1,440 @@
+"""
+Reading and writing graphs in bulk:
+
+    streaming import of delimited edge lists into, and streaming GEXF/GraphML
+    export (e.g. for gephi) out of, the tables of classes created with
+    :func:`graphalchemy.sqlmodels.create_base_classes`.
+
+    Everything here goes through SQLAlchemy Core with executemany, a chunk
+    at a time, so memory stays constant however large the input is.
+"""
+import csv
+import itertools
+import logging
+import re
+import sys
+import uuid
+from xml.sax.saxutils import escape
+import sqlalchemy as sqla
+from graphalchemy.traversal import chunked
+from graphalchemy.sqlmodels import _check_merge
+logger = logging.getLogger("graphalchemy")
+
+checkpoint_metadata = sqla.MetaData()
+checkpoints = sqla.Table("graphalchemy_checkpoints", checkpoint_metadata,
+        sqla.Column("name", sqla.Unicode, primary_key=True),
+        sqla.Column("position", sqla.Integer, nullable=False))
+
+def _open(path_or_file):
+    """ returns (file, should_close) for a path or an already open file """
+    if hasattr(path_or_file, "read"):
+        return path_or_file, False
+    if sys.version_info[0] < 3:
+        return open(path_or_file, "rb"), True
+    return open(path_or_file, newline=""), True
+
+def _text(value, encoding):
+    if isinstance(value, bytes):
+        value = value.decode(encoding)
+    return value
+
+class KeyMap(object):
+    """ maps external keys to node ids. Holds up to `max_keys` keys in memory
+    and spills everything into a scratch table (indexed by key) when that
+    fills up, so lookups for a whole chunk stay a single indexed select.
+
+        :param session: session to run the scratch-table queries on
+        :param name: name of the scratch table (dropped and recreated here)
+        :param int max_keys: maximum number of keys to keep in memory
+    """
+    def __init__(self, session, name, max_keys=1000000):
+        self.session = session
+        self.max_keys = max_keys
+        self.memory = {}
+        self.table = sqla.Table(name, sqla.MetaData(),
+                sqla.Column("key", sqla.Unicode, primary_key=True),
+                sqla.Column("id", sqla.Integer, nullable=False))
+        self.table.drop(bind=session.connection(), checkfirst=True)
+        self.table.create(bind=session.connection())
+        self.spilled = False
+
+    def __len__(self):
+        return len(self.memory)
+
+    def add(self, mapping):
+        """ add a dict of {key: id} """
+        self.memory.update(mapping)
+        if len(self.memory) > self.max_keys:
+            self.spill()
+
+    def spill(self):
+        """ move every in-memory key into the scratch table """
+        if self.memory:
+            logger.debug("Spilling %d keys to %s" % (len(self.memory), self.table.name))
+            self.session.execute(self.table.insert().prefix_with("OR REPLACE"),
+                    [dict(key=k, id=v) for k, v in self.memory.items()])
+            self.memory.clear()
+            self.spilled = True
+
+    def lookup(self, keys):
+        """ returns a dict of {key: id} for every key in `keys` that is known """
+        found = {}
+        missing = []
+        for key in keys:
+            if key in self.memory:
+                found[key] = self.memory[key]
+            else:
+                missing.append(key)
+        if self.spilled:
+            table = self.table
+            for chunk in chunked(missing):
+                query = sqla.select([table.c.key, table.c.id], table.c.key.in_(chunk))
+                found.update(self.session.execute(query).fetchall())
+        return found
+
+    def drop(self):
+        """ drop the scratch table and forget everything """
+        self.memory.clear()
+        self.table.drop(bind=self.session.connection(), checkfirst=True)
+
+def load_edgelist(path_or_file, session, Node, Edge, chunk=10000, delimiter=",",
+        header=False, key_column="label", max_keys=1000000, checkpoint=None,
+        encoding="utf-8", merge="sum"):
+    """ stream an edge list of `src,dst[,weight[,label]]` lines into the
+    database, committing every `chunk` lines.
+
+    Nodes are identified by an external key (`src`/`dst`) stored in the
+    `key_column` attribute of `Node` (`label` by default). Nodes already in
+    the table are matched by that column, and unseen keys become new nodes on
+    the fly. Keys that don't fit in memory (`max_keys`) are spilled to a
+    scratch table named `<node table>_keymap_<random suffix>`, so loads
+    running at the same time each get their own; it's dropped afterwards,
+    whether the load succeeds or fails.
+
+    Parameters:
+
+        :param path_or_file: path to the edge list, or an open file
+        :param session: SQLAlchemy session to load with (will be committed!)
+        :param Node: mapped node class
+        :param Edge: mapped edge class
+        :param int chunk: number of lines per transaction
+        :param delimiter: field separator
+        :param bool header: whether the first line is a header to skip
+        :param key_column: Node attribute holding the external key (should be unique)
+        :param int max_keys: maximum number of keys held in memory
+        :param checkpoint: (optional) name to record progress under. Progress
+                           is stored in the `graphalchemy_checkpoints` table in
+                           the same transaction as each chunk, so rerunning
+                           with the same name resumes after the last committed
+                           chunk.
+        :param encoding: encoding of keys and labels in the file
+        :param merge: with `unique_edges`, edges are loaded with
+                      :meth:`Edge.bulk_upsert`, and `merge` says how the
+                      weight of an edge that's already there is merged
+                      ('sum', 'max' or 'replace')
+
+    NOTE: new node ids are assigned from `max(id) + 1`, so nothing else may
+    insert nodes while this runs.
+
+    Returns:
+
+        :returns: (nodes_created, edges_created); with `unique_edges`,
+                  edges_created counts the lines, merged or not
+
+    """
+    if getattr(Edge, "unique_edges", False):
+        _check_merge(merge)
+    node_table = Node.__table__
+    key_col = node_table.c[key_column]
+    session.commit()
+    keymap = KeyMap(session, "%s_keymap_%s" % (node_table.name, uuid.uuid4().hex[:12]),
+            max_keys=max_keys)
+    try:
+        # pick up nodes that already exist (from earlier or interrupted runs)
+        existing = session.execute(sqla.select([key_col, node_table.c.id], key_col != None))
+        for rows in iter(lambda: existing.fetchmany(chunk), []):
+            keymap.add(dict(rows))
+        next_id = (session.execute(sqla.select([sqla.func.max(node_table.c.id)])).scalar() or 0) + 1
+        position = 0
+        if checkpoint is not None:
+            checkpoint = _text(checkpoint, encoding)
+            position = _start_checkpoint(session, checkpoint)
+        f, should_close = _open(path_or_file)
+        try:
+            reader = csv.reader(f, delimiter=delimiter)
+            if header:
+                next(reader, None)
+            # skip whatever an earlier run already committed
+            for row in itertools.islice(reader, position):
+                pass
+            nodes_created = edges_created = 0
+            rows = []
+            for row in reader:
+                rows.append(row)
+                if len(rows) >= chunk:
+                    n, e = _load_chunk(session, rows, keymap, next_id, node_table,
+                            Edge, key_column, encoding, merge)
+                    next_id += n
+                    nodes_created += n
+                    edges_created += e
+                    position += len(rows)
+                    _commit_chunk(session, checkpoint, position)
+                    rows = []
+            n, e = _load_chunk(session, rows, keymap, next_id, node_table,
+                    Edge, key_column, encoding, merge)
+            nodes_created += n
+            edges_created += e
+            position += len(rows)
+            _commit_chunk(session, checkpoint, position)
+        finally:
+            if should_close:
+                f.close()
+    except:
+        session.rollback()
+        raise
+    finally:
+        keymap.drop()
+        session.commit()
+    return nodes_created, edges_created
+
+def _start_checkpoint(session, checkpoint):
+    """ returns the number of lines already loaded under `checkpoint` """
+    checkpoints.create(bind=session.connection(), checkfirst=True)
+    position = session.execute(sqla.select([checkpoints.c.position],
+        checkpoints.c.name == checkpoint)).scalar()
+    if position is None:
+        session.execute(checkpoints.insert(), dict(name=checkpoint, position=0))
+        return 0
+    logger.info("Resuming %r after line %d" % (checkpoint, position))
+    return position
+
+def _commit_chunk(session, checkpoint, position):
+    if checkpoint is not None:
+        session.execute(checkpoints.update().where(checkpoints.c.name == checkpoint),
+                dict(position=position))
+    session.commit()
+
+def _load_chunk(session, rows, keymap, next_id, node_table, Edge, key_column, encoding, merge):
+    """ insert the nodes and edges for one chunk of rows, returns
+    (nodes_created, edges_created) """
+    edges = []
+    for row in rows:
+        if not row:
+            continue
+        if len(row) < 2:
+            raise ValueError("Edge list lines need at least a source and target: %r" % (row,))
+        weight = row[2] if len(row) > 2 and row[2] != "" else None
+        label = _text(row[3], encoding) if len(row) > 3 and row[3] != "" else None
+        edges.append((_text(row[0], encoding), _text(row[1], encoding),
+            weight and float(weight), label))
+    if not edges:
+        return 0, 0
+    keys = set(e[0] for e in edges)
+    keys.update(e[1] for e in edges)
+    ids = keymap.lookup(keys)
+    new = {}
+    for key in sorted(keys.difference(ids)):
+        new[key] = next_id
+        next_id += 1
+    if new:
+        session.execute(node_table.insert(),
+                [{"id": i, key_column: k} for k, i in new.items()])
+        ids.update(new)
+        keymap.add(new)
+    ends = [(ids[s], ids[t]) for s, t, w, l in edges]
+    if getattr(Edge, "undirected", False):
+        # stored low id first, as the CHECK constraint requires
+        ends = [(min(pair), max(pair)) for pair in ends]
+    rows = [dict(source_id=s, target_id=t, weight=w, label=l)
+            for (s, t), (_, _, w, l) in zip(ends, edges)]
+    if getattr(Edge, "unique_edges", False):
+        # re-sent edges are merged instead of breaking the unique index
+        Edge.bulk_upsert(session, rows, merge)
+    else:
+        session.execute(Edge.__table__.insert(), rows)
+    return len(new), len(edges)
+
+def _open_output(path_or_file):
+    """ returns (file, should_close) for a path or an already open file """
+    if hasattr(path_or_file, "write"):
+        return path_or_file, False
+    return open(path_or_file, "wb"), True
+
+def _iter_chunks(session, query, chunk):
+    """ generator of lists of at most `chunk` rows from `query`, streamed
+    from the cursor (server-side where the driver supports it) """
+    result = session.execute(query.execution_options(stream_results=True))
+    for rows in iter(lambda: result.fetchmany(chunk), []):
+        yield rows
+
+# characters XML 1.0 doesn't allow at all, not even as character references
+# (surrogates only on wide builds, where they can't be half of a pair)
+_INVALID_XML = re.compile(u"[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff%s]"
+        % (u"\ud800-\udfff" if sys.maxunicode > 0xffff else u""))
+
+def _xml_text(value):
+    """ text of `value`, without invalid characters, escaped for XML """
+    return escape(_INVALID_XML.sub(u"", u"%s" % value))
+
+def _quote(value):
+    """ text of `value`, escaped for use inside a double-quoted attribute """
+    return _xml_text(value).replace(u'"', u"&quot;")
+
+def _rgb(color):
+    """ (r, g, b) for a '#rrggbb'/'rrggbb' color, None for anything else """
+    color = color.lstrip("#")
+    if len(color) == 6:
+        try:
+            return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+        except ValueError:
+            pass
+    return None
+
+GEXF_HEADER = u"""<?xml version="1.0" encoding="%(encoding)s"?>
+<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:viz="http://www.gexf.net/1.2draft/viz" version="1.2">
+  <graph defaultedgetype="%(edgetype)s" mode="static">
+    <attributes class="node">
+      <attribute id="color" title="color" type="string"/>
+    </attributes>
+    <attributes class="edge">
+      <attribute id="color" title="color" type="string"/>
+    </attributes>
+    <nodes>
+"""
+GEXF_MIDDLE = u"""    </nodes>
+    <edges>
+"""
+GEXF_FOOTER = u"""    </edges>
+  </graph>
+</gexf>
+"""
+
+def _gexf_viz(color, size, size_tag):
+    """ the attvalues and viz elements shared by nodes and edges """
+    parts = []
+    if color is not None:
+        parts.append(u'<attvalues><attvalue for="color" value="%s"/></attvalues>' % _quote(color))
+        rgb = _rgb(color)
+        if rgb:
+            parts.append(u'<viz:color r="%d" g="%d" b="%d"/>' % rgb)
+    if size is not None:
+        parts.append(u'<viz:%s value="%r"/>' % (size_tag, float(size)))
+    return u"".join(parts)
+
+def _gexf_node(row):
+    node_id, label, size, color = row
+    label = u' label="%s"' % _quote(label) if label is not None else u""
+    inner = _gexf_viz(color, size, "size")
+    if inner:
+        return u'      <node id="%d"%s>%s</node>\n' % (node_id, label, inner)
+    return u'      <node id="%d"%s/>\n' % (node_id, label)
+
+def _gexf_edge(row):
+    edge_id, source_id, target_id, label, weight, size, color, directed = row
+    attrs = [u'id="%d" source="%d" target="%d"' % (edge_id, source_id, target_id)]
+    if label is not None:
+        attrs.append(u'label="%s"' % _quote(label))
+    if weight is not None:
+        attrs.append(u'weight="%r"' % float(weight))
+    if directed is not None:
+        attrs.append(u'type="%s"' % (u"directed" if directed else u"undirected"))
+    inner = _gexf_viz(color, size, "thickness")
+    if inner:
+        return u"      <edge %s>%s</edge>\n" % (u" ".join(attrs), inner)
+    return u"      <edge %s/>\n" % u" ".join(attrs)
+
+GRAPHML_HEADER = u"""<?xml version="1.0" encoding="%(encoding)s"?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns">
+  <key id="label" for="node" attr.name="label" attr.type="string"/>
+  <key id="size" for="node" attr.name="size" attr.type="double"/>
+  <key id="color" for="node" attr.name="color" attr.type="string"/>
+  <key id="e_label" for="edge" attr.name="label" attr.type="string"/>
+  <key id="e_weight" for="edge" attr.name="weight" attr.type="double"/>
+  <key id="e_size" for="edge" attr.name="size" attr.type="double"/>
+  <key id="e_color" for="edge" attr.name="color" attr.type="string"/>
+  <graph edgedefault="%(edgetype)s">
+"""
+GRAPHML_FOOTER = u"""  </graph>
+</graphml>
+"""
+
+def _graphml_data(pairs):
+    return u"".join(u'<data key="%s">%s</data>' % (key, _xml_text(value))
+            for key, value in pairs if value is not None)
+
+def _graphml_node(row):
+    node_id, label, size, color = row
+    data = _graphml_data([("label", label), ("size", size), ("color", color)])
+    if data:
+        return u'    <node id="n%d">%s</node>\n' % (node_id, data)
+    return u'    <node id="n%d"/>\n' % node_id
+
+def _graphml_edge(row):
+    edge_id, source_id, target_id, label, weight, size, color, directed = row
+    directed = u' directed="%s"' % (u"true" if directed else u"false") if directed is not None else u""
+    data = _graphml_data([("e_label", label), ("e_weight", weight), ("e_size", size), ("e_color", color)])
+    start = u'    <edge id="e%d" source="n%d" target="n%d"%s' % (edge_id, source_id, target_id, directed)
+    if data:
+        return u"%s>%s</edge>\n" % (start, data)
+    return start + u"/>\n"
+
+def _write_xml(session, Node, Edge, fp, chunk, encoding, header, middle, footer,
+        format_node, format_edge):
+    """ streams nodes then edges through the formatters, writing one chunk
+    of rows at a time. returns (nodes_written, edges_written) """
+    nodes = Node.__table__.c
+    edges = Edge.__table__.c
+    out, should_close = _open_output(fp)
+    counts = [0, 0]
+    try:
+        edgetype = "undirected" if getattr(Edge, "undirected", False) else "directed"
+        out.write((header % dict(encoding=encoding, edgetype=edgetype)).encode(encoding))
+        queries = [
+            (sqla.select([nodes.id, nodes.label, nodes.size, nodes.color]), format_node),
+            (sqla.select([edges.id, edges.source_id, edges.target_id, edges.label,
+                edges.weight, edges.size, edges.color, edges.directed]), format_edge)]
+        for i, (query, format_row) in enumerate(queries):
+            for rows in _iter_chunks(session, query, chunk):
+                out.write(u"".join(map(format_row, rows)).encode(encoding, "xmlcharrefreplace"))
+                counts[i] += len(rows)
+            if i == 0:
+                out.write(middle.encode(encoding))
+        out.write(footer.encode(encoding))
+    finally:
+        if should_close:
+            out.close()
+    return tuple(counts)
+
+def write_gexf(session, Node, Edge, fp, chunk=10000, encoding="utf-8"):
+    """ stream the whole graph to `fp` as GEXF 1.2 (gephi's native format).
+
+    Rows are fetched `chunk` at a time and written as they come, so memory
+    stays bounded by the chunk size. `label` and `weight` become GEXF
+    attributes, `size` becomes `viz:size` (`viz:thickness` for edges), and
+    `color` is kept as a string attribute (plus `viz:color` when it is a hex
+    color like `#ff8800`). Edges with `directed` set get an explicit `type`;
+    the default is undirected for `undirected` edge classes.
+
+    Parameters:
+
+        :param session: SQLAlchemy session (or anything with `execute`)
+        :param Node: mapped node class
+        :param Edge: mapped edge class
+        :param fp: path or file opened in *binary* mode
+        :param int chunk: number of rows to fetch and write at a time
+        :param encoding: output encoding
+
+    Returns:
+
+        :returns: (nodes_written, edges_written)
+
+    """
+    return _write_xml(session, Node, Edge, fp, chunk, encoding,
+            GEXF_HEADER, GEXF_MIDDLE, GEXF_FOOTER, _gexf_node, _gexf_edge)
+
+def write_graphml(session, Node, Edge, fp, chunk=10000, encoding="utf-8"):
+    """ stream the whole graph to `fp` as GraphML. Same parameters and return
+    value as :func:`write_gexf`. Node ids are written as `n<id>` and edge ids
+    as `e<id>`; label, size, color and weight become `<data>` elements. """
+    return _write_xml(session, Node, Edge, fp, chunk, encoding,
+            GRAPHML_HEADER, u"", GRAPHML_FOOTER, _graphml_node, _graphml_edge)
@@ -0,0 +1,344 @@
+"""
+Live graphs:
+
+    keep an in-memory copy of the graph current without rebuilding it.
+    A :class:`ChangeFeed` listens to SQLAlchemy's session events and, when a
+    transaction commits, publishes the node and edge inserts, updates and
+    deletes it flushed. A :class:`LiveGraph` loads the graph once and then
+    applies those changes to a target at O(changes) cost: a networkx graph
+    (:class:`NetworkXTarget`) or a CSR snapshot with a delta buffer
+    (:class:`DeltaCSR`). Example::
+
+        >>> feed = ChangeFeed(Node, Edge)
+        >>> live = LiveGraph(feed, session, NetworkXTarget(nx.MultiDiGraph()))
+        >>> ...  # commits from any session now show up in live.target.graph
+
+Only changes that go through the ORM flush are seen. Set-based statements
+(`Query.delete`, :meth:`Node.bulk_delete`, :meth:`Edge.bulk_upsert`, the
+loaders in :mod:`graphalchemy.io`...) and other processes bypass it: call
+:meth:`LiveGraph.reload` after those.
+"""
+import collections
+import logging
+import threading
+import weakref
+import sqlalchemy as sqla
+import sqlalchemy.orm as orm
+logger = logging.getLogger("graphalchemy")
+
+class Change(collections.namedtuple("Change", ["op", "kind", "id", "values"])):
+    """ one committed change: `op` is 'insert', 'update' or 'delete', `kind`
+    is 'node' or 'edge', and `values` maps column names to the row's values
+    (the last values known to the session, for deletes). """
+    __slots__ = ()
+
+def _values(obj, load=True):
+    """ {column attribute: value} for `obj`, loading expired attributes if
+    `load` (otherwise only what's in memory) """
+    state = orm.attributes.instance_state(obj)
+    keys = [prop.key for prop in orm.object_mapper(obj).iterate_properties
+            if isinstance(prop, orm.ColumnProperty)]
+    if load:
+        return dict((key, getattr(obj, key)) for key in keys)
+    return dict((key, state.dict.get(key)) for key in keys)
+
+class ChangeFeed(object):
+    """ in-process stream of committed node/edge changes, fed by the
+    `after_flush` / `after_commit` / `after_soft_rollback` events of
+    `target`. Changes flushed in a transaction that is rolled back are
+    dropped.
+
+        :param Node: mapped node class
+        :param Edge: mapped edge class
+        :param target: session class, sessionmaker or session to listen to
+                       (default: every session)
+    """
+    def __init__(self, Node, Edge, target=orm.Session):
+        self.Node = Node
+        self.Edge = Edge
+        self.subscribers = []
+        self.active = True
+        # flushed but uncommitted changes, per session
+        self.pending = weakref.WeakKeyDictionary()
+        sqla.event.listen(target, "after_flush", self._after_flush)
+        sqla.event.listen(target, "after_commit", self._after_commit)
+        sqla.event.listen(target, "after_soft_rollback", self._after_rollback)
+
+    def subscribe(self, callback):
+        """ call `callback(changes)` with the list of :class:`Change` of
+        every commit, on the committing thread. The rows are committed by
+        then, so exceptions from `callback` are logged, not raised. """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def close(self):
+        """ stop publishing (SQLAlchemy can't remove the listeners) """
+        self.active = False
+        self.pending.clear()
+
+    def _kind(self, obj):
+        if isinstance(obj, self.Node):
+            return "node"
+        if isinstance(obj, self.Edge):
+            return "edge"
+
+    def _after_flush(self, session, flush_context):
+        if not self.active:
+            return
+        changes = self.pending.setdefault(session, [])
+        for op, objs in [("insert", session.new), ("update", session.dirty),
+                ("delete", session.deleted)]:
+            for obj in objs:
+                kind = self._kind(obj)
+                if kind is None:
+                    continue
+                if op == "update" and not session.is_modified(obj, include_collections=False):
+                    continue
+                if op == "delete":
+                    # the row is gone, so only what's in memory is available
+                    values = _values(obj, load=False)
+                    values["id"] = orm.attributes.instance_state(obj).key[1][0]
+                else:
+                    values = _values(obj)
+                changes.append(Change(op, kind, values["id"], values))
+
+    def _after_commit(self, session):
+        changes = self.pending.pop(session, None)
+        if changes and self.active:
+            for callback in list(self.subscribers):
+                try:
+                    callback(changes)
+                except Exception:
+                    logger.exception("Change feed subscriber %r failed on %d changes" %
+                            (callback, len(changes)))
+
+    def _after_rollback(self, session, previous_transaction):
+        self.pending.pop(session, None)
+
+class LiveGraph(object):
+    """ an in-memory graph kept current from a :class:`ChangeFeed`.
+
+    The graph is loaded once from `session` (subscribing first, so nothing
+    committed meanwhile is lost), then every commit's changes are applied to
+    `target` under :attr:`lock`; hold the lock to read a consistent graph
+    while other threads commit.
+
+        :param feed: :class:`ChangeFeed`
+        :param session: session (or anything with `execute`) to load from
+        :param target: :class:`NetworkXTarget`, :class:`DeltaCSR` or anything
+                       with the same methods
+    """
+    def __init__(self, feed, session, target):
+        self.feed = feed
+        self.session = session
+        self.target = target
+        self.lock = threading.RLock()
+        self.applied = 0
+        feed.subscribe(self.apply)
+        self.reload()
+
+    def close(self):
+        self.feed.unsubscribe(self.apply)
+
+    def reload(self):
+        """ reload the whole graph from the database """
+        nodes = self.feed.Node.__table__
+        edges = self.feed.Edge.__table__
+        with self.lock:
+            self.endpoints = {}
+            self.incident = collections.defaultdict(set)
+            node_rows = [dict(row) for row in self.session.execute(sqla.select([nodes]))]
+            edge_rows = [dict(row) for row in self.session.execute(sqla.select([edges]))]
+            for row in edge_rows:
+                self._track(row["id"], row["source_id"], row["target_id"])
+            self.target.load(node_rows, edge_rows)
+
+    def _track(self, edge_id, source_id, target_id):
+        self.endpoints[edge_id] = (source_id, target_id)
+        self.incident[source_id].add(edge_id)
+        self.incident[target_id].add(edge_id)
+
+    def _untrack(self, edge_id):
+        source_id, target_id = self.endpoints.pop(edge_id)
+        for node_id in (source_id, target_id):
+            self.incident[node_id].discard(edge_id)
+            if not self.incident[node_id]:
+                del self.incident[node_id]
+        return source_id, target_id
+
+    def _remove_edge(self, edge_id):
+        if edge_id in self.endpoints:
+            source_id, target_id = self._untrack(edge_id)
+            self.target.remove_edge(edge_id, source_id, target_id)
+
+    def apply(self, changes):
+        """ apply a list of :class:`Change` (this is the feed callback).
+        Changes are idempotent, so replaying some is harmless. Node inserts
+        and updates go first and node deletes last, so edges never refer to
+        nodes the target doesn't have (the flush lists objects unordered). """
+        with self.lock:
+            for change in sorted(changes, key=_apply_order):
+                if change.kind == "node":
+                    if change.op == "delete":
+                        # the database removed (or refused) the edges too
+                        for edge_id in list(self.incident.get(change.id, ())):
+                            self._remove_edge(edge_id)
+                        self.target.remove_node(change.id)
+                    else:
+                        self.target.add_node(change.id, change.values)
+                else:
+                    self._remove_edge(change.id)
+                    if change.op != "delete":
+                        values = change.values
+                        self._track(change.id, values["source_id"], values["target_id"])
+                        self.target.add_edge(change.id, values["source_id"], values["target_id"], values)
+                self.applied += 1
+
+def _apply_order(change):
+    if change.kind == "edge":
+        return 1
+    return 2 if change.op == "delete" else 0
+
+class NetworkXTarget(object):
+    """ applies changes to a networkx graph. Multigraphs key their edges by
+    edge id; simple graphs keep an edge while any parallel edge is left.
+    Node and edge columns become node/edge attributes.
+
+        :param graph: networkx graph to fill (default: a new MultiDiGraph)
+    """
+    def __init__(self, graph=None):
+        if graph is None:
+            try:
+                import networkx
+            except ImportError:
+                raise ImportError("Must have networkx installed to use NetworkXTarget")
+            graph = networkx.MultiDiGraph()
+        self.graph = graph
+        self.multi = graph.is_multigraph()
+        # parallel edges behind each (source, target) of a simple graph
+        self.parallel = collections.defaultdict(set)
+
+    def load(self, nodes, edges):
+        self.graph.clear()
+        self.parallel.clear()
+        for row in nodes:
+            self.add_node(row["id"], row)
+        for row in edges:
+            self.add_edge(row["id"], row["source_id"], row["target_id"], row)
+
+    def add_node(self, node_id, values):
+        self.graph.add_node(node_id, **_attributes(values))
+
+    def remove_node(self, node_id):
+        if node_id in self.graph:
+            self.graph.remove_node(node_id)
+
+    def add_edge(self, edge_id, source_id, target_id, values):
+        attributes = _attributes(values)
+        if self.multi:
+            self.graph.add_edge(source_id, target_id, key=edge_id, **attributes)
+        else:
+            self.parallel[source_id, target_id].add(edge_id)
+            self.graph.add_edge(source_id, target_id, **attributes)
+
+    def remove_edge(self, edge_id, source_id, target_id):
+        if self.multi:
+            if self.graph.has_edge(source_id, target_id, edge_id):
+                self.graph.remove_edge(source_id, target_id, edge_id)
+            return
+        left = self.parallel[source_id, target_id]
+        left.discard(edge_id)
+        if not left:
+            del self.parallel[source_id, target_id]
+            if self.graph.has_edge(source_id, target_id):
+                self.graph.remove_edge(source_id, target_id)
+
+def _attributes(values):
+    return dict((k, v) for k, v in values.items()
+            if k not in ("id", "source_id", "target_id") and v is not None)
+
+class DeltaCSR(object):
+    """ a :class:`~graphalchemy.csr.CSRGraph` of out-edges plus a buffer of
+    edges added and removed since it was built. :meth:`neighbors` merges
+    the two; once the buffer holds more than `rebuild_fraction` of the
+    snapshot's edges (and at least `min_buffer` changes) the snapshot is
+    rebuilt, so each change costs amortized O(1 / rebuild_fraction).
+
+        :param default_weight: weight for edges whose weight is NULL
+    """
+    def __init__(self, default_weight=1.0, rebuild_fraction=0.1, min_buffer=1000):
+        self.default_weight = default_weight
+        self.rebuild_fraction = rebuild_fraction
+        self.min_buffer = min_buffer
+
+    def load(self, nodes, edges):
+        self.nodes = set(row["id"] for row in nodes)
+        self.edges = dict((row["id"], (row["source_id"], row["target_id"], row["weight"]))
+                for row in edges)
+        self._rebuild()
+
+    def _rebuild(self):
+        from graphalchemy.csr import CSRGraph
+        rows = list(self.edges.items())
+        weights = [w if w is not None else self.default_weight for _, (s, t, w) in rows]
+        self.csr = CSRGraph.from_arrays(sorted(self.nodes), [s for _, (s, t, w) in rows],
+                [t for _, (s, t, w) in rows], weights, edge_ids=[i for i, _ in rows])
+        self.added = collections.defaultdict(dict)
+        self.removed = set()
+        # whether nodes were added or removed since the snapshot
+        self.nodes_changed = False
+
+    @property
+    def buffered(self):
+        """ number of changes waiting in the delta buffer """
+        return len(self.removed) + sum(len(a) for a in self.added.values())
+
+    def add_node(self, node_id, values):
+        if node_id not in self.nodes:
+            self.nodes.add(node_id)
+            self.nodes_changed = True
+
+    def remove_node(self, node_id):
+        if node_id in self.nodes:
+            self.nodes.discard(node_id)
+            self.nodes_changed = True
+
+    def add_edge(self, edge_id, source_id, target_id, values):
+        weight = values.get("weight")
+        self.edges[edge_id] = (source_id, target_id, weight)
+        self.added[source_id][edge_id] = (target_id,
+                self.default_weight if weight is None else weight)
+        self._check_buffer()
+
+    def remove_edge(self, edge_id, source_id, target_id):
+        self.edges.pop(edge_id, None)
+        if self.added.get(source_id, {}).pop(edge_id, None) is None:
+            self.removed.add(edge_id)
+        self._check_buffer()
+
+    def _check_buffer(self):
+        if self.buffered > max(self.rebuild_fraction * self.csr.num_edges, self.min_buffer):
+            self._rebuild()
+
+    def neighbors(self, node_id):
+        """ list of (target_id, weight) for the current out-edges of `node_id` """
+        found = []
+        csr = self.csr
+        position = csr.ids.searchsorted(node_id)
+        if position < len(csr) and csr.ids[position] == node_id:
+            start, stop = csr.indptr[position], csr.indptr[position + 1]
+            for target, weight, edge_id in zip(csr.ids[csr.indices[start:stop]],
+                    csr.weights[start:stop], csr.edge_ids[start:stop]):
+                if edge_id not in self.removed:
+                    found.append((int(target), float(weight)))
+        found.extend(self.added.get(node_id, {}).values())
+        return found
+
+    def snapshot(self):
+        """ the current graph as a :class:`CSRGraph` (with `edge_ids`), for
+        whole-graph algorithms; rebuilt first if anything is buffered """
+        if self.buffered or self.nodes_changed:
+            self._rebuild()
+        return self.csr
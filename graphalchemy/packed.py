@@ -0,0 +1,303 @@
+"""
+Packed adjacency:
+
+    one row per node and direction holding all of its neighbor ids, so that
+    reading the neighbors of a hub is one row fetch instead of a row per
+    edge. Turn it on with ``create_base_classes(..., packed_adjacency=True)``
+    and read it with :meth:`Node.packed_neighbors` or :func:`read_neighbors`::
+
+        >>> Edge.rebuild_packed(session)      # fill it from the edge table
+        >>> ids, weights = hub.packed_neighbors("out")
+
+The table (`<edge table>_packed`) has columns (node_id, direction, degree,
+neighbors, weights): `neighbors` holds the sorted neighbor ids as LEB128
+varints of their differences (so dense id ranges take about a byte per
+edge), `weights` the edge weights in the same order as little-endian
+doubles (NaN for NULL), one entry per edge, so parallel edges repeat an id.
+
+The rows of the nodes an ORM flush touches are patched as part of the
+flush, by decoding, editing and re-encoding them, in databases that have
+the packed table: :func:`~graphalchemy.sqlmodels.ensure_indexes` or
+:meth:`Edge.rebuild_packed` add it to a database that predates the option.
+The set-based methods of the mapped classes (`Node.bulk_delete`,
+`Edge.bulk_upsert`, `Edge.compact`...) refresh the rows of the nodes they
+touch. Other set-based statements (`Query.delete`, the loaders in
+:mod:`graphalchemy.io`, triggers...) bypass the flush: call
+:meth:`Edge.rebuild_packed` after them, with the affected node ids if they
+are known. Node ids must be non-negative.
+"""
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("Must have NumPy installed to use packed adjacency")
+import collections
+import weakref
+import sqlalchemy as sqla
+import sqlalchemy.orm as orm
+from graphalchemy.basemodels import BaseEdge
+from graphalchemy.traversal import chunked, check_direction, CHUNKSIZE
+
+_WEIGHT = np.dtype("<f8")
+
+def packed_table_name(table_name):
+    """ name of the packed adjacency table of edge table `table_name` """
+    return "%s_packed" % table_name
+
+def _packed_table(table_name):
+    """ lightweight Table for the packed adjacency table of `table_name` """
+    return sqla.Table(packed_table_name(table_name), sqla.MetaData(),
+            sqla.Column("node_id", sqla.Integer, primary_key=True),
+            sqla.Column("direction", sqla.String(3), primary_key=True),
+            sqla.Column("degree", sqla.Integer, nullable=False),
+            sqla.Column("neighbors", sqla.LargeBinary, nullable=False),
+            sqla.Column("weights", sqla.LargeBinary, nullable=False))
+
+def packed_ddl(table_name):
+    """ (name, [statement]) creating the packed adjacency table of edge
+    table `table_name` """
+    name = packed_table_name(table_name)
+    return name, ["CREATE TABLE IF NOT EXISTS %s (node_id INTEGER NOT NULL, "
+        "direction VARCHAR(3) NOT NULL, degree INTEGER NOT NULL, neighbors BLOB NOT NULL, "
+        "weights BLOB NOT NULL, PRIMARY KEY (node_id, direction))" % name]
+
+def _varint_lengths(values):
+    """ bytes taken by each uint64 in `values` as a varint """
+    lengths = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        lengths += values >= np.uint64(1 << (7 * k))
+    return lengths
+
+def _varints(values, lengths):
+    """ uint8 array of the uint64s in `values` as consecutive varints """
+    out = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+    for k in range(int(lengths.max()) if len(values) else 0):
+        more = lengths > k
+        byte = (values[more] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        # the high bit says another byte of the same value follows
+        byte |= np.where(lengths[more] > k + 1, 0x80, 0).astype(np.uint64)
+        out[starts[more] + k] = byte
+    return out
+
+def _unvarints(data):
+    """ uint64 array of the varints in uint8 array `data` """
+    last = (data & 0x80) == 0
+    group = np.cumsum(last) - last
+    starts = np.flatnonzero(np.concatenate([[True], last[:-1]]))
+    shift = (np.arange(len(data)) - starts[group]) * 7
+    values = np.zeros(int(last.sum()), dtype=np.uint64)
+    np.bitwise_or.at(values, group, (data & 0x7F).astype(np.uint64) << shift.astype(np.uint64))
+    return values
+
+def _deltas(ids, starts):
+    """ differences of sorted `ids`, restarting at each offset in `starts` """
+    ids = ids.astype(np.uint64)
+    deltas = ids.copy()
+    deltas[1:] -= ids[:-1]
+    deltas[starts] = ids[starts]
+    return deltas
+
+def encode(ids, weights=None):
+    """ (neighbors, weights) blobs for arrays of neighbor `ids` and their
+    `weights` (default NaN), sorted by id """
+    ids = np.asarray(ids, dtype=np.int64)
+    if weights is None:
+        weights = np.empty(len(ids))
+        weights.fill(np.nan)
+    weights = np.asarray(weights, dtype=_WEIGHT)
+    order = np.argsort(ids, kind="mergesort")
+    ids, weights = ids[order], weights[order]
+    deltas = _deltas(ids, [0] if len(ids) else [])
+    return _varints(deltas, _varint_lengths(deltas)).tobytes(), weights.tobytes()
+
+def decode(neighbors, weights=None):
+    """ (ids, weights) arrays from the blobs of a packed row (weights is
+    None if its blob is) """
+    data = np.frombuffer(neighbors, dtype=np.uint8)
+    ids = np.cumsum(_unvarints(data)).astype(np.int64)
+    if weights is not None:
+        weights = np.frombuffer(weights, dtype=_WEIGHT)
+    return ids, weights
+
+def _weights(values):
+    return np.array([np.nan if w is None else w for w in values], dtype=_WEIGHT)
+
+def _directions(direction):
+    check_direction(direction)
+    return ["out", "in"] if direction == "both" else [direction]
+
+def rebuild(session, Edge, node_ids=None, chunk=CHUNKSIZE):
+    """ refill the packed rows of `node_ids` (default: every node) from the
+    edge table, with one scan (or one indexed read per chunk of ids) """
+    table = Edge.__table__
+    packed = _packed_table(table.name)
+    columns = [table.c.source_id, table.c.target_id, table.c.weight]
+    if node_ids is None:
+        session.execute(packed.delete())
+        rows = session.execute(sqla.select(columns)).fetchall()
+        _write(session, packed, rows, None)
+        return
+    for ids in chunked(sorted(set(node_ids)), chunk):
+        session.execute(packed.delete(packed.c.node_id.in_(ids)))
+        rows = session.execute(sqla.select(columns, sqla.or_(
+            table.c.source_id.in_(ids), table.c.target_id.in_(ids)))).fetchall()
+        _write(session, packed, rows, set(ids))
+
+def refresh(session, Edge, node_ids):
+    """ :func:`rebuild` the rows of `node_ids` after a set-based write, in
+    databases that have the packed table """
+    connection = session.connection(mapper=orm.class_mapper(Edge))
+    if node_ids and _has_packed(connection, Edge.__table__):
+        rebuild(session, Edge, node_ids)
+
+def _write(session, packed, rows, wanted):
+    """ insert the packed rows of the (source_id, target_id, weight) `rows`,
+    only for nodes in `wanted` (if given), encoding all of them at once """
+    if not rows:
+        return
+    sources = np.array([row[0] for row in rows], dtype=np.int64)
+    targets = np.array([row[1] for row in rows], dtype=np.int64)
+    weights = _weights(row[2] for row in rows)
+    for direction, near, far in [("out", sources, targets), ("in", targets, sources)]:
+        order = np.lexsort((far, near))
+        near, far, w = near[order], far[order], weights[order]
+        starts = np.flatnonzero(np.concatenate([[True], near[1:] != near[:-1]]))
+        ends = np.append(starts[1:], len(near))
+        deltas = _deltas(far, starts)
+        lengths = _varint_lengths(deltas)
+        data = _varints(deltas, lengths)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        params = [dict(node_id=int(near[a]), direction=direction, degree=int(b - a),
+                neighbors=data[offsets[a]:offsets[b]].tobytes(), weights=w[a:b].tobytes())
+                for a, b in zip(starts, ends) if wanted is None or near[a] in wanted]
+        for params_chunk in chunked(params, CHUNKSIZE):
+            session.execute(packed.insert(), params_chunk)
+
+def read_neighbors(session, Edge, node_ids, direction="out", chunk=CHUNKSIZE):
+    """ {node id: (ids, weights)} for `node_ids`, from one row per node and
+    direction (both directions are merged for 'both'); nodes without edges
+    get empty arrays """
+    packed = _packed_table(Edge.__table__.name)
+    node_ids = list(node_ids)
+    found = collections.defaultdict(list)
+    for ids in chunked(node_ids, chunk):
+        query = sqla.select([packed.c.node_id, packed.c.neighbors, packed.c.weights], sqla.and_(
+            packed.c.node_id.in_(ids), packed.c.direction.in_(_directions(direction))))
+        for node_id, neighbors, weights in session.execute(query):
+            found[node_id].append(decode(neighbors, weights))
+    result = {}
+    for node_id in node_ids:
+        parts = found.get(node_id, [])
+        if len(parts) == 1:
+            result[node_id] = parts[0]
+            continue
+        ids = np.concatenate([p[0] for p in parts] or [np.zeros(0, dtype=np.int64)])
+        weights = np.concatenate([p[1] for p in parts] or [np.zeros(0, dtype=_WEIGHT)])
+        order = np.argsort(ids, kind="mergesort")
+        result[node_id] = ids[order], weights[order]
+    return result
+
+def _packed(obj):
+    return isinstance(obj, BaseEdge) and getattr(obj, "packed_adjacency", False) is True
+
+def _edge_changes(session):
+    """ {edge class: [(source_id, target_id, weight, +1 or -1)]} for the
+    edges with `packed_adjacency` that `session` just flushed """
+    changes = collections.defaultdict(list)
+    def old(obj, key):
+        added, unchanged, deleted = orm.attributes.get_history(obj, key)
+        return (list(deleted) or list(unchanged) or [None])[0]
+    for obj in session.new:
+        if _packed(obj):
+            changes[type(obj)].append((obj.source_id, obj.target_id, obj.weight, 1))
+    for obj in session.deleted:
+        if _packed(obj):
+            # the row is gone, so only what's in memory is available
+            state = orm.attributes.instance_state(obj)
+            values = [state.dict.get(key) for key in ("source_id", "target_id", "weight")]
+            changes[type(obj)].append(tuple(values) + (-1,))
+    for obj in session.dirty:
+        if _packed(obj):
+            before = tuple(old(obj, key) for key in ("source_id", "target_id", "weight"))
+            after = (obj.source_id, obj.target_id, obj.weight)
+            if before != after:
+                changes[type(obj)].extend([before + (-1,), after + (1,)])
+    return changes
+
+# per engine, the packed tables known to exist
+_existing = weakref.WeakKeyDictionary()
+
+def _has_packed(connection, table):
+    known = _existing.setdefault(connection.engine, set())
+    name = packed_table_name(table.name)
+    if name not in known and connection.dialect.has_table(connection, name):
+        known.add(name)
+    return name in known
+
+def _after_flush(session, flush_context):
+    """ patch the packed rows of every node whose edges `session` just
+    flushed, in databases that have the packed table """
+    for Edge, changes in _edge_changes(session).items():
+        connection = session.connection(mapper=orm.class_mapper(Edge))
+        if _has_packed(connection, Edge.__table__):
+            patch(connection, Edge.__table__, changes)
+
+# one listener for every class with `packed_adjacency`
+sqla.event.listen(orm.Session, "after_flush", _after_flush)
+
+def patch(bind, table, changes):
+    """ apply (source_id, target_id, weight, +1 or -1) `changes` to the
+    packed rows of edge table `table`, reading and rewriting one row per
+    node and direction touched (`bind` is a connection or session) """
+    packed = _packed_table(table.name)
+    touched = collections.defaultdict(list)
+    for source_id, target_id, weight, sign in changes:
+        if source_id is None or target_id is None:
+            continue
+        touched[source_id, "out"].append((target_id, weight, sign))
+        touched[target_id, "in"].append((source_id, weight, sign))
+    rows = {}
+    for ids in chunked(sorted(set(node_id for node_id, direction in touched)), CHUNKSIZE):
+        query = sqla.select([packed.c.node_id, packed.c.direction, packed.c.neighbors,
+            packed.c.weights], packed.c.node_id.in_(ids))
+        for node_id, direction, neighbors, weights in bind.execute(query):
+            if (node_id, direction) in touched:
+                rows[node_id, direction] = decode(neighbors, weights)
+    nothing = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=_WEIGHT))
+    empty = []
+    for key, edits in sorted(touched.items()):
+        ids, weights = _edit(*rows.get(key, nothing), edits=edits)
+        if not len(ids):
+            empty.append(key)
+            continue
+        deltas = _deltas(ids, [0])
+        bind.execute(packed.insert().prefix_with("OR REPLACE"), dict(node_id=key[0],
+            direction=key[1], degree=len(ids), weights=weights.tobytes(),
+            neighbors=_varints(deltas, _varint_lengths(deltas)).tobytes()))
+    for node_id, direction in empty:
+        bind.execute(packed.delete(sqla.and_(packed.c.node_id == node_id,
+            packed.c.direction == direction)))
+
+def _edit(ids, weights, edits):
+    """ sorted (ids, weights) with the (neighbor, weight, +1 or -1) `edits` """
+    keep = np.ones(len(ids), dtype=bool)
+    added = []
+    for neighbor, weight, sign in edits:
+        if sign > 0:
+            added.append((neighbor, weight))
+            continue
+        # drop an entry for `neighbor`, preferably one with the same weight
+        lo = np.searchsorted(ids, neighbor, side="left")
+        hi = np.searchsorted(ids, neighbor, side="right")
+        candidates = [i for i in range(lo, hi) if keep[i]]
+        same = [i for i in candidates if weights[i] == weight or (weight is None and np.isnan(weights[i]))]
+        if same or candidates:
+            keep[(same or candidates)[0]] = False
+    ids, weights = ids[keep], weights[keep]
+    if added:
+        added.sort(key=lambda pair: pair[0])
+        new_ids = np.array([n for n, w in added], dtype=np.int64)
+        at = np.searchsorted(ids, new_ids, side="right")
+        ids = np.insert(ids, at, new_ids)
+        weights = np.insert(weights, at, _weights(w for n, w in added))
+    return ids, weights
@@ -0,0 +1,163 @@
+"""
+Path patterns:
+
+    a small, Cypher-flavored way to describe fixed-length paths and compile
+    them into a *single* SQL statement, instead of hand-writing the joins or
+    walking `iter_edge_targets` in Python. Example (friends of friends of
+    node 1 that are labeled "admin")::
+
+        >>> m = match(Node, Edge).path("a", "->", "b", "->", "c")
+        >>> m.where(m["a"].id == 1, m["c"].label == u"admin")
+        >>> session.execute(m.select("c", distinct=True)).fetchall()
+        >>> m.query(session, "b", "c").all()   # (Node, Node) tuples
+
+Every step of a path is an alias of the edge table, joined to the previous
+one on the node ids, so the database's planner picks the join order and the
+source_id/target_id indexes do the lookups. Node tables are only joined in
+for the names that are actually referenced (in `where` or `query`).
+"""
+import sqlalchemy as sqla
+import sqlalchemy.orm as orm
+from sqlalchemy.sql.util import find_tables
+
+# '->': left node is the source, '<-': left node is the target, '-': either
+ARROWS = ("->", "<-", "-")
+
+class Pattern(object):
+    """ a set of fixed-length paths over one Node/Edge pair. Build it with
+    :meth:`path` and :meth:`where`, then run :meth:`select` or :meth:`query`.
+
+        :param Node: mapped node class
+        :param Edge: mapped edge class
+        :param bool distinct_edges: never use the same edge twice in a match
+                                    (like Cypher). Default True.
+        :param bool distinct_nodes: never bind two names to the same node.
+                                    Default False.
+    """
+    def __init__(self, Node, Edge, distinct_edges=True, distinct_nodes=False):
+        self.Node = Node
+        self.Edge = Edge
+        self.distinct_edges = distinct_edges
+        self.distinct_nodes = distinct_nodes
+        self.names = []
+        # aliased Node classes (and their underlying table aliases) by name
+        self.nodes = {}
+        self.tables = {}
+        # (left name, arrow, right name, edge alias) for every step
+        self.steps = []
+        self.clauses = []
+
+    def path(self, *spec):
+        """ add a path: node names alternating with arrows, e.g.
+        ``path("a", "->", "b", "<-", "c")``. Names already used in this
+        pattern refer to the same node, so several paths make a tree or
+        a cycle. Returns the pattern. """
+        if len(spec) < 3 or len(spec) % 2 == 0:
+            raise ValueError("A path is node names alternating with arrows, got %r" % (spec,))
+        names, arrows = spec[::2], spec[1::2]
+        for arrow in arrows:
+            if arrow not in ARROWS:
+                raise ValueError("Arrows must be one of %r, not %r" % (ARROWS, arrow))
+        for name in names:
+            if name not in self.nodes:
+                self.names.append(name)
+                table = self.tables[name] = self.Node.__table__.alias(name)
+                self.nodes[name] = orm.aliased(self.Node, alias=table)
+        for left, arrow, right in zip(names, arrows, names[1:]):
+            self.steps.append((left, arrow, right, self._edge_alias(arrow, len(self.steps))))
+        return self
+
+    def _edge_alias(self, arrow, i):
+        name = "_e%d" % i
+        table = self.Edge.__table__
+        if arrow != "-":
+            return table.alias(name)
+        # undirected: every edge, once each way round
+        swapped = [table.c.target_id.label("source_id"), table.c.source_id.label("target_id")]
+        others = [c for c in table.c if c.name not in ("source_id", "target_id")]
+        forward = sqla.select(others + [table.c.source_id, table.c.target_id])
+        backward = sqla.select(others + swapped)
+        return sqla.union_all(forward, backward).alias(name)
+
+    def __getitem__(self, name):
+        """ the (aliased) Node class bound to `name`, for use in :meth:`where` """
+        return self.nodes[name]
+
+    def edge(self, i):
+        """ the table alias for the `i`-th step, e.g. ``m.edge(0).c.weight > 1`` """
+        return self.steps[i][3]
+
+    def where(self, *clauses):
+        """ add conditions on the nodes (``m["b"].label == u"x"``) or edges
+        (``m.edge(0).c.weight > 2``). Returns the pattern. """
+        self.clauses.extend(clauses)
+        return self
+
+    def _bindings(self):
+        """ (conditions, {name: id column}) tying the steps together """
+        conditions = []
+        bound = {}
+        for left, arrow, right, edge in self.steps:
+            if arrow == "<-":
+                ends = ((left, edge.c.target_id), (right, edge.c.source_id))
+            else:
+                ends = ((left, edge.c.source_id), (right, edge.c.target_id))
+            for name, column in ends:
+                if name in bound:
+                    conditions.append(bound[name] == column)
+                else:
+                    bound[name] = column
+        if self.distinct_edges:
+            edges = [step[3] for step in self.steps]
+            for i, edge in enumerate(edges):
+                for other in edges[i + 1:]:
+                    conditions.append(edge.c.id != other.c.id)
+        if self.distinct_nodes:
+            for i, name in enumerate(self.names):
+                for other in self.names[i + 1:]:
+                    conditions.append(bound[name] != bound[other])
+        return conditions, bound
+
+    def _conditions(self, referenced=()):
+        """ all the where clauses, joining in the node tables that are
+        referenced by `referenced` names or any user clause """
+        if not self.steps:
+            raise ValueError("Pattern has no paths, call path() first")
+        conditions, bound = self._bindings()
+        tables = set()
+        for clause in self.clauses:
+            tables.update(find_tables(clause, check_columns=True, include_aliases=True))
+        for name in self.names:
+            if name in referenced or self.tables[name] in tables:
+                conditions.append(self.tables[name].c.id == bound[name])
+        return conditions + list(self.clauses), bound
+
+    def select(self, *names, **kwargs):
+        """ a Core select of the ids bound to `names` (all names by default),
+        with one column per name, labeled with the name.
+
+            :param bool distinct: SELECT DISTINCT
+        """
+        names = names or self.names
+        conditions, bound = self._conditions()
+        query = sqla.select([bound[name].label(name) for name in names],
+                sqla.and_(*conditions), from_obj=[step[3] for step in self.steps])
+        if kwargs.get("distinct"):
+            query = query.distinct()
+        return query
+
+    def query(self, session, *names):
+        """ an ORM Query for the nodes bound to `names` (all names by default),
+        producing tuples of Node instances (or single instances for one name) """
+        names = names or self.names
+        conditions, bound = self._conditions(names)
+        return session.query(*[self.nodes[name] for name in names]).filter(sqla.and_(*conditions))
+
+    def count(self, session):
+        """ number of matches """
+        return session.execute(sqla.select([sqla.func.count()]).select_from(
+            self.select().alias())).scalar()
+
+def match(Node, Edge, **kwargs):
+    """ start a :class:`Pattern` for `Node` and `Edge` (kwargs are passed on) """
+    return Pattern(Node, Edge, **kwargs)
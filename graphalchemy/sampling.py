@@ -0,0 +1,341 @@
+"""
+Sampling:
+
+    vectorized neighborhood sampling over a :class:`~graphalchemy.csr.CSRGraph`
+    snapshot, for minibatch training of graph neural networks, and random
+    walks for DeepWalk/node2vec embeddings. One NumPy pass per layer (or walk
+    step) replaces a `node.neighbors` + `random.sample` call per node.
+"""
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("Must have NumPy installed to use sampling")
+import collections
+import multiprocessing
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from graphalchemy.csr import CSRGraph
+
+class Block(collections.namedtuple("Block", ["src_ids", "dst_ids", "edge_src", "edge_dst"])):
+    """ one sampled layer, as compact arrays.
+
+    `dst_ids` are the node ids the layer computes, `src_ids` the node ids it
+    reads from (always starting with `dst_ids`, in the same order). Sampled
+    edge `i` goes from ``src_ids[edge_src[i]]`` to ``dst_ids[edge_dst[i]]``.
+    """
+    __slots__ = ()
+
+def _segments(indptr, positions):
+    """ (starts, degrees) of the adjacency slices for `positions` """
+    starts = indptr[positions]
+    return starts, indptr[positions + 1] - starts
+
+def _expand(starts, lengths):
+    """ (offsets into indices, segment of each offset) for all the slices """
+    total = lengths.sum()
+    segment = np.repeat(np.arange(len(lengths)), lengths)
+    firsts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return np.repeat(starts - firsts, lengths) + np.arange(total), segment
+
+def _pick(starts, degrees, draws, cumulative=None):
+    """ offsets into indices for one uniform `draws` value in [0, 1) per
+    slice: uniform within the slice, or by weight given the running total
+    of the weights (`cumulative`) """
+    if cumulative is None:
+        return starts + (draws * degrees).astype(np.int64)
+    base = np.where(starts > 0, cumulative[starts - 1], 0)
+    totals = cumulative[starts + degrees - 1] - base
+    offsets = _sorted_search(cumulative, base + draws * totals, side="right")
+    return np.clip(offsets, starts, starts + degrees - 1)
+
+def _sorted_search(array, values, side="left"):
+    """ np.searchsorted, but with the values sorted first: several times
+    faster for many random values against a large array (cache locality) """
+    order = np.argsort(values)
+    found = np.empty(len(values), dtype=np.int64)
+    found[order] = np.searchsorted(array, values[order], side=side)
+    return found
+
+def _top_k(segment, keys, k):
+    """ mask of the entries with the `k` largest keys in each segment
+    (segments must be sorted) """
+    order = np.lexsort((-keys, segment))
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - np.searchsorted(segment[order], segment[order])
+    return ranks < k
+
+class NeighborSampler(object):
+    """ samples fixed fan-out neighborhoods for batches of seed nodes.
+
+        :param csr: :class:`CSRGraph` to sample from (its direction decides
+                    which neighbors count; weights are needed for `weighted`)
+        :param fanouts: neighbors per node for each layer, from the seeds
+                        outwards, e.g. ``[25, 10]``. None or -1 takes every
+                        neighbor.
+        :param bool weighted: sample proportionally to edge weight
+        :param bool replace: sample with replacement (cheaper for hubs: cost
+                             is proportional to the fan-out, not the degree)
+        :param seed: seed for the random state, for reproducible batches
+    """
+    def __init__(self, csr, fanouts, weighted=False, replace=False, seed=None):
+        if weighted and csr.weights is None:
+            raise ValueError("weighted sampling needs a snapshot with weights")
+        self.csr = csr
+        self.fanouts = list(fanouts)
+        self.weighted = weighted
+        self.replace = replace
+        self.random = np.random.RandomState(seed)
+        self._cumulative = np.cumsum(csr.weights) if weighted and replace else None
+
+    @classmethod
+    def from_session(cls, session, Node, Edge, fanouts, direction="both", **kwargs):
+        """ snapshot the graph (with weights if `weighted`) and build a sampler.
+        `direction` defaults to 'both', like :attr:`BaseNode.neighbors`. """
+        csr = CSRGraph.from_session(session, Node, Edge, direction=direction,
+                weighted=kwargs.get("weighted", False))
+        return cls(csr, fanouts, **kwargs)
+
+    def sample_neighbors(self, positions, k):
+        """ sample up to `k` neighbors of each position.
+
+            :returns: (which, neighbors): index into `positions` and neighbor
+                      position for every sampled edge
+        """
+        starts, degrees = _segments(self.csr.indptr, positions)
+        if k is None or k < 0:
+            offsets, which = _expand(starts, degrees)
+            return which, self.csr.indices[offsets]
+        if self.replace:
+            has = np.nonzero(degrees)[0]
+            which = np.repeat(has, k)
+            offsets = _pick(starts[which], degrees[which],
+                    self.random.random_sample(len(which)), self._cumulative)
+            return which, self.csr.indices[offsets]
+        offsets, which = _expand(starts, degrees)
+        if len(offsets):
+            if self.weighted:
+                # Efraimidis-Spirakis: top k of u ** (1 / w)
+                weights = self.csr.weights[offsets]
+                keys = np.where(weights > 0,
+                        np.log(self.random.random_sample(len(offsets))) / np.maximum(weights, 1e-300),
+                        -np.inf)
+            else:
+                keys = self.random.random_sample(len(offsets))
+            keep = _top_k(which, keys, k)
+            offsets, which = offsets[keep], which[keep]
+        return which, self.csr.indices[offsets]
+
+    def sample(self, seeds):
+        """ sample a multi-layer neighborhood of the seed *node ids*.
+
+            :returns: list of :class:`Block`, from the input layer to the
+                      seeds (so ``blocks[0].src_ids`` are every node whose
+                      features are needed and ``blocks[-1].dst_ids`` are the
+                      seeds)
+        """
+        dst = _unique_in_order(self.csr.positions(seeds))
+        blocks = []
+        for k in self.fanouts:
+            which, neighbors = self.sample_neighbors(dst, k)
+            src, edge_src = _relabel(dst, neighbors)
+            blocks.append(Block(self.csr.ids[src], self.csr.ids[dst], edge_src, which))
+            dst = src
+        blocks.reverse()
+        return blocks
+
+    def iter_batches(self, seeds, batch_size, shuffle=True, prefetch=1):
+        """ generator of :meth:`sample` results for `seeds` split into
+        batches, sampled on a background thread up to `prefetch` batches
+        ahead of the consumer. """
+        seeds = np.asarray(seeds)
+        if shuffle:
+            seeds = seeds[self.random.permutation(len(seeds))]
+        batches = [seeds[i:i + batch_size] for i in range(0, len(seeds), batch_size)]
+        return _prefetch((self.sample(batch) for batch in batches), prefetch)
+
+def _unique_in_order(values):
+    """ `values` without duplicates, keeping first occurrences in order """
+    _, first = np.unique(values, return_index=True)
+    return values[np.sort(first)]
+
+def _relabel(dst, neighbors):
+    """ src positions (dst first, then new neighbors in order of appearance)
+    and the index into src of each neighbor """
+    everything = np.concatenate([dst, neighbors])
+    unique, first, inverse = np.unique(everything, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="mergesort")
+    local = np.empty(len(order), dtype=np.int64)
+    local[order] = np.arange(len(order))
+    return unique[order], local[inverse[len(dst):]]
+
+_DONE = object()
+
+def _prefetch(iterable, size):
+    """ iterate `iterable` on a daemon thread, at most `size` items ahead.
+    Exceptions are re-raised in the consumer. """
+    items = queue.Queue(maxsize=max(size, 1))
+    stop = threading.Event()
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            items.put((_DONE, None))
+        except Exception as e:
+            items.put((_DONE, e))
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+
+# walks generated per task: results don't depend on the number of processes
+WALK_CHUNK = 100000
+
+def random_walks(snapshot_or_session, starts, length, p=1, q=1, weighted=True,
+        seed=None, processes=1, Node=None, Edge=None, direction="out"):
+    """ random walks of `length` nodes from each of `starts`, all advanced in
+    lockstep over a CSR snapshot.
+
+    With ``p == q == 1`` every step picks a neighbor uniformly (or in
+    proportion to edge weight): DeepWalk. Otherwise each step is biased like
+    node2vec, relative to the previous node: returning to it is weighted by
+    ``1 / p``, moving to one of its neighbors by 1 and moving further away by
+    ``1 / q``. Biased steps are drawn by rejection from the first-order
+    distribution, which needs no per-edge-pair tables (memory stays O(edges)).
+
+        :param snapshot_or_session: a :class:`CSRGraph`, or a session to
+                                    snapshot (then pass `Node` and `Edge`)
+        :param starts: node ids to start from (repeat ids for several walks)
+        :param bool weighted: follow edges in proportion to their weight, if
+                              the snapshot has weights
+        :param seed: seed for reproducible walks (the same for any number of
+                     processes)
+        :param int processes: worker processes to fan chunks of
+                              `WALK_CHUNK` walks out to
+        :param direction: which edges to follow, when snapshotting a session
+        :returns: array of node ids, one row per walk; walks that reach a
+                  node without neighbors are padded with -1
+    """
+    if p <= 0 or q <= 0:
+        raise ValueError("p and q must be positive")
+    if isinstance(snapshot_or_session, CSRGraph):
+        csr = snapshot_or_session
+    else:
+        if Node is None or Edge is None:
+            raise ValueError("Node and Edge are required to snapshot a session")
+        csr = CSRGraph.from_session(snapshot_or_session, Node, Edge,
+                direction=direction, weighted=weighted)
+    positions = csr.positions(starts)
+    if weighted and csr.weights is None:
+        weighted = False
+    chunks = [positions[i:i + WALK_CHUNK] for i in range(0, len(positions), WALK_CHUNK)]
+    seeds = np.random.RandomState(seed).randint(2 ** 31 - 1, size=len(chunks))
+    tasks = [(chunk, length, p, q, chunk_seed) for chunk, chunk_seed in zip(chunks, seeds)]
+    if processes > 1 and len(tasks) > 1:
+        # the snapshot goes to each worker once, not with every task
+        pool = multiprocessing.Pool(min(processes, len(tasks)),
+                initializer=_init_worker, initargs=(csr, weighted))
+        try:
+            results = pool.map(_walk_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        walker = _Walker(csr, weighted)
+        results = [_walk_chunk(walker, *task) for task in tasks]
+    if not results:
+        return np.empty((0, length), dtype=np.int64)
+    return np.concatenate(results)
+
+class _Walker(object):
+    """ the per-step sampling for :func:`random_walks`, built once per
+    process and shared by its chunks """
+    def __init__(self, csr, weighted):
+        self.csr = csr
+        self.degrees = csr.degree()
+        self.cumulative = np.cumsum(csr.weights) if weighted else None
+        # edges as sorted source * n + target keys, for "is it a neighbor" tests
+        self.keys = csr.sources() * len(csr) + csr.indices
+
+    def step(self, random, current):
+        """ a first-order random neighbor of each position in `current` """
+        offsets = _pick(self.csr.indptr[current], self.degrees[current],
+                random.random_sample(len(current)), self.cumulative)
+        return self.csr.indices[offsets]
+
+    def connected(self, sources, targets):
+        wanted = sources * len(self.csr) + targets
+        found = _sorted_search(self.keys, wanted)
+        found[found >= len(self.keys)] = 0
+        return self.keys[found] == wanted
+
+    def biased_step(self, random, previous, current, p, q):
+        """ a node2vec step from `current`, having come from `previous` """
+        top = max(1.0 / p, 1.0, 1.0 / q)
+        bottom = min(1.0 / p, 1.0, 1.0 / q)
+        chosen = np.empty(len(current), dtype=np.int64)
+        pending = np.arange(len(current))
+        while len(pending):
+            proposal = self.step(random, current[pending])
+            draws = random.random_sample(len(pending)) * top
+            # below the smallest bias everything is accepted, no lookups needed
+            accepted = draws < bottom
+            check = np.nonzero(~accepted)[0]
+            came_from = previous[pending[check]]
+            bias = np.where(proposal[check] == came_from, 1.0 / p,
+                    np.where(self.connected(came_from, proposal[check]), 1.0, 1.0 / q))
+            accepted[check] = draws[check] < bias
+            chosen[pending[accepted]] = proposal[accepted]
+            pending = pending[~accepted]
+        return chosen
+
+_worker_walker = None
+
+def _init_worker(csr, weighted):
+    global _worker_walker
+    _worker_walker = _Walker(csr, weighted)
+
+def _walk_task(task):
+    return _walk_chunk(_worker_walker, *task)
+
+def _walk_chunk(walker, positions, length, p, q, seed):
+    csr = walker.csr
+    random = np.random.RandomState(seed)
+    # one row per step while walking, so each step writes a contiguous row
+    walks = np.full((length, len(positions)), -1, dtype=np.int64)
+    if length:
+        walks[0] = positions
+    alive = np.arange(len(positions))
+    current, previous = positions, None
+    for step in range(1, length):
+        moving = walker.degrees[current] > 0
+        if not moving.all():
+            alive, current = alive[moving], current[moving]
+            if previous is not None:
+                previous = previous[moving]
+        if not len(alive):
+            break
+        if previous is None or (p == 1 and q == 1):
+            current, previous = walker.step(random, current), current
+        else:
+            current, previous = walker.biased_step(random, previous, current, p, q), current
+        walks[step, alive] = current
+    return np.ascontiguousarray(np.where(walks >= 0, csr.ids[np.maximum(walks, 0)], -1).T)
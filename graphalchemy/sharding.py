@@ -0,0 +1,249 @@
+"""
+Sharding:
+
+    one graph hash-partitioned across several SQLite files, for graphs whose
+    write load is more than a single file (and its single writer) can take.
+    Node `i` lives in shard ``i % shards`` together with its out-edges, so
+    writes go straight to the owning file and out-edge lookups touch one
+    shard. Reads that span shards run on a router connection that ATTACHes
+    every file and sees each table as a UNION ALL over the shards; SQLite
+    pushes the WHERE clause into every arm, so each shard still uses its
+    indexes. Example::
+
+        >>> graph = sqlite_connect_shards(["g0.db", "g1.db"], Base.metadata, Node, Edge)
+        >>> graph.add_all([Node(id=1), Node(id=2), Edge(source_id=1, target_id=2)])
+        >>> graph.commit()
+        >>> graph.k_hop(2, 3)
+        >>> k_hop(graph, graph.edges, 2, 3)     # same thing, any table-level helper
+
+Foreign keys can't be enforced (an edge's target may live in another file),
+edge ids are only unique within a shard, and a commit is one commit per
+shard, not a single transaction.
+"""
+import logging
+import os
+import sqlalchemy as sqla
+import sqlalchemy.orm as orm
+from graphalchemy.sqlmodels import sqlite_connect, _InsertFromSelect
+from graphalchemy import traversal
+logger = logging.getLogger("graphalchemy")
+
+# SQLite's default limit on the number of attached databases
+MAX_SHARDS = 10
+
+def shard_of(node_id, shards):
+    """ the shard that owns `node_id` (and its out-edges) """
+    return node_id % shards
+
+def sqlite_connect_shards(dbpaths, metadata, Node, Edge, echo=False, **kwargs):
+    """ connect to (and create the tables in) every shard file, like
+    :func:`~graphalchemy.sqlmodels.sqlite_connect` does for one file (so the
+    files must exist, but may be empty). Foreign keys are not enforced, and
+    `metadata` is left unbound.
+
+        :param dbpaths: list of paths, one per shard (order matters: it is
+                        the partitioning)
+        :returns: :class:`ShardedGraph`
+    """
+    engines = []
+    for path in dbpaths:
+        engine, session = sqlite_connect(path, metadata, echo=echo, enforce_fk=False, **kwargs)
+        session.close()
+        engines.append(engine)
+    metadata.bind = None
+    return ShardedGraph(engines, Node, Edge, sessionmaker=kwargs.get("sessionmaker"))
+
+class _Union(object):
+    """ stand-in for a mapped class whose `__table__` is the UNION ALL of
+    its table in every attached shard """
+    def __init__(self, mapped, shards):
+        self.mapped = mapped
+        self.tables = [_attached_table(mapped.__table__, i) for i in range(shards)]
+        self.__table__ = sqla.union_all(*[sqla.select([t]) for t in self.tables]).alias()
+
+    def __getattr__(self, name):
+        return getattr(self.mapped, name)
+
+def _attached_table(table, shard):
+    """ copy of `table`'s columns in the schema of attached shard `shard` """
+    return sqla.Table(table.name, sqla.MetaData(),
+            *[sqla.Column(c.name, c.type) for c in table.c], schema="shard%d" % shard)
+
+def _router(paths):
+    """ in-memory engine that ATTACHes every path as shard0, shard1, ... """
+    engine = sqla.create_engine("sqlite://")
+    def attach(dbapi_con, con_record):
+        for i, path in enumerate(paths):
+            dbapi_con.execute("ATTACH DATABASE ? AS shard%d" % i, (path,))
+    sqla.event.listen(engine, "connect", attach)
+    return engine
+
+class ShardedGraph(object):
+    """ a graph partitioned over `engines` (one per shard file).
+
+        :param engines: SQLite engines, in partitioning order
+        :param Node: mapped node class
+        :param Edge: mapped edge class
+        :param sessionmaker: (optional) for the per-shard sessions
+    """
+    def __init__(self, engines, Node, Edge, sessionmaker=None):
+        self.Node = Node
+        self.Edge = Edge
+        self.sessionmaker = sessionmaker or orm.sessionmaker
+        self._use(engines)
+
+    def _use(self, engines):
+        """ (re)connect sessions, router and unions to `engines` """
+        if not engines:
+            raise ValueError("Need at least one shard")
+        if len(engines) > MAX_SHARDS:
+            raise ValueError("SQLite can attach at most %d shards, got %d" % (MAX_SHARDS, len(engines)))
+        self.engines = list(engines)
+        self.sessions = [self.sessionmaker(bind=engine)() for engine in self.engines]
+        self.router = _router(self.paths)
+        self.nodes = _Union(self.Node, len(self.engines))
+        self.edges = _Union(self.Edge, len(self.engines))
+        self._next_id = None
+
+    @property
+    def paths(self):
+        return [engine.url.database for engine in self.engines]
+
+    def __len__(self):
+        return len(self.engines)
+
+    def shard_of(self, node_id):
+        return shard_of(node_id, len(self.engines))
+
+    def session_for(self, node_id):
+        """ the session of the shard that owns `node_id` """
+        return self.sessions[self.shard_of(node_id)]
+
+    def execute(self, *args, **kwargs):
+        """ run a statement on the router, where :attr:`nodes` and
+        :attr:`edges` see every shard (so a ShardedGraph can be passed as
+        the session to the table-level helpers) """
+        return self.router.execute(*args, **kwargs)
+
+    def allocate_id(self):
+        """ a node id that isn't used in any shard """
+        if self._next_id is None:
+            table = self.nodes.__table__
+            self._next_id = (self.execute(sqla.select([sqla.func.max(table.c.id)])).scalar() or 0) + 1
+        node_id, self._next_id = self._next_id, self._next_id + 1
+        return node_id
+
+    def add(self, obj):
+        """ add a node or edge to the session of its owning shard. Nodes
+        without an id get one from :meth:`allocate_id`; edges need an
+        explicit `source_id` (relationships can't span shards). """
+        if isinstance(obj, self.Edge):
+            if obj.source_id is None:
+                raise ValueError("Edges need a source_id to be routed to a shard")
+            self.session_for(obj.source_id).add(obj)
+        elif isinstance(obj, self.Node):
+            if obj.id is None:
+                obj.id = self.allocate_id()
+            self.session_for(obj.id).add(obj)
+        else:
+            raise TypeError("Can only add %s or %s instances, not %r" % (
+                self.Node.__name__, self.Edge.__name__, obj))
+
+    def add_all(self, objs):
+        for obj in objs:
+            self.add(obj)
+
+    def get(self, node_id):
+        """ the node with id `node_id`, from its shard (or None) """
+        return self.session_for(node_id).query(self.Node).get(node_id)
+
+    def flush(self):
+        for session in self.sessions:
+            session.flush()
+
+    def commit(self):
+        """ commit every shard, one after the other """
+        for session in self.sessions:
+            session.commit()
+
+    def rollback(self):
+        for session in self.sessions:
+            session.rollback()
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+        self.router.dispose()
+
+    def neighbors(self, node_id, direction="both"):
+        """ set of ids adjacent to `node_id` (out-edges come from its own
+        shard, in-edges from all of them) """
+        traversal.check_direction(direction)
+        found = set()
+        if direction in ("out", "both"):
+            found.update(traversal.expand_frontier(self.session_for(node_id), self.Edge,
+                [node_id], "out"))
+        if direction in ("in", "both"):
+            found.update(traversal.expand_frontier(self, self.edges, [node_id], "in"))
+        return found
+
+    def k_hop(self, source, k, direction="both"):
+        """ :func:`graphalchemy.traversal.k_hop` across every shard """
+        return traversal.k_hop(self, self.edges, source, k, direction)
+
+    def rebalance(self, dbpaths):
+        """ repartition the graph over `dbpaths` (e.g. the current paths plus
+        some new ones), moving every node and out-edge whose owner changes
+        with `INSERT ... SELECT` / `DELETE` statements between attached
+        files, in one transaction. Missing files are created. Pending
+        changes are committed first, and the graph uses the new shards
+        afterwards. Files that are no longer shards are left untouched.
+        Moved edges get new ids in their new shard.
+
+            :returns: (nodes_moved, edges_moved)
+        """
+        self.commit()
+        old = [os.path.abspath(path) for path in self.paths]
+        new = [os.path.abspath(path) for path in dbpaths]
+        everything = old + [path for path in new if path not in old]
+        if len(everything) > MAX_SHARDS or len(set(new)) != len(new):
+            raise ValueError("Need distinct paths, and at most %d files in total" % MAX_SHARDS)
+        metadata = self.Node.__table__.metadata
+        engines = []
+        for path in new:
+            if not os.path.exists(path):
+                open(path, "a").close()
+            engine = sqla.create_engine("sqlite:///" + path)
+            metadata.create_all(bind=engine, tables=[self.Node.__table__, self.Edge.__table__])
+            engines.append(engine)
+        self.close()
+        router = _router(everything)
+        moved = [0, 0]
+        connection = router.connect()
+        transaction = connection.begin()
+        try:
+            for i, path in enumerate(old):
+                for which, (table, key) in enumerate([(self.Edge.__table__, "source_id"),
+                        (self.Node.__table__, "id")]):
+                    source = _attached_table(table, i)
+                    owner = source.c[key] % len(new)
+                    for j, target_path in enumerate(new):
+                        if target_path == path:
+                            continue
+                        target = _attached_table(table, everything.index(target_path))
+                        # edge ids are per shard: moved edges get new ones
+                        columns = [c.name for c in table.c if not (which == 0 and c.name == "id")]
+                        moved[which] += connection.execute(_InsertFromSelect(target, columns,
+                            sqla.select([source.c[c] for c in columns], owner == j))).rowcount
+                    if path in new:
+                        connection.execute(source.delete().where(owner != new.index(path)))
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        finally:
+            connection.close()
+            router.dispose()
+        logger.info("Rebalanced %d nodes and %d edges onto %d shards" % (moved[1], moved[0], len(new)))
+        self._use(engines)
+        return moved[1], moved[0]
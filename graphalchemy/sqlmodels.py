@@ -12,14 +12,22 @@ try:
     import sqlalchemy as sqla # Column, Integer, Unicode, Float, Boolean, ForeignKey
 except ImportError:
     raise ImportError("Must have SQLAlchemy installed to use sqlmodelss")
+import collections
+import datetime
 import logging
-from basemodels import BaseEdge, BaseNode
+import re
+from graphalchemy.basemodels import BaseEdge, BaseNode
+from graphalchemy import backup
+from graphalchemy.traversal import chunked, expand_frontier, scoped, top_neighbors, CHUNKSIZE
 import sqlalchemy.ext.declarative as decl # declared_attr
 import sqlalchemy.orm as orm # relationship, backref
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
 # overwrite a few extensions to use flask-sqlalchemy's model
 import os
 logger = logging.getLogger("graphalchemy")
-def sqlite_connect(dbpath, metadata, echo=False, enforce_fk=True, **kwargs):
+def sqlite_connect(dbpath, metadata, echo=False, enforce_fk=True, in_memory=False,
+        checkpoint_commits=None, checkpoint_interval=None, **kwargs):
     """ return an sqllite connection to the given dbpath.
     Optional arguments default to sqlalchemy functions.
 
@@ -36,6 +44,14 @@ def sqlite_connect(dbpath, metadata, echo=False, enforce_fk=True, **kwargs):
         :param event: event creator for engine (from SQLAlchemy)
         :param bool enforce_fk: set database to enforce foreign key relationships
         :default enforce_fk: True
+        :param bool in_memory: load the database at `dbpath` into memory and work
+                               there; it's written back by the engine's
+                               :class:`~graphalchemy.backup.Checkpointer`
+                               (`engine.checkpointer`), which may lose the
+                               commits since its last checkpoint on a crash
+        :param int checkpoint_commits: (in_memory) checkpoint every so many commits
+        :param float checkpoint_interval: (in_memory) checkpoint after a commit
+                                          once so many seconds have passed
 
     Returns:
 
@@ -57,7 +73,12 @@ def sqlite_connect(dbpath, metadata, echo=False, enforce_fk=True, **kwargs):
     else:
         logger.info("Using dbpath %r" % (dbpath or ":memory:"))
     dbpath = dbpath and os.path.abspath(dbpath)
-    engine = create_engine("sqlite:///" + dbpath, echo=echo)
+    if in_memory:
+        if not dbpath:
+            raise ValueError("in_memory needs a path to load from and checkpoint to")
+        engine = backup.memory_engine(echo=echo)
+    else:
+        engine = create_engine("sqlite:///" + dbpath, echo=echo)
     if enforce_fk:
         def _fk_pragma_on_connect(dbapi_con, con_record):
             """ set enforced foreignkey for sqlite """
@@ -65,31 +86,253 @@ def sqlite_connect(dbpath, metadata, echo=False, enforce_fk=True, **kwargs):
         event.listen(engine, 'connect', _fk_pragma_on_connect)
     else:
         logger.info("NOT enforcing ForeignKeys")
+    if in_memory:
+        backup.restore(engine, dbpath)
     metadata.bind = engine
     metadata.create_all()
     Session = sessionmaker(bind=engine)
+    if in_memory:
+        engine.checkpointer = backup.Checkpointer(engine, dbpath, Session,
+                commits=checkpoint_commits, interval=checkpoint_interval)
     session = Session()
     return engine, session
 
+# put an _ between every lowerUpper match, e.g.:
+# "aA" --> "a_A"
+# OR add underscores between double caps.
+_CAMEL_BOUNDARY = re.compile("[a-z][A-Z]|[A-Z][A-Z]")
+
+def _add_underscore(matchobj):
+    match = matchobj.group(0)
+    return match[0] + "_" + match[1]
+
 def class_to_tablename(class_str):
     """ converts `class_str` to a tablename, s.t.
     CamelCase --> camel_case """
-    def add_underscore(matchobj):
-        match = matchobj.group(0)
-        return match[0] + "_" + match[1]
-    # put an _ between every lowerUpper match, e.g.:
-    # "aA" --> "a_A"
-    # then convert everything to lower case
-    # OR add underscores between double caps.
-    import re
-    match = re.compile("[a-z][A-Z]|[A-Z][A-Z]")
     # need to do it twice because AAA --> "a_a_a")
-    return re.sub(match, add_underscore,
-            re.sub(match, add_underscore, class_str)).lower()
+    # then convert everything to lower case
+    return _CAMEL_BOUNDARY.sub(_add_underscore,
+            _CAMEL_BOUNDARY.sub(_add_underscore, class_str)).lower()
+
+
+def ensure_indexes(bind, *classes):
+    """ creates any index declared on the tables of `classes` that doesn't
+    exist in the database yet, along with any auxiliary table an option
+    keeps next to them (e.g. the packed adjacency table). `metadata.create_all()`
+    skips tables that already exist, so use this after turning on an option
+    that adds indexes (e.g. `unique_edges`) for an existing database.
+
+        :param bind: engine or connection
+        :param classes: mapped classes (or tables)
+        :returns: list of the names of the indexes (and tables) created
+    """
+    from sqlalchemy.engine.reflection import Inspector
+    inspector = Inspector.from_engine(bind)
+    created = []
+    for cls in classes:
+        table = getattr(cls, "__table__", cls)
+        existing = set(index["name"] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind)
+                created.append(index.name)
+        created.extend(_ensure_auxiliary(bind, table))
+    return created
+
+def _attach_auxiliary(ddl):
+    """ after_parent_attach listener that creates (and drops) an auxiliary
+    table along with the table it's attached to. `ddl(table name)` gives
+    (auxiliary table name, statements creating it and its triggers); the
+    statements use IF NOT EXISTS and are kept in the table's `info`, so
+    :func:`_ensure_auxiliary` can add them to an existing database """
+    def attach(item, table):
+        name, statements = ddl(table.name)
+        table.info.setdefault("auxiliary", {})[name] = statements
+        for statement in statements:
+            sqla.event.listen(table, "after_create",
+                    sqla.DDL(statement).execute_if(dialect="sqlite"))
+        sqla.event.listen(table, "before_drop",
+                sqla.DDL("DROP TABLE IF EXISTS %s" % name).execute_if(dialect="sqlite"))
+    return attach
+
+def _ensure_auxiliary(bind, table):
+    """ create the auxiliary tables of `table` that don't exist yet in the
+    database of `bind` (engine, connection or session). On SQLite, creating
+    one ends the current transaction. Returns their names. """
+    from sqlalchemy.engine.reflection import Inspector
+    if isinstance(bind, orm.Session):
+        bind = bind.connection()
+    auxiliary = table.info.get("auxiliary", {})
+    if not auxiliary or bind.dialect.name != "sqlite":
+        return []
+    existing = set(Inspector.from_engine(bind).get_table_names())
+    created = []
+    for name, statements in sorted(auxiliary.items()):
+        if name not in existing:
+            for statement in statements:
+                bind.execute(statement)
+            created.append(name)
+    return created
+
+# SQL for merging the weight of an incoming duplicate edge into the stored one
+# (see `Edge.bulk_upsert`), keeping NULL only if both weights are NULL
+UPSERT_MERGES = {
+    "sum": "coalesce({table}.weight + excluded.weight, {table}.weight, excluded.weight)",
+    "max": "max(coalesce({table}.weight, excluded.weight), coalesce(excluded.weight, {table}.weight))",
+    "replace": "excluded.weight",
+    }
+
+def _endpoints(session, table, criterion):
+    """ set of the node ids at either end of the edges of `table` matching
+    `criterion` """
+    ids = set()
+    for source_id, target_id in session.execute(
+            sqla.select([table.c.source_id, table.c.target_id], criterion)):
+        ids.update((source_id, target_id))
+    return ids
+
+def _check_merge(merge):
+    if merge not in UPSERT_MERGES:
+        raise ValueError("merge must be one of %r, not %r" % (sorted(UPSERT_MERGES), merge))
+
+class _InsertFromSelect(Executable, ClauseElement):
+    """ INSERT INTO `table` (`columns`) SELECT ... """
+    def __init__(self, table, columns, select):
+        self.table = table
+        self.columns = columns
+        self.select = select
+
+@compiles(_InsertFromSelect)
+def _compile_insert_from_select(element, compiler, **kw):
+    return "INSERT INTO %s (%s) %s" % (
+            compiler.process(element.table, asfrom=True),
+            ", ".join(compiler.preparer.quote_identifier(c) for c in element.columns),
+            compiler.process(element.select))
+
+def label_fts_table(table_name):
+    """ name of the FTS5 table indexing the labels of node table `table_name` """
+    return "%s_label_fts" % table_name
+
+def _label_fts_ddl(table_name):
+    """ (name, statements) creating an external-content FTS5 table over the
+    labels of node table `table_name`, with triggers keeping it in sync """
+    names = dict(fts=label_fts_table(table_name), table=table_name)
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(label, content='{table}', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS {table}_label_ai AFTER INSERT ON {table} BEGIN "
+            "INSERT INTO {fts}(rowid, label) VALUES (new.id, new.label); END",
+        "CREATE TRIGGER IF NOT EXISTS {table}_label_ad AFTER DELETE ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, label) VALUES ('delete', old.id, old.label); END",
+        "CREATE TRIGGER IF NOT EXISTS {table}_label_au AFTER UPDATE OF id, label ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, label) VALUES ('delete', old.id, old.label); "
+            "INSERT INTO {fts}(rowid, label) VALUES (new.id, new.label); END",
+        ]
+    return names["fts"], [statement.format(**names) for statement in statements]
+
+def adjacency_table_name(table_name):
+    """ name of the symmetric adjacency table of undirected edge table `table_name` """
+    return "%s_adjacency" % table_name
+
+def _adjacency_table(table_name):
+    """ lightweight Table for the adjacency table of `table_name` """
+    return sqla.Table(adjacency_table_name(table_name), sqla.MetaData(),
+            sqla.Column("node_id", sqla.Integer, primary_key=True),
+            sqla.Column("other_id", sqla.Integer, primary_key=True),
+            sqla.Column("edge_id", sqla.Integer, primary_key=True))
+
+def _adjacency_ddl(table_name):
+    """ (name, statements) creating the symmetric adjacency table of
+    undirected edge table `table_name`: one (node_id, other_id, edge_id) row
+    per end of every edge (one for self loops), clustered on its primary
+    key and kept in sync by triggers """
+    names = dict(adjacency=adjacency_table_name(table_name), table=table_name)
+    add = ("INSERT OR IGNORE INTO {adjacency} VALUES (new.source_id, new.target_id, new.id); "
+        "INSERT OR IGNORE INTO {adjacency} VALUES (new.target_id, new.source_id, new.id); ")
+    remove = ("DELETE FROM {adjacency} WHERE node_id IN (old.source_id, old.target_id) "
+        "AND other_id IN (old.source_id, old.target_id) AND edge_id = old.id; ")
+    statements = [
+        "CREATE TABLE IF NOT EXISTS {adjacency} (node_id INTEGER NOT NULL, other_id INTEGER NOT NULL, "
+            "edge_id INTEGER NOT NULL, PRIMARY KEY (node_id, other_id, edge_id)) WITHOUT ROWID",
+        "CREATE TRIGGER IF NOT EXISTS {table}_adjacency_ai AFTER INSERT ON {table} BEGIN " + add + "END",
+        "CREATE TRIGGER IF NOT EXISTS {table}_adjacency_ad AFTER DELETE ON {table} BEGIN " + remove + "END",
+        "CREATE TRIGGER IF NOT EXISTS {table}_adjacency_au AFTER UPDATE OF id, source_id, target_id "
+            "ON {table} BEGIN " + remove + add + "END",
+        ]
+    return names["adjacency"], [statement.format(**names) for statement in statements]
+
+class _Symmetric(object):
+    """ stand-in for an undirected edge class whose `__table__` lists every
+    edge once from each end, read from the adjacency table """
+    def __init__(self, mapped):
+        self.mapped = mapped
+        table = mapped.__table__
+        adjacency = _adjacency_table(table.name)
+        renamed = dict(id=adjacency.c.edge_id, source_id=adjacency.c.node_id,
+                target_id=adjacency.c.other_id)
+        self.__table__ = sqla.select([renamed[c.name].label(c.name) if c.name in renamed else c
+            for c in table.c], adjacency.c.edge_id == table.c.id).alias()
+
+    def __getattr__(self, name):
+        return getattr(self.mapped, name)
+
+def _swap_ends(edge):
+    """ reverse `edge` (columns and loaded relationships) in place """
+    state = orm.attributes.instance_state(edge)
+    edge.source_id, edge.target_id = edge.target_id, edge.source_id
+    if "source" in state.dict or "target" in state.dict:
+        source, target = state.dict.get("source"), state.dict.get("target")
+        orm.attributes.set_committed_value(edge, "source", target)
+        orm.attributes.set_committed_value(edge, "target", source)
+
+# generated classes, by the arguments they were generated from
+_class_cache = {}
+
+class _Identity(object):
+    """ cache key part that compares `obj` by identity (SQLAlchemy
+    expressions overload ==) """
+    __slots__ = ("obj",)
 
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __hash__(self):
+        return id(self.obj)
+
+    def __eq__(self, other):
+        return isinstance(other, _Identity) and other.obj is self.obj
+
+def _freeze(value):
+    """ hashable version of an argument to :func:`create_base_classes` """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if value is None or isinstance(value, (bool, int, float, str, type(u""))):
+        return value
+    return _Identity(value)
+
+def clear_class_cache():
+    """ forget the classes :func:`create_base_classes` generated, so the next
+    call generates new ones """
+    _class_cache.clear()
+
+_NODE_DOC = """ SQLAlchemy declarative base for a Node representation
+
+        Implements the BaseNode ABC:
+
+        {BaseNode}""".format(BaseNode=BaseNode.__doc__)
+
+_EDGE_DOC = """ SQLAlchemy declarative base for edge representation.
+
+        Implements the BaseEdgeABC:
+
+        {BaseEdge}""".format(BaseEdge=BaseEdge.__doc__)
 
 def create_base_classes( NodeClass, EdgeClass, NodeTable = None, EdgeTable =
-        None, Base = None, **kwargs):
+        None, Base = None, unique_edges = False, cascade_deletes = False,
+        multi_graph = False, temporal = False, label_index = None,
+        node_properties = None, edge_properties = None, index_properties = (),
+        undirected = False, weight_index = False, packed_adjacency = False, **kwargs):
     """ creates base classes (BaseEdge and BaseNode) for use as mixins for
     graph nodes and edges. ALL parameters must be strings convertible to
     unicode! Classes need to be subclassed/composited with a declarative_base
@@ -104,81 +347,745 @@ def create_base_classes( NodeClass, EdgeClass, NodeTable = None, EdgeTable =
                     added to the class type for you, thereby requiring
                     no subclassing on your part.
         :type Base: SQLAlchemy declarative base
+        :param bool unique_edges: (optional) add a unique index on
+                    (source_id, target_id, label), so there is at most one
+                    edge per label between two nodes. Edge labels become
+                    non-nullable (defaulting to u"") so that unlabeled
+                    edges collide too. Enables :meth:`Edge.bulk_upsert`.
+        :param bool cascade_deletes: (optional) declare `ON DELETE CASCADE`
+                    on the edge foreign keys (and cascade through the
+                    `in_edges`/`out_edges` relationships), so deleting a node
+                    deletes its edges instead of raising IntegrityError.
+        :param bool multi_graph: (optional) add a non-nullable `graph_id`
+                    column to both tables, so many independent graphs can
+                    share one schema. Every adjacency index is prefixed by
+                    `graph_id`, the `in_edges`/`out_edges` relationships join
+                    on it too (assigning `edge.source`/`edge.target` copies the
+                    node's `graph_id` to the edge), and :meth:`Node.in_graph`,
+                    :meth:`Node.drop_graph` and :meth:`Node.copy_graph` are
+                    enabled. Scope the set-based helpers to one graph with
+                    ``scoped(Edge, Edge.in_graph(gid))`` (see
+                    :func:`graphalchemy.traversal.scoped`) so their lookups use
+                    the prefixed indexes.
+        :param bool temporal: (optional) give edges a validity interval:
+                    `valid_from` (required, defaults to the UTC time of
+                    insertion) and `valid_to` (NULL while still valid). The
+                    adjacency indexes become (source_id, valid_from) and
+                    (target_id, valid_from), and :meth:`Edge.as_of`,
+                    :meth:`Node.neighbors_as_of` and :meth:`Edge.compact` are
+                    enabled. With `unique_edges`, the unique index includes
+                    `valid_from`, so an edge can have several intervals.
+        :param label_index: (optional) index node labels for
+                    :meth:`Node.find_by_label`: 'btree' adds an index on
+                    `label` (for prefix lookups); 'fts' also adds an FTS5
+                    table over the labels (for word and phrase queries),
+                    kept in sync by triggers on the node table.
+        :param dict node_properties: (optional) extra typed columns for the
+                    node table, as {name: SQLAlchemy type or Column}, e.g.
+                    ``{"kind": Unicode(20), "score": Float}``
+        :param dict edge_properties: (optional) same for the edge table
+        :param index_properties: (optional) names of properties to index:
+                    node properties get an index of their own, edge
+                    properties are indexed after source_id and after
+                    target_id, so :meth:`Node.find_neighbors` and
+                    :func:`~graphalchemy.traversal.expand_frontier` can
+                    filter on them while looking up adjacency.
+        :param bool undirected: (optional) store every edge canonically, with
+                    ``source_id <= target_id`` (swapped on flush, and
+                    enforced by a CHECK constraint, so set-based loaders
+                    must order the ends themselves), default `directed` to
+                    False, and keep a symmetric adjacency table
+                    (`<edge table>_adjacency`, maintained by triggers) so
+                    that :meth:`Node.neighbor_ids`, :meth:`Node.degree` and
+                    :meth:`Node.is_adjacent` are each a single index seek.
+                    :meth:`Edge.symmetric` lets the table-level helpers use
+                    it with direction 'out'.
+        :param bool weight_index: (optional) index edges on (source_id,
+                    weight) and (target_id, weight), so
+                    :meth:`Node.top_neighbors` reads only the `k` entries it
+                    returns.
+        :param bool packed_adjacency: (optional) keep a table with each
+                    node's neighbor ids (and weights) packed into one row
+                    per direction (`<edge table>_packed`, see
+                    :mod:`graphalchemy.packed`), patched on every flush and
+                    by the set-based methods, and filled with
+                    :meth:`Edge.rebuild_packed`, so
+                    :meth:`Node.packed_neighbors` reads a hub's neighbors
+                    with one row fetch. Requires NumPy.
 
     :returns: tuple of Node, Edge classes
     :rtype: (:class:`Node`, :class:`Edge`)
 
+    Classes are generated once per set of arguments: calling again with the
+    same arguments (and the same `Base`) returns the same classes, so
+    several parts of a program can ask for them without redefining the
+    tables (see :func:`clear_class_cache`). Mappers are configured lazily,
+    by SQLAlchemy, on first use.
+
     NOTE: To overwrite the default inheritance, you can pass in any SQLAlchemy
     classes used in creating the functions as a keyword argument::
 
         declared_attr, Column, Unicode, Integer, Float, Boolean,
-        relationship, backref, ForeignKey
+        relationship, backref, ForeignKey, Index, DateTime
 
             """
+    arguments = dict(locals())
+    key = _freeze(arguments)
+    if key not in _class_cache:
+        _class_cache[key] = _create_base_classes(**arguments)
+    return _class_cache[key]
+
+def _create_base_classes(NodeClass, EdgeClass, NodeTable, EdgeTable, Base, unique_edges,
+        cascade_deletes, multi_graph, temporal, label_index, node_properties,
+        edge_properties, index_properties, undirected, weight_index, packed_adjacency, kwargs):
     declared_attr = kwargs.get("declared_attr") or decl.declared_attr
     Column = kwargs.get("Column") or sqla.Column
     Integer = kwargs.get("Integer") or sqla.Integer
     Unicode = kwargs.get("Unicode") or sqla.Unicode
     Float = kwargs.get("Float") or sqla.Float
     Boolean = kwargs.get("Boolean") or sqla.Boolean
+    DateTime = kwargs.get("DateTime") or sqla.DateTime
     ForeignKey = kwargs.get("ForeignKey") or sqla.ForeignKey
+    Index = kwargs.get("Index") or sqla.Index
     relationship = kwargs.get("relationship") or orm.relationship
     backref = kwargs.get("backref") or orm.backref
+    packing = None
+    if packed_adjacency:
+        # NumPy encodes and decodes the packed rows
+        from graphalchemy import packed as packing
     # store inputted locals if provided
     NodeTable = NodeTable or class_to_tablename(NodeClass)
     EdgeTable = EdgeTable or class_to_tablename(EdgeClass)
     fdict = dict(NodeClass=NodeClass, EdgeClass=EdgeClass)
+    # with multi_graph, every index (and join) leads with graph_id
+    prefix = ("graph_id",) if multi_graph else ()
+    # and with temporal, adjacency indexes end with valid_from
+    suffix = ("valid_from",) if temporal else ()
+    # (name, columns, kwargs) for each index on the edge table. adjacency
+    # lookups go through the source_id/target_id indexes
+    edge_indexes = [
+        ("ix_%s_source_id" % EdgeTable, prefix + ("source_id",) + suffix, {}),
+        ("ix_%s_target_id" % EdgeTable, prefix + ("target_id",) + suffix, {}),
+        ]
+    node_indexes = []
+    if label_index not in (None, "btree", "fts"):
+        raise ValueError("label_index must be None, 'btree' or 'fts', not %r" % (label_index,))
+    if label_index:
+        node_indexes.append(("ix_%s_label" % NodeTable, ("label",), {}))
+    node_properties = node_properties or {}
+    edge_properties = edge_properties or {}
+    for name in index_properties:
+        if name not in node_properties and name not in edge_properties:
+            raise ValueError("Can only index declared properties, not %r" % (name,))
+        if name in node_properties:
+            node_indexes.append(("ix_%s_%s" % (NodeTable, name), prefix + (name,), {}))
+        if name in edge_properties:
+            for end in ("source_id", "target_id"):
+                edge_indexes.append(("ix_%s_%s_%s" % (EdgeTable, end, name), prefix + (end, name), {}))
+    if multi_graph:
+        node_indexes.append(("ix_%s_graph_id" % NodeTable, ("graph_id", "id"), {}))
+        joins = dict((end, "and_({NodeClass}.id == {EdgeClass}.{end}_id, "
+            "{NodeClass}.graph_id == {EdgeClass}.graph_id)".format(end=end, **fdict))
+            for end in ("source", "target"))
+        foreign_keys = dict((end, "[{EdgeClass}.{end}_id, {EdgeClass}.graph_id]".format(
+            end=end, **fdict)) for end in ("source", "target"))
+    else:
+        joins = dict((end, "{NodeClass}.id == {EdgeClass}.{end}_id".format(end=end, **fdict))
+            for end in ("source", "target"))
+        foreign_keys = dict(source=None, target=None)
+    # ON DELETE CASCADE for the edge foreign keys, if asked for
+    fk_options = dict(ondelete="CASCADE") if cascade_deletes else {}
+    backref_options = dict(cascade="all, delete-orphan", passive_deletes=True) if cascade_deletes else {}
+    if weight_index:
+        for end in ("source_id", "target_id"):
+            edge_indexes.append(("ix_%s_%s_weight" % (EdgeTable, end), prefix + (end, "weight"), {}))
+    if unique_edges:
+        edge_indexes.append(("uq_%s_source_target_label" % EdgeTable,
+            prefix + ("source_id", "target_id", "label") + suffix, dict(unique=True)))
 
     class _Node(BaseNode):
-        """ SQLAlchemy declarative base for a Node representation
-
-        Implements the BaseNode ABC:
-
-        {BaseNode}""".format(BaseNode=BaseNode.__doc__)
+        __doc__ = _NODE_DOC
         __tablename__ = NodeTable
+
+        @declared_attr
+        def __table_args__(self):
+            indexes = tuple(Index(name, *columns, **kw) for name, columns, kw in node_indexes)
+            if label_index == "fts":
+                # the FTS table and its triggers follow the label index's table
+                label = [ix for ix in indexes if ix.name == "ix_%s_label" % NodeTable][0]
+                sqla.event.listen(label, "after_parent_attach", _attach_auxiliary(_label_fts_ddl))
+            return indexes
         id = Column(Integer, primary_key=True) # gephi (req)
         size = Column(Integer) # gephi (optional)
         label = Column(Unicode) # gephi (optional)
         color = Column(Unicode(10))
 
+        @classmethod
+        def bulk_delete(cls, session, ids, cascade_edges=True, chunk=CHUNKSIZE):
+            """ delete the nodes with the given ids (and, with `cascade_edges`,
+            every edge touching them) using set-based DELETE statements, without
+            loading anything through the ORM.
 
+            The ids are bound into `IN (...)` lists of up to `chunk` ids, and
+            everything runs in the session's transaction (no DDL, so nothing
+            pending is committed behind the caller's back). Objects for
+            deleted rows are expunged from `session`,
+            and the `in_edges`/`out_edges` of nodes still in the session are
+            expired. The deletes go through `Query.delete`, so SQLAlchemy's
+            `after_bulk_delete` session event fires for each of them.
 
-    class _Edge(BaseEdge):
-        """ SQLAlchemy declarative base for edge representation.
+                :param session: SQLAlchemy session (not committed)
+                :param ids: iterable of node ids
+                :param bool cascade_edges: delete edges touching the nodes first.
+                            If False, remaining edges make the node delete fail
+                            with IntegrityError (when foreign keys are enforced),
+                            unless the classes were created with `cascade_deletes`.
+                :returns: (nodes_deleted, edges_deleted)
+            """
+            ids = set(ids)
+            if not ids:
+                return 0, 0
+            Edge = cls._edge_class()
+            edges_deleted = nodes_deleted = 0
+            touched = set(ids)
+            for selected in chunked(sorted(ids), chunk):
+                groups = [(None, selected)]
+                if multi_graph and (cascade_edges or packed_adjacency):
+                    # the edge indexes lead with graph_id, so delete per graph
+                    by_graph = collections.defaultdict(list)
+                    for node_id, graph_id in session.execute(sqla.select(
+                            [cls.__table__.c.id, cls.__table__.c.graph_id], cls.id.in_(selected))):
+                        by_graph[graph_id].append(node_id)
+                    groups = sorted(by_graph.items())
+                for graph_id, group in groups:
+                    # one statement per column, so each can use its own index
+                    for column in (Edge.source_id, Edge.target_id):
+                        criterion = column.in_(group)
+                        if multi_graph:
+                            criterion = sqla.and_(Edge.graph_id == graph_id, criterion)
+                        if packed_adjacency:
+                            touched |= _endpoints(session, Edge.__table__, criterion)
+                        if cascade_edges:
+                            edges_deleted += session.query(Edge).filter(criterion
+                                    ).delete(synchronize_session=False)
+                nodes_deleted += session.query(cls).filter(cls.id.in_(selected)
+                        ).delete(synchronize_session=False)
+            for obj in list(session.identity_map.values()):
+                state = orm.attributes.instance_state(obj)
+                if isinstance(obj, cls):
+                    if state.key[1][0] in ids:
+                        session.expunge(obj)
+                    else:
+                        session.expire(obj, ["in_edges", "out_edges"])
+                elif isinstance(obj, Edge) and (state.dict.get("source_id") in ids
+                        or state.dict.get("target_id") in ids):
+                    session.expunge(obj)
+            if packed_adjacency:
+                packing.refresh(session, Edge, touched)
+            return nodes_deleted, edges_deleted
 
-        Implements the BaseEdgeABC:
+        @classmethod
+        def find_by_label(cls, session, prefix=None, match=None, limit=None):
+            """ ids of the nodes whose label starts with `prefix` and/or
+            matches the FTS5 query `match` (e.g. ``u'alpha OR "beta gamma"'``
+            or ``u'alph*'``), without scanning the node table. Prefix lookups
+            are a range scan of the label index and come back in label
+            order; `match` alone comes back best match first. Requires
+            `label_index` ('fts' for `match`).
+
+                :param session: SQLAlchemy session
+                :param unicode prefix: (optional) start of the whole label
+                :param unicode match: (optional) FTS5 query
+                :param int limit: (optional) return at most `limit` ids
+                :returns: list of node ids
+            """
+            if not cls.label_index:
+                raise ValueError("find_by_label requires create_base_classes(..., label_index=...)")
+            if prefix is None and match is None:
+                raise ValueError("Need a prefix or a match")
+            table = cls.__table__
+            if match is not None:
+                if cls.label_index != "fts":
+                    raise ValueError("match requires create_base_classes(..., label_index='fts')")
+                fts = sqla.sql.table(label_fts_table(table.name), sqla.sql.column("rowid"), sqla.sql.column("rank"))
+                matched = sqla.select([fts.c.rowid], sqla.literal_column(
+                    '"%s"' % fts.name).match(match))
+            if prefix is None:
+                query = matched.order_by(fts.c.rank)
+            else:
+                query = sqla.select([table.c.id], table.c.label >= prefix
+                        ).order_by(table.c.label, table.c.id)
+                if prefix:
+                    # everything up to the next possible prefix
+                    query = query.where(table.c.label < prefix[:-1] + u"%c" % (ord(prefix[-1]) + 1))
+                if match is not None:
+                    query = query.where(table.c.id.in_(matched))
+            if limit is not None:
+                query = query.limit(limit)
+            return [row[0] for row in session.execute(query)]
+
+        @classmethod
+        def rebuild_label_index(cls, session):
+            """ rebuild the FTS5 label table from the node table (e.g. after
+            the table was filled before the index existed; the FTS table
+            and its triggers are created first if they don't exist).
+            Requires `label_index='fts'`. """
+            if cls.label_index != "fts":
+                raise ValueError("rebuild_label_index requires create_base_classes(..., label_index='fts')")
+            _ensure_auxiliary(session, cls.__table__)
+            fts = label_fts_table(cls.__table__.name)
+            session.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (fts, fts))
+
+        def top_neighbors(self, k, by="weight", direction="out"):
+            """ the `k` neighbors joined to this node by the edges with the
+            largest `by` (weight by default), heaviest first, as a list of
+            (neighbor_id, value). O(k) with `weight_index`; see
+            :func:`graphalchemy.traversal.top_neighbors` for many nodes at
+            once. """
+            session = orm.object_session(self)
+            return top_neighbors(session, self._graph_edges(type(self)._edge_class()),
+                    [self.id], k, by, direction)[self.id]
+
+        def _graph_edges(self, Edge):
+            """ `Edge`, scoped to this node's graph with `multi_graph`, so
+            that lookups seek the indexes leading with graph_id """
+            if not self.multi_graph:
+                return Edge
+            return scoped(Edge, type(self)._edge_class().graph_id == self.graph_id)
+
+        def _adjacency(self):
+            if not self.undirected:
+                raise ValueError("adjacency lookups require create_base_classes(..., undirected=True)")
+            return _adjacency_table(type(self)._edge_class().__table__.name)
+
+        def neighbor_ids(self):
+            """ sorted list of the distinct ids adjacent to this node (itself
+            too, if it has a self loop), with one seek of the adjacency
+            table. Requires `undirected`. """
+            adjacency = self._adjacency()
+            query = sqla.select([adjacency.c.other_id], adjacency.c.node_id == self.id
+                    ).distinct().order_by(adjacency.c.other_id)
+            return [row[0] for row in orm.object_session(self).execute(query)]
+
+        def degree(self):
+            """ number of edges touching this node (a self loop counts once),
+            with one seek of the adjacency table. Requires `undirected`. """
+            adjacency = self._adjacency()
+            return orm.object_session(self).execute(sqla.select([sqla.func.count()],
+                adjacency.c.node_id == self.id)).scalar()
+
+        def is_adjacent(self, other):
+            """ whether an edge joins this node and `other` (a node or id),
+            with one seek of the adjacency table. Requires `undirected`. """
+            adjacency = self._adjacency()
+            query = sqla.select([adjacency.c.edge_id], sqla.and_(adjacency.c.node_id == self.id,
+                adjacency.c.other_id == getattr(other, "id", other))).limit(1)
+            return orm.object_session(self).execute(query).first() is not None
+
+        def packed_neighbors(self, direction="out"):
+            """ (ids, weights) NumPy arrays of this node's neighbors (one
+            entry per edge, sorted by id), decoded from one row of the
+            packed adjacency table per direction. Requires
+            `packed_adjacency`. """
+            if not self.packed_adjacency:
+                raise ValueError("packed_neighbors requires create_base_classes(..., packed_adjacency=True)")
+            return packing.read_neighbors(orm.object_session(self), type(self)._edge_class(),
+                    [self.id], direction)[self.id]
+
+        @classmethod
+        def _edge_class(cls):
+            return orm.class_mapper(cls).get_property("out_edges").mapper.class_
+
+        def neighbors_as_of(self, t, direction="both"):
+            """ list of the nodes joined to this one by edges valid at time
+            `t` (see :meth:`Edge.as_of`), found with set-based selects on the
+            (source_id, valid_from)/(target_id, valid_from) indexes. Requires
+            `temporal`.
+
+                :param direction: 'out', 'in' or 'both'
+            """
+            return self._load_neighbors(type(self)._edge_class().as_of(t), direction)
+
+        def find_neighbors(self, where=None, edge_where=None, direction="both"):
+            """ list of the nodes adjacent to this one that match `where`,
+            through edges that match `edge_where`, e.g.
+            ``node.find_neighbors(Node.kind == u"person", Edge.weight > 1)``.
+            Both criteria go into the adjacency selects, so with
+            `index_properties` the lookup stays on the indexes.
+
+                :param where: (optional) criterion on the node columns
+                :param edge_where: (optional) criterion on the edge columns
+                :param direction: 'out', 'in' or 'both'
+            """
+            Edge = type(self)._edge_class()
+            if edge_where is not None:
+                Edge = scoped(Edge, edge_where)
+            return self._load_neighbors(Edge, direction, where)
+
+        def _load_neighbors(self, Edge, direction, where=None):
+            cls = type(self)
+            session = orm.object_session(self)
+            ids = expand_frontier(session, self._graph_edges(Edge), [self.id], direction,
+                    Node=cls, where=where)
+            found = []
+            for chunk in chunked(ids):
+                found.extend(session.query(cls).filter(cls.id.in_(chunk)))
+            return found
+
+        @classmethod
+        def _check_multi_graph(cls):
+            if not cls.multi_graph:
+                raise ValueError("graph operations require create_base_classes(..., multi_graph=True)")
+
+        @classmethod
+        def in_graph(cls, graph_id):
+            """ filter criterion for the rows of one graph, e.g.
+            ``session.query(Node).filter(Node.in_graph(3))``. Requires
+            `multi_graph`. """
+            cls._check_multi_graph()
+            return cls.graph_id == graph_id
+
+        @classmethod
+        def drop_graph(cls, session, graph_id):
+            """ delete every node and edge of one graph with two set-based
+            DELETEs (edges first), using the `graph_id` indexes. Objects for
+            deleted rows are expunged from `session`. Requires `multi_graph`.
+
+                :param session: SQLAlchemy session (not committed)
+                :returns: (nodes_deleted, edges_deleted)
+            """
+            cls._check_multi_graph()
+            Edge = cls._edge_class()
+            if packed_adjacency:
+                touched = _endpoints(session, Edge.__table__, Edge.graph_id == graph_id)
+            edges_deleted = session.query(Edge).filter(Edge.graph_id == graph_id
+                    ).delete(synchronize_session=False)
+            nodes_deleted = session.query(cls).filter(cls.graph_id == graph_id
+                    ).delete(synchronize_session=False)
+            for obj in list(session.identity_map.values()):
+                if isinstance(obj, (cls, Edge)) and orm.attributes.instance_state(
+                        obj).dict.get("graph_id") == graph_id:
+                    session.expunge(obj)
+            if packed_adjacency:
+                packing.refresh(session, Edge, touched)
+            return nodes_deleted, edges_deleted
+
+        @classmethod
+        def copy_graph(cls, session, graph_id, new_graph_id):
+            """ copy every node and edge of one graph into `new_graph_id` with
+            two `INSERT ... SELECT` statements, without loading anything.
+            Copied nodes get new ids, offset past the current largest id, and
+            copied edges are re-pointed at them. All other columns (including
+            any added by subclasses on the same tables) are copied as they
+            are. Requires `multi_graph`.
+
+                :param session: SQLAlchemy session (not committed)
+                :returns: (nodes_copied, edges_copied)
+            """
+            cls._check_multi_graph()
+            Edge = cls._edge_class()
+            nodes, edges = cls.__table__, Edge.__table__
+            first, last = session.execute(sqla.select([sqla.func.min(nodes.c.id),
+                sqla.func.max(nodes.c.id)]).where(nodes.c.graph_id == graph_id)).first()
+            if first is None:
+                return 0, 0
+            largest = session.execute(sqla.select([sqla.func.max(nodes.c.id)])).scalar()
+            offset = largest + 1 - first
+            replaced = {"id": nodes.c.id + offset, "source_id": edges.c.source_id + offset,
+                    "target_id": edges.c.target_id + offset}
+            copied = []
+            for table in (nodes, edges):
+                columns = [c for c in table.c if not (table is edges and c.name == "id")]
+                selected = [sqla.literal(new_graph_id) if c.name == "graph_id"
+                        else replaced.get(c.name, c) for c in columns]
+                copied.append(session.execute(_InsertFromSelect(table, [c.name for c in columns],
+                    sqla.select(selected, table.c.graph_id == graph_id))).rowcount)
+            if packed_adjacency:
+                packing.refresh(session, Edge, set(node_id + offset for node_id in
+                    _endpoints(session, edges, edges.c.graph_id == graph_id)))
+            return tuple(copied)
+
+
+    class _Edge(BaseEdge):
+        __doc__ = _EDGE_DOC
 
-        {BaseEdge}""".format(BaseEdge=BaseEdge.__doc__)
         @declared_attr
         def __tablename__(self):
             return EdgeTable
+
+        @declared_attr
+        def __table_args__(self):
+            # fresh Index objects for every table the mixin ends up on
+            args = tuple(Index(name, *columns, **kw) for name, columns, kw in edge_indexes)
+            if undirected:
+                canonical = sqla.CheckConstraint("source_id <= target_id",
+                        name="ck_%s_canonical" % EdgeTable)
+                # the adjacency table and its triggers follow the edge table
+                sqla.event.listen(canonical, "after_parent_attach", _attach_auxiliary(_adjacency_ddl))
+                args += (canonical,)
+            if packed_adjacency:
+                # the packed table follows the source_id index's table
+                sqla.event.listen(args[0], "after_parent_attach",
+                        _attach_auxiliary(packing.packed_ddl))
+            return args
         id = Column(Integer, primary_key=True)
 
         size = Column(Integer) # gephi (optional)
-        label = Column(Unicode) # gephi (optional)
+        label = Column(Unicode, nullable=not unique_edges,
+                default=u"" if unique_edges else None) # gephi (optional)
         weight = Column(Float) # gephi (optional)
         color = Column(Unicode(10))
         directed = Column(Boolean) # choices are 0, 1
 
         @declared_attr
         def source_id(self):
-            return Column(Integer, ForeignKey(NodeTable + ".id"), nullable=False)
+            return Column(Integer, ForeignKey(NodeTable + ".id", **fk_options), nullable=False)
 
         @declared_attr
         def target_id(self):
-            return Column(Integer, ForeignKey(NodeTable + ".id"), nullable=False)
+            return Column(Integer, ForeignKey(NodeTable + ".id", **fk_options), nullable=False)
 
         @declared_attr
         def source(self):
             return relationship(NodeClass,
-                    primaryjoin="{NodeClass}.id == {EdgeClass}.source_id".format(**fdict), uselist=False,
-                    backref=backref("out_edges"))
+                    primaryjoin=joins["source"], foreign_keys=foreign_keys["source"], uselist=False,
+                    backref=backref("out_edges", **backref_options))
 
         @declared_attr
         def target(self):
             return relationship(NodeClass,
-                primaryjoin="{NodeClass}.id == {EdgeClass}.target_id".format(**fdict), uselist=False,
-                backref=backref("in_edges"))
+                primaryjoin=joins["target"], foreign_keys=foreign_keys["target"], uselist=False,
+                backref=backref("in_edges", **backref_options))
+
+        @classmethod
+        def between(cls, a, b):
+            """ filter criterion for the edges joining nodes (or ids) `a` and
+            `b`, in either order. With `undirected` that's a single seek on
+            the canonical (source_id, target_id) order. """
+            a, b = getattr(a, "id", a), getattr(b, "id", b)
+            if cls.undirected:
+                a, b = min(a, b), max(a, b)
+                return sqla.and_(cls.source_id == a, cls.target_id == b)
+            return sqla.or_(sqla.and_(cls.source_id == a, cls.target_id == b),
+                    sqla.and_(cls.source_id == b, cls.target_id == a))
+
+        @classmethod
+        def _check_undirected(cls):
+            if not cls.undirected:
+                raise ValueError("symmetric lookups require create_base_classes(..., undirected=True)")
+
+        @classmethod
+        def symmetric(cls):
+            """ stand-in for this class that sees every edge from both ends
+            (source_id is the near end), read from the adjacency table, for
+            the table-level helpers with direction 'out', e.g.
+            ``k_hop(session, Edge.symmetric(), node, 2, "out")``. Requires
+            `undirected`. """
+            cls._check_undirected()
+            return _Symmetric(cls)
+
+        @classmethod
+        def rebuild_adjacency(cls, session):
+            """ refill the adjacency table from the edge table (e.g. after
+            turning `undirected` on for an existing table, once its edges
+            are canonical; the adjacency table and its triggers are created
+            first if they don't exist). Requires `undirected`. """
+            cls._check_undirected()
+            table = cls.__table__
+            _ensure_auxiliary(session, table)
+            adjacency = _adjacency_table(table.name)
+            session.execute(adjacency.delete())
+            session.execute(_InsertFromSelect(adjacency, ["node_id", "other_id", "edge_id"],
+                sqla.union(sqla.select([table.c.source_id, table.c.target_id, table.c.id]),
+                    sqla.select([table.c.target_id, table.c.source_id, table.c.id]))))
+
+        @classmethod
+        def rebuild_packed(cls, session, node_ids=None):
+            """ refill the packed adjacency rows of `node_ids` (default:
+            every node) from the edge table, e.g. after set-based writes.
+            Creates the packed table first (and fills it for every node)
+            if the database predates `packed_adjacency`. Requires
+            `packed_adjacency`. """
+            if not cls.packed_adjacency:
+                raise ValueError("rebuild_packed requires create_base_classes(..., packed_adjacency=True)")
+            if _ensure_auxiliary(session, cls.__table__):
+                node_ids = None
+            packing.rebuild(session, cls, node_ids)
+
+        @classmethod
+        def in_graph(cls, graph_id):
+            """ filter criterion for the edges of one graph. Requires `multi_graph`. """
+            if not cls.multi_graph:
+                raise ValueError("graph operations require create_base_classes(..., multi_graph=True)")
+            return cls.graph_id == graph_id
+
+        @classmethod
+        def _check_temporal(cls):
+            if not cls.temporal:
+                raise ValueError("time slicing requires create_base_classes(..., temporal=True)")
+
+        @classmethod
+        def valid_at(cls, t):
+            """ filter criterion for the edges valid at time `t`:
+            ``valid_from <= t`` and `valid_to` NULL or after `t`. Requires
+            `temporal`. """
+            cls._check_temporal()
+            return sqla.and_(cls.valid_from <= t, sqla.or_(cls.valid_to == None, cls.valid_to > t))
+
+        @classmethod
+        def as_of(cls, t):
+            """ stand-in for this class that only sees the edges valid at time
+            `t`, for the table-level helpers (k-hop, snapshots, export...),
+            e.g. ``k_hop(session, Edge.as_of(t), node, 2)`` or
+            ``write_gexf(session, Node, Edge.as_of(t), fp)``. Nothing is
+            copied: every statement just filters on `valid_from`/`valid_to`.
+            Requires `temporal`. See :func:`graphalchemy.traversal.scoped`. """
+            return scoped(cls, cls.valid_at(t))
+
+        @classmethod
+        def compact(cls, session, before):
+            """ delete the edges that expired (`valid_to`) at or before
+            `before`, with one set-based DELETE. Requires `temporal`.
+
+                :param session: SQLAlchemy session (not committed)
+                :returns: number of edges deleted
+            """
+            cls._check_temporal()
+            expired = sqla.and_(cls.valid_to != None, cls.valid_to <= before)
+            if packed_adjacency:
+                touched = _endpoints(session, cls.__table__, expired)
+            removed = session.query(cls).filter(expired).delete(synchronize_session=False)
+            for obj in list(session.identity_map.values()):
+                if isinstance(obj, cls):
+                    valid_to = orm.attributes.instance_state(obj).dict.get("valid_to")
+                    if valid_to is not None and valid_to <= before:
+                        session.expunge(obj)
+            if packed_adjacency:
+                packing.refresh(session, cls, touched)
+            return removed
+
+        @classmethod
+        def bulk_upsert(cls, session, rows, merge="sum", chunk=10000):
+            """ insert edges with a single `INSERT ... ON CONFLICT` statement per
+            `chunk` rows (SQLite 3.24+). Edges that already exist for
+            (source_id, target_id, label) aren't duplicated; instead their
+            weight is merged with the incoming weight. Requires `unique_edges`.
+
+                :param session: SQLAlchemy session (not committed)
+                :param rows: iterable of dicts with `source_id`, `target_id`
+                             (and `graph_id` with `multi_graph`) and optionally
+                             `label`, `weight`, `size`, `color`, `directed`
+                             (and `valid_from`, `valid_to` with `temporal`)
+                :param merge: 'sum' adds the weights, 'max' keeps the larger
+                              weight, 'replace' keeps the incoming weight
+                :returns: number of rows processed
+                :raises: ValueError if the class wasn't created with
+                         `unique_edges=True` or `merge` is unknown
+            """
+            if not cls.unique_edges:
+                raise ValueError("bulk_upsert requires create_base_classes(..., unique_edges=True)")
+            _check_merge(merge)
+            table = cls.__table__
+            quoted = session.get_bind(None).dialect.identifier_preparer.format_table(table)
+            key = prefix + ("source_id", "target_id", "label") + suffix
+            columns = key + ("weight", "size", "color", "directed") + (("valid_to",) if temporal else ())
+            statement = sqla.text(
+                    "INSERT INTO {table} ({columns}) VALUES ({values}) "
+                    "ON CONFLICT ({key}) DO UPDATE SET weight = {merge}".format(
+                        table=quoted, columns=", ".join(columns), key=", ".join(key),
+                        values=", ".join(":" + c for c in columns),
+                        merge=UPSERT_MERGES[merge].format(table=quoted)))
+            count = 0
+            now = datetime.datetime.utcnow()
+            touched = set()
+            for rows_chunk in chunked(rows, chunk):
+                params = [dict((c, row.get(c)) for c in columns) for row in rows_chunk]
+                for row in params:
+                    if row["label"] is None:
+                        row["label"] = u""
+                    if undirected and row["source_id"] > row["target_id"]:
+                        row["source_id"], row["target_id"] = row["target_id"], row["source_id"]
+                    if temporal and row["valid_from"] is None:
+                        row["valid_from"] = now
+                session.execute(statement, params)
+                count += len(params)
+                if packed_adjacency:
+                    touched.update(row[end] for row in params for end in ("source_id", "target_id"))
+            if packed_adjacency:
+                packing.refresh(session, cls, touched)
+            return count
+
+        @classmethod
+        def collapse_parallel_edges(cls, session, merge="sum"):
+            """ merge every group of edges sharing (source_id, target_id, label)
+            into the edge with the lowest id, using one GROUP BY to find the
+            groups and set-based UPDATE/DELETE statements to compact them.
+            Weights are merged as in :meth:`bulk_upsert` ('replace' keeps the
+            weight of the newest edge). With `unique_edges`, NULL labels are
+            set to u"" first and the unique index is created if it is missing,
+            which makes this the migration path for existing databases.
+
+                :param session: SQLAlchemy session (not committed)
+                :returns: number of edges removed
+            """
+            _check_merge(merge)
+            table = cls.__table__
+            if cls.unique_edges:
+                session.execute(table.update().where(table.c.label == None).values(label=u""))
+            key = [table.c[name] for name in prefix + ("source_id", "target_id", "label") + suffix]
+            groups = sqla.select([sqla.func.min(table.c.id), sqla.func.max(table.c.id),
+                sqla.func.sum(table.c.weight), sqla.func.max(table.c.weight),
+                table.c.source_id, table.c.target_id]
+                ).group_by(*key).having(sqla.func.count() > 1)
+            groups = session.execute(groups).fetchall()
+            if merge == "replace":
+                newest = {}
+                for ids in chunked([g[1] for g in groups]):
+                    newest.update(session.execute(sqla.select([table.c.id, table.c.weight],
+                        table.c.id.in_(ids))).fetchall())
+                merged = [(g[0], newest[g[1]]) for g in groups]
+            elif merge == "max":
+                merged = [(g[0], g[3]) for g in groups]
+            else:
+                merged = [(g[0], g[2]) for g in groups]
+            if merged:
+                session.execute(table.update().where(table.c.id == sqla.bindparam("keep_id")
+                    ).values(weight=sqla.bindparam("merged_weight")),
+                    [dict(keep_id=i, merged_weight=w) for i, w in merged])
+            keepers = sqla.select([sqla.func.min(table.c.id)]).group_by(*key)
+            removed = session.execute(table.delete().where(~table.c.id.in_(keepers))).rowcount
+            if cls.unique_edges:
+                ensure_indexes(session.connection(), table)
+            if packed_adjacency:
+                packing.refresh(session, cls, set(g[4] for g in groups) | set(g[5] for g in groups))
+            return removed
+
+    _Edge.unique_edges = unique_edges
+    _Node.multi_graph = _Edge.multi_graph = multi_graph
+    _Node.label_index = label_index
+    _Node.undirected = _Edge.undirected = undirected
+    if undirected:
+        _Edge.directed = Column(Boolean, default=False)
+        def canonical_order(mapper, connection, edge):
+            """ store undirected edges with source_id <= target_id """
+            if (isinstance(edge, _Edge) and edge.source_id is not None
+                    and edge.target_id is not None and edge.source_id > edge.target_id):
+                _swap_ends(edge)
+        for when in ("before_insert", "before_update"):
+            sqla.event.listen(orm.mapper, when, canonical_order)
+    _Node.packed_adjacency = _Edge.packed_adjacency = packed_adjacency
+    _Edge.temporal = temporal
+    if temporal:
+        _Edge.valid_from = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+        _Edge.valid_to = Column(DateTime)
+    if multi_graph:
+        _Node.graph_id = Column(Integer, nullable=False)
+        _Edge.graph_id = Column(Integer, nullable=False)
+    for cls, properties in [(_Node, node_properties), (_Edge, edge_properties)]:
+        for name, spec in sorted(properties.items()):
+            if hasattr(cls, name):
+                raise ValueError("Property %r would shadow %s.%s" % (name, cls.__name__, name))
+            setattr(cls, name, spec.copy() if isinstance(spec, sqla.Column) else Column(spec))
 
     # if given a base class then return a fully functional class
     if Base:
@@ -193,11 +1100,13 @@ def create_flask_classes(
         EdgeClass,
         NodeTable = None,
         EdgeTable = None,
+        **options
         ):
     """ Convenience method for creating Node and Edge base classes for use with
     :mod:`Flask-SQLAlchemy`. Has nearly the same signature as :meth:`create_base_classes`
     But does not take in any overriding methods. Only NodeClass and EdgeClass
-    are required.
+    are required. Any other `options` (e.g. `unique_edges=True`) are passed
+    through to :meth:`create_base_classes`.
 
     The one required parameter is `db`, which you must create first from the
     sqlalchemy directions.  Example usage:
@@ -237,6 +1146,9 @@ def create_flask_classes(
         Float = db.Float,
         Boolean = db.Boolean,
         ForeignKey = db.ForeignKey,
+        DateTime = db.DateTime,
+        Index = db.Index,
         relationship = db.relationship,
         backref = db.backref,
+        **options
         )
@@ -0,0 +1,320 @@
+"""
+Traversal:
+
+    set-based traversal helpers that work directly against the edge table of
+    classes created with :func:`graphalchemy.sqlmodels.create_base_classes`.
+
+    Instead of following `in_edges`/`out_edges` one node at a time (one lazy
+    load per node), these expand a whole frontier of node ids with a handful
+    of `IN (...)` selects, and weighted searches page adjacency lists in a
+    batch of nodes at a time.
+"""
+import collections
+import heapq
+import itertools
+import sqlalchemy as sqla
+
+# stay well under SQLite's default limit of 999 bound parameters
+CHUNKSIZE = 500
+# nodes per top_neighbors statement (SQLite allows 500 terms in a compound select)
+TOP_CHUNKSIZE = 200
+DIRECTIONS = ("out", "in", "both")
+
+def chunked(seq, size=CHUNKSIZE):
+    """ generator that splits any iterable into lists of at most `size` items """
+    seq = iter(seq)
+    chunk = list(itertools.islice(seq, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(seq, size))
+
+def check_direction(direction):
+    """ raises ValueError if `direction` isn't one of 'out', 'in' or 'both' """
+    if direction not in DIRECTIONS:
+        raise ValueError("direction must be one of %r, not %r" % (DIRECTIONS, direction))
+
+class Scoped(object):
+    """ stand-in for a mapped Node or Edge class whose `__table__` is the
+    class's table filtered by `criteria`. Everything that reads `__table__`
+    directly (the functions here, CSR snapshots, export...) then only sees
+    the matching rows; e.g. the edges of one graph::
+
+        >>> edges = scoped(Edge, Edge.graph_id == 3)
+        >>> k_hop(session, edges, node_id, 2)
+
+    The filter is a subquery that SQLite flattens into each statement, so
+    indexes led by the filtered columns still apply.
+    """
+    def __init__(self, mapped, criteria):
+        self.mapped = mapped
+        self.criteria = tuple(criteria)
+        table = getattr(mapped, "__table__", mapped)
+        self.__table__ = sqla.select([table], sqla.and_(*self.criteria)).alias()
+
+    def __getattr__(self, name):
+        return getattr(self.mapped, name)
+
+def scoped(mapped, *criteria):
+    """ :class:`Scoped` stand-in for `mapped` (a class, or an already scoped
+    one, whose criteria are kept) restricted to rows matching `criteria` """
+    if isinstance(mapped, Scoped):
+        return Scoped(mapped.mapped, mapped.criteria + criteria)
+    return Scoped(mapped, criteria)
+
+def expand_frontier(session, Edge, ids, direction="both", Node=None, where=None):
+    """ returns the set of ids adjacent to any of the node ids in `ids`.
+
+        :param session: SQLAlchemy session (or anything with `execute`)
+        :param Edge: mapped edge class (needs `__table__`, see :func:`scoped`)
+        :param ids: iterable of node ids
+        :param direction: 'out' follows source -> target, 'in' follows
+                          target -> source, 'both' does both (like
+                          :meth:`~graphalchemy.basemodels.BaseNode.neighbors`)
+        :param Node: (optional) mapped node class `where` refers to
+        :param where: (optional) criterion on `Node`'s columns that the
+                      neighbors must match, e.g. ``Node.kind == u"person"``;
+                      it's joined into the same selects. (To filter on the
+                      edges' columns, pass ``scoped(Edge, criterion)``.)
+        :rtype: set
+    """
+    check_direction(direction)
+    if where is not None and Node is None:
+        raise ValueError("Need the Node class to filter neighbors with where")
+    found = set()
+    for chunk in chunked(ids):
+        for query in _frontier_queries(Edge.__table__, chunk, direction, Node, where):
+            found.update(row[0] for row in session.execute(query))
+    return found
+
+def _ends(table, direction):
+    """ (near, far) edge columns to follow for `direction` """
+    ends = []
+    if direction in ("out", "both"):
+        ends.append((table.c.source_id, table.c.target_id))
+    if direction in ("in", "both"):
+        ends.append((table.c.target_id, table.c.source_id))
+    return ends
+
+def _frontier_queries(table, chunk, direction, Node=None, where=None):
+    """ the selects :func:`expand_frontier` runs for one chunk of ids """
+    queries = []
+    for near, far in _ends(table, direction):
+        criteria = [near.in_(chunk)]
+        if where is not None:
+            criteria += [Node.__table__.c.id == far, where]
+        queries.append(sqla.select([far], sqla.and_(*criteria)))
+    return queries
+
+def _adjacency_queries(table, chunk, direction):
+    """ the selects :meth:`Adjacency.load` runs for one chunk of ids """
+    return [sqla.select([near, far, table.c.weight], near.in_(chunk))
+            for near, far in _ends(table, direction)]
+
+def _top_queries(table, chunk, k, by, direction):
+    """ the selects :func:`top_neighbors` runs for one chunk of ids: for
+    each end, a UNION ALL of one `LIMIT k` select per node """
+    queries = []
+    for near, far in _ends(table, direction):
+        value = table.c[by]
+        arms = [sqla.select([near.label("node_id"), far.label("other_id"), value.label("value")],
+            near == node_id).order_by(value.desc()).limit(k).alias() for node_id in chunk]
+        queries.append(sqla.union_all(*[sqla.select([arm]) for arm in arms]))
+    return queries
+
+def top_neighbors(session, Edge, ids, k, by="weight", direction="out"):
+    """ the `k` neighbors with the largest `by` (an edge column) of every
+    node in `ids`, heaviest first (NULLs last). Each node gets its own
+    ``ORDER BY by DESC LIMIT k`` select, so with an index on (source_id,
+    by) and (target_id, by) (see `weight_index` and `index_properties` in
+    :func:`~graphalchemy.sqlmodels.create_base_classes`) SQLite reads k
+    index entries per node, backwards, whatever its degree; the selects
+    for up to `TOP_CHUNKSIZE` nodes go out as one statement.
+
+        :param Edge: mapped edge class (or a :func:`scoped` one)
+        :param ids: iterable of node ids
+        :param int k: neighbors per node
+        :param by: edge column to rank by
+        :param direction: 'out', 'in' or 'both' (the best `k` of both)
+        :returns: dict of {node_id: [(neighbor_id, value), ...]}
+    """
+    check_direction(direction)
+    found = {}
+    for chunk in chunked(set(ids), TOP_CHUNKSIZE):
+        for node_id in chunk:
+            found[node_id] = []
+        if k <= 0:
+            continue
+        for query in _top_queries(Edge.__table__, chunk, k, by, direction):
+            for node_id, other_id, value in session.execute(query):
+                found[node_id].append((other_id, value))
+    if direction == "both":
+        for node_id, neighbors in found.items():
+            # NULL ranks below everything, as in SQLite
+            neighbors.sort(key=lambda pair: (pair[1] is not None, pair[1]), reverse=True)
+            del neighbors[k:]
+    return found
+
+def k_hop(session, Edge, source, k, direction="both"):
+    """ breadth-first search out to `k` hops from `source`, expanding one
+    frontier per hop.
+
+        :param source: node instance or node id
+        :param k: maximum number of hops
+        :type k: int
+        :returns: dict of {node_id: hops} for every node reachable within `k`
+                  hops (not including `source` itself)
+    """
+    source = getattr(source, "id", source)
+    seen = {source: 0}
+    frontier = set([source])
+    for hop in range(1, k + 1):
+        frontier = expand_frontier(session, Edge, frontier, direction).difference(seen)
+        if not frontier:
+            break
+        for node_id in frontier:
+            seen[node_id] = hop
+    del seen[source]
+    return seen
+
+class Adjacency(object):
+    """ adjacency lists paged in from the edge table on demand, a batch of
+    nodes per select, with up to `cache_size` nodes kept in an LRU cache.
+    Share one between queries to reuse what earlier ones fetched (but throw
+    it away when the edges change).
+
+        :param session: SQLAlchemy session (or anything with `execute`)
+        :param Edge: mapped edge class
+        :param direction: 'out', 'in' or 'both'
+        :param default_weight: weight for edges whose weight is NULL
+        :param int cache_size: maximum number of nodes to keep lists for
+    """
+    def __init__(self, session, Edge, direction="out", default_weight=1.0, cache_size=100000):
+        check_direction(direction)
+        self.session = session
+        self.table = Edge.__table__
+        self.direction = direction
+        self.default_weight = default_weight
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+
+    def __contains__(self, node_id):
+        return node_id in self.cache
+
+    def __getitem__(self, node_id):
+        """ list of (neighbor_id, weight) for `node_id`, loading it if needed """
+        neighbors = self.cache.pop(node_id, None)
+        if neighbors is None:
+            neighbors = self.load([node_id])[node_id]
+            self.cache.pop(node_id, None)
+        # (re)insert at the most recently used end
+        self.cache[node_id] = neighbors
+        return neighbors
+
+    def load(self, ids):
+        """ fetch the adjacency lists of every id in `ids` that isn't cached,
+        returns a dict of the lists fetched """
+        ids = [i for i in set(ids) if i not in self.cache]
+        table = self.table
+        loaded = {}
+        for chunk in chunked(ids):
+            found = dict((node_id, []) for node_id in chunk)
+            for query in _adjacency_queries(table, chunk, self.direction):
+                for node_id, other_id, weight in self.session.execute(query):
+                    if weight is None:
+                        weight = self.default_weight
+                    found[node_id].append((other_id, weight))
+            self.cache.update(found)
+            loaded.update(found)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return loaded
+
+def _search(adjacency, source, target, cutoff, heuristic, batch):
+    """ Dijkstra (or A* with a `heuristic`) over an :class:`Adjacency`.
+    Returns (distances, predecessors) for every settled node """
+    distances = {}
+    predecessors = {source: None}
+    tentative = {source: 0}
+    heap = [(heuristic(source) if heuristic else 0, 0, source)]
+    while heap:
+        _, distance, node = heapq.heappop(heap)
+        if node in distances:
+            continue
+        distances[node] = distance
+        if node == target:
+            break
+        if node not in adjacency:
+            # page in this node along with the next few candidates in the heap
+            adjacency.load([node] + [entry[2] for entry in heap[:batch]
+                if entry[2] not in distances])
+        for neighbor, weight in adjacency[node]:
+            if weight < 0:
+                raise ValueError("Negative edge weight %r on (%r, %r)" % (weight, node, neighbor))
+            new_distance = distance + weight
+            if cutoff is not None and new_distance > cutoff:
+                continue
+            if neighbor in distances:
+                continue
+            if neighbor not in tentative or new_distance < tentative[neighbor]:
+                tentative[neighbor] = new_distance
+                predecessors[neighbor] = node
+                estimate = new_distance + (heuristic(neighbor) if heuristic else 0)
+                heapq.heappush(heap, (estimate, new_distance, neighbor))
+    return distances, predecessors
+
+def _path(predecessors, node):
+    path = []
+    while node is not None:
+        path.append(node)
+        node = predecessors[node]
+    path.reverse()
+    return path
+
+def dijkstra(session, Edge, source, target=None, cutoff=None, direction="out",
+        default_weight=1.0, adjacency=None, batch=CHUNKSIZE):
+    """ weighted shortest paths from `source` using the edges' `weight`.
+
+    Adjacency is paged in from the indexed edge table as nodes come off the
+    heap (together with up to `batch` of the next candidates in one select),
+    so a single-pair query only touches the explored region of the graph.
+
+        :param source: node instance or node id
+        :param target: (optional) node instance or id to stop at
+        :param cutoff: (optional) ignore paths longer than this
+        :param direction: 'out' (default), 'in' or 'both'
+        :param default_weight: weight for edges whose weight is NULL
+        :param adjacency: (optional) :class:`Adjacency` to (re)use as a cache;
+                          its direction and default weight take precedence
+        :returns: with `target`, (distance, path) or (None, None) if it can't
+                  be reached; otherwise (distances, paths), dicts keyed by node
+                  id like networkx's `single_source_dijkstra`
+        :raises: ValueError on negative edge weights
+    """
+    return _shortest(session, Edge, source, target, cutoff, None, direction,
+            default_weight, adjacency, batch)
+
+def astar(session, Edge, source, target, heuristic, cutoff=None, direction="out",
+        default_weight=1.0, adjacency=None, batch=CHUNKSIZE):
+    """ A* search from `source` to `target`. Same as :func:`dijkstra`, but
+    nodes are expanded in order of distance + ``heuristic(node_id, target_id)``,
+    which must never overestimate the remaining distance.
+
+        :returns: (distance, path) or (None, None) if `target` can't be reached
+    """
+    target = getattr(target, "id", target)
+    return _shortest(session, Edge, source, target, cutoff,
+            lambda node_id: heuristic(node_id, target), direction,
+            default_weight, adjacency, batch)
+
+def _shortest(session, Edge, source, target, cutoff, heuristic, direction,
+        default_weight, adjacency, batch):
+    source = getattr(source, "id", source)
+    target = getattr(target, "id", target)
+    if adjacency is None:
+        adjacency = Adjacency(session, Edge, direction, default_weight)
+    distances, predecessors = _search(adjacency, source, target, cutoff, heuristic, batch)
+    if target is not None:
+        if target not in distances:
+            return None, None
+        return distances[target], _path(predecessors, target)
+    return distances, dict((node, _path(predecessors, node)) for node in distances)
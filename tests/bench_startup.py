@@ -0,0 +1,36 @@
+""" Startup benchmark: time from import to the first query when a program
+defines many graph types, e.g.::
+
+    $ python tests/bench_startup.py 50
+"""
+import sys
+import time
+start = time.time()
+from graphalchemy.sqlmodels import create_base_classes
+from sqlalchemy.ext.declarative import declarative_base
+import sqlalchemy as sqla
+imported = time.time()
+
+def main(graphs=20):
+    Base = declarative_base()
+    before = time.time()
+    classes = [create_base_classes("Node%d" % i, "Edge%d" % i, Base=Base) for i in range(graphs)]
+    generated = time.time()
+    # what other modules asking for the same classes cost
+    for i in range(graphs):
+        create_base_classes("Node%d" % i, "Edge%d" % i, Base=Base)
+    cached = time.time()
+    engine = sqla.create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sqla.orm.sessionmaker(bind=engine)()
+    # the first query configures every mapper
+    session.query(classes[0][0]).count()
+    queried = time.time()
+    print("import:             %8.1f ms" % ((imported - start) * 1000))
+    print("generate %4d types: %8.1f ms" % (graphs, (generated - before) * 1000))
+    print("cached lookups:     %8.1f ms" % ((cached - generated) * 1000))
+    print("create + 1st query: %8.1f ms" % ((queried - cached) * 1000))
+    print("import to query:    %8.1f ms" % ((queried - start) * 1000))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -10,7 +10,7 @@ from nose.tools import assert_equal, nottest
 # TODO: add flask-sqlalchemy tests
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 import os
 
 
@@ -155,6 +155,35 @@ class DBSetup(object):
             except:
                 pass
 
+def create_memory_graph(edges=(), nodes=0, dbpath="sqlite://", enforce_fk=False, **options):
+    """ creates fresh Node/Edge classes (passing `options` through to
+    `create_base_classes`) on a new database (in-memory by default, with
+    foreign keys enforced if `enforce_fk`), with `nodes` nodes plus any node
+    ids mentioned in `edges`, which is a list of (source_id, target_id) or
+    (source_id, target_id, weight) tuples.
+    Returns DBObject """
+    Base = declarative_base()
+    Node, Edge = create_base_classes("Node", "Edge", Base=Base, **options)
+    engine = create_engine(dbpath)
+    if enforce_fk:
+        event.listen(engine, "connect",
+                lambda dbapi_con, con_record: dbapi_con.execute("pragma foreign_keys=on"))
+    Base.metadata.bind = engine
+    Base.metadata.create_all()
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    ids = set(range(1, nodes + 1))
+    for edge in edges:
+        ids.update(edge[:2])
+    session.add_all([Node(id=i, label=u"node%d" % i) for i in sorted(ids)])
+    session.flush()
+    for edge in edges:
+        weight = edge[2] if len(edge) > 2 else None
+        session.add(Edge(source_id=edge[0], target_id=edge[1], weight=weight))
+    session.commit()
+    return make_DBObject(Node=Node, Edge=Edge, engine=engine, Base=Base,
+            session=session, Session=Session)
+
 def check_object_characteristics(object, attributes):
     assert object
     for k,v in attributes.items():
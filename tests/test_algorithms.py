@@ -0,0 +1,96 @@
+from sqlmodelutils import create_memory_graph
+from graphalchemy.algorithms import (triangles, clustering, undirected_snapshot, triangle_counts,
+        core_numbers, core_number_array, prune_to_kcore)
+from graphalchemy.csr import CSRGraph
+from nose.tools import assert_equal, assert_almost_equal, raises
+import numpy as np
+
+# triangles 1-2-3 and 3-4-5, a reversed duplicate (2 -> 1), a self loop on 6
+EDGES = [(1, 2), (2, 3), (3, 1), (3, 4), (4, 5), (5, 3), (2, 1), (6, 6), (6, 1)]
+TRIANGLES = {1: 1, 2: 1, 3: 2, 4: 1, 5: 1, 6: 0}
+CLUSTERING = {1: 1 / 3., 2: 1.0, 3: 1 / 3., 4: 1.0, 5: 1.0, 6: 0.0}
+
+def test_csr_from_arrays():
+    """ CSRGraph.from_arrays builds sorted adjacency by position """
+    csr = CSRGraph.from_arrays([10, 20, 30], [20, 10, 10, 10], [10, 30, 20, 30], [1, 2, 3, 4])
+    assert_equal(csr.indptr.tolist(), [0, 3, 4, 4])
+    assert_equal(csr.indices.tolist(), [1, 2, 2, 0])
+    assert_equal(csr.weights.tolist(), [3, 2, 4, 1])
+    simple = CSRGraph.from_arrays([10, 20, 30], [20, 10, 10, 10], [10, 30, 20, 30], direction="both", simple=True)
+    assert_equal(simple.degree().tolist(), [2, 1, 1])
+    assert_equal(simple.positions([30, 10]).tolist(), [2, 0])
+
+@raises(KeyError)
+def test_csr_unknown_ids():
+    """ edges pointing at ids that aren't nodes raise KeyError """
+    CSRGraph.from_arrays([1, 2], [1], [3])
+
+def test_triangles_numpy_and_sql_agree():
+    """ triangles: the numpy and SQL methods give the same counts """
+    db = create_memory_graph(EDGES)
+    assert_equal(triangles(db.session, db.Node, db.Edge), TRIANGLES)
+    assert_equal(triangles(db.session, db.Node, db.Edge, method="sql"), TRIANGLES)
+    assert_equal(triangles(db.session, db.Node, db.Edge, ids=[3, 6]), {3: 2, 6: 0})
+
+def test_clustering():
+    """ clustering coefficients match 2T / (d(d - 1)) """
+    db = create_memory_graph(EDGES)
+    snapshot = undirected_snapshot(db.session, db.Node, db.Edge)
+    for method, kwargs in [("numpy", dict(snapshot=snapshot)), ("sql", {})]:
+        results = clustering(db.session, db.Node, db.Edge, method=method, **kwargs)
+        assert_equal(sorted(results), sorted(CLUSTERING))
+        for node_id, value in CLUSTERING.items():
+            assert_almost_equal(results[node_id], value)
+
+def test_triangles_written_back():
+    """ results can be written into a node column in bulk """
+    db = create_memory_graph(EDGES)
+    triangles(db.session, db.Node, db.Edge, ids=range(1, 7), method="numpy", column="size")
+    db.session.commit()
+    assert_equal(dict((n.id, n.size) for n in db.session.query(db.Node)), TRIANGLES)
+
+def test_triangle_counts_complete_graph():
+    """ every node of K5 is in 6 triangles """
+    ids = range(5)
+    pairs = [(a, b) for a in ids for b in ids if a < b]
+    csr = CSRGraph.from_arrays(ids, [a for a, b in pairs], [b for a, b in pairs], direction="both")
+    assert_equal(triangle_counts(csr).tolist(), [6] * 5)
+
+def test_core_numbers():
+    """ core numbers of two triangles plus a tail, checked against peeling """
+    db = create_memory_graph(EDGES + [(7, 6), (8, 7)])
+    cores = core_numbers(db.session, db.Node, db.Edge)
+    assert_equal(cores, {1: 2, 2: 2, 3: 2, 4: 2, 5: 2, 6: 1, 7: 1, 8: 1})
+    assert_equal(prune_to_kcore(db.session, db.Node, db.Edge, 2), set([1, 2, 3, 4, 5]))
+    assert_equal(prune_to_kcore(db.session, db.Node, db.Edge, 3), set())
+
+def test_core_numbers_random_graph():
+    """ the bucket algorithm agrees with repeated peeling """
+    rng = np.random.RandomState(0)
+    pairs = rng.randint(0, 60, size=(300, 2))
+    csr = CSRGraph.from_arrays(range(60), pairs[:, 0], pairs[:, 1], direction="both", simple=True)
+    cores = core_number_array(csr)
+    adjacency = dict((p, set(csr.neighbors(p).tolist())) for p in range(60))
+    for k in range(cores.max() + 2):
+        alive = set(range(60))
+        while True:
+            low = [p for p in alive if len(adjacency[p] & alive) < k]
+            if not low:
+                break
+            alive.difference_update(low)
+        assert_equal(alive, set(np.nonzero(cores >= k)[0].tolist()))
+
+def test_kcore_table():
+    """ the k-core can be joined against, without committing anything """
+    import sqlalchemy as sqla
+    db = create_memory_graph(EDGES)
+    db.session.add(db.Node(id=100))
+    db.session.flush()
+    ids, core = prune_to_kcore(db.session, db.Node, db.Edge, 2, table="kcore")
+    nodes = db.session.query(db.Node).filter(db.Node.id.in_(sqla.select([core.c.id])))
+    assert_equal(sorted(n.id for n in nodes), sorted(ids))
+    assert_equal(db.session.query(db.Node).join(core, core.c.id == db.Node.id).count(), len(ids))
+    ids, core = prune_to_kcore(db.session, db.Node, db.Edge, 3, table="kcore")
+    assert_equal(db.session.query(db.Node).filter(db.Node.id.in_(sqla.select([core.c.id]))).count(), 0)
+    db.session.rollback()
+    assert_equal(db.session.query(db.Node).get(100), None)
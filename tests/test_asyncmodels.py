@@ -0,0 +1,147 @@
+from nose.plugins.skip import SkipTest
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+from graphalchemy.asyncmodels import AsyncGraph
+from graphalchemy.sqlmodels import create_base_classes
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool, QueuePool
+from nose.tools import assert_equal, assert_raises
+from multiprocessing.pool import ThreadPool
+import threading
+import tempfile
+import time
+import os
+
+class ThreadLoop(object):
+    """ stands in for an event loop: run_in_executor on a ThreadPool """
+    def run_in_executor(self, executor, fn, *args):
+        return executor.apply_async(fn, args)
+
+class TestRun(object):
+    """ run/_call without asyncio """
+    def setUp(self):
+        fd, self.dbpath = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        Base = declarative_base()
+        self.Node, self.Edge = create_base_classes("Node", "Edge", Base=Base)
+        # QueuePool counts the connections sessions haven't given back
+        self.engine = create_engine("sqlite:///" + self.dbpath, poolclass=QueuePool,
+                connect_args={"check_same_thread": False})
+        Base.metadata.create_all(self.engine)
+        self.pool = ThreadPool(4)
+        self.graph = AsyncGraph(self.engine, self.Node, self.Edge, max_workers=2,
+                loop=ThreadLoop(), executor=self.pool)
+
+    def tearDown(self):
+        self.graph.close()
+        self.pool.close()
+        self.pool.join()
+        self.engine.dispose()
+        os.remove(self.dbpath)
+
+    def labels(self):
+        return [row[0] for row in self.engine.execute("SELECT label FROM node ORDER BY id")]
+
+    def test_commit(self):
+        """ run commits when fn returns and closes the session """
+        def add(session, label):
+            session.add(self.Node(label=label))
+            return label
+        assert_equal(self.graph.run(add, u"a").get(), u"a")
+        assert_equal(self.labels(), [u"a"])
+        assert_equal(self.engine.pool.checkedout(), 0)
+
+    def test_rollback(self):
+        """ run rolls back and re-raises when fn fails """
+        def add_and_fail(session):
+            session.add(self.Node(label=u"b"))
+            session.flush()
+            raise ValueError("boom")
+        assert_raises(ValueError, self.graph.run(add_and_fail).get)
+        assert_equal(self.labels(), [])
+        assert_equal(self.engine.pool.checkedout(), 0)
+
+    def test_concurrency_cap(self):
+        """ no more than max_workers calls run at once, even on a bigger pool """
+        lock = threading.Lock()
+        counts = {"now": 0, "max": 0}
+        def slow(session):
+            with lock:
+                counts["now"] += 1
+                counts["max"] = max(counts["max"], counts["now"])
+            time.sleep(0.05)
+            with lock:
+                counts["now"] -= 1
+        for result in [self.graph.run(slow) for _ in range(6)]:
+            result.get()
+        assert_equal(counts["max"], 2)
+
+    def test_neighbors_unknown_node(self):
+        """ neighbors of a missing node is a KeyError """
+        assert_raises(KeyError, self.graph.neighbors(42).get)
+
+    def test_needs_loop_and_executor(self):
+        """ without asyncio, loop and executor must be passed in """
+        if asyncio is not None:
+            raise SkipTest("asyncio is available")
+        assert_raises(ImportError, AsyncGraph, self.engine, self.Node, self.Edge)
+
+class TestAsyncGraph(object):
+    def setUp(self):
+        if asyncio is None:
+            raise SkipTest("asyncio is not available")
+        fd, self.dbpath = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        Base = declarative_base()
+        self.Node, self.Edge = create_base_classes("Node", "Edge", Base=Base)
+        self.engine = create_engine("sqlite:///" + self.dbpath)
+        Base.metadata.create_all(self.engine)
+        session = sessionmaker(bind=self.engine)()
+        session.add_all([self.Node(id=i, label=u"node%d" % i) for i in range(1, 6)])
+        session.commit()
+        session.close()
+        self.loop = asyncio.new_event_loop()
+        self.graph = AsyncGraph(self.engine, self.Node, self.Edge, max_workers=2, loop=self.loop)
+
+    def tearDown(self):
+        self.graph.close()
+        self.loop.close()
+        os.remove(self.dbpath)
+
+    def test_bulk_connect_and_neighbors(self):
+        """ bulk_connect inserts edges, neighbors/get run concurrently """
+        run = self.loop.run_until_complete
+        assert_equal(run(self.graph.bulk_connect([(1, 2), (1, 3), (4, 1)], weight=2.0)), 3)
+        results = run(asyncio.gather(*[self.graph.neighbors(i) for i in range(1, 6)]))
+        assert_equal([sorted(n.id for n in result) for result in results],
+                [[2, 3, 4], [1], [1], [1], []])
+        node = run(self.graph.get(4))
+        assert_equal(node.label, u"node4")
+
+    def test_k_hop(self):
+        """ k_hop is offloaded like everything else """
+        run = self.loop.run_until_complete
+        run(self.graph.bulk_connect([(1, 2), (2, 3), (3, 4)]))
+        assert_equal(run(self.graph.k_hop(1, 2)), {2: 1, 3: 2})
+
+def test_bulk_connect_undirected():
+    """ bulk_connect orders the ends of undirected edges """
+    if asyncio is None:
+        raise SkipTest("asyncio is not available")
+    Base = declarative_base()
+    Node, Edge = create_base_classes("Node", "Edge", Base=Base, undirected=True)
+    engine = create_engine("sqlite://", poolclass=StaticPool,
+            connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    loop = asyncio.new_event_loop()
+    graph = AsyncGraph(engine, Node, Edge, loop=loop)
+    try:
+        assert_equal(loop.run_until_complete(graph.bulk_connect([(2, 1)])), 1)
+        assert_equal(engine.execute("SELECT source_id, target_id FROM edge").fetchall(), [(1, 2)])
+    finally:
+        graph.close()
+        loop.close()
@@ -0,0 +1,171 @@
+from graphalchemy.backup import snapshot, clone_to_memory, restore
+from graphalchemy.sqlmodels import sqlite_connect, create_base_classes
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import create_engine, DDL, event
+import sqlalchemy.orm as orm
+from nose.tools import assert_equal, raises
+import shutil
+import tempfile
+import os
+
+class TestBackup(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "graph.db")
+        open(self.path, "a").close()
+        Base = declarative_base()
+        self.Node, self.Edge = create_base_classes("Node", "Edge", Base=Base)
+        # a trigger, to check that the whole schema is copied
+        event.listen(self.Node.__table__, "after_create", DDL(
+            "CREATE TRIGGER node_size AFTER INSERT ON node "
+            "BEGIN UPDATE node SET size = 1 WHERE id = new.id AND size IS NULL; END"))
+        self.engine, self.session = sqlite_connect(self.path, Base.metadata)
+        self.session.add_all([self.Node(id=i) for i in range(1, 4)])
+        self.session.add_all([self.Edge(source_id=1, target_id=2), self.Edge(source_id=2, target_id=3)])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def edges(self, session):
+        return sorted(map(tuple, session.query(self.Edge)))
+
+    def test_snapshot(self):
+        """ snapshot writes a consistent copy, and refuses to overwrite """
+        dest = snapshot(self.engine, os.path.join(self.tmpdir, "copy.db"))
+        engine, session = sqlite_connect(dest, self.Node.metadata)
+        assert_equal(self.edges(session), [(1, 2), (2, 3)])
+        session.add(self.Node(id=4))
+        session.commit()
+        assert_equal(session.query(self.Node).get(4).size, 1)
+        assert_equal(self.session.query(self.Node).count(), 3)
+        session.close()
+
+    @raises(ValueError)
+    def test_snapshot_existing_dest(self):
+        """ snapshot won't overwrite a file """
+        snapshot(self.engine, self.path)
+
+    def test_clone_and_restore(self):
+        """ a clone is independent of the source until it's restored """
+        engine, session = clone_to_memory(self.engine)
+        session.add(self.Edge(source_id=3, target_id=1))
+        session.query(self.Edge).filter(self.Edge.target_id == 2).delete()
+        session.query(self.Edge).filter(self.Edge.source_id == 2).delete()
+        session.delete(session.query(self.Node).get(2))
+        session.commit()
+        assert_equal(self.edges(self.session), [(1, 2), (2, 3)])
+        # and a clone of the clone (in memory, so it goes through a file)
+        second, second_session = clone_to_memory(engine)
+        assert_equal(self.edges(second_session), [(3, 1)])
+        restore(self.engine, engine)
+        self.session.expire_all()
+        assert_equal(self.edges(self.session), [(3, 1)])
+        assert_equal(sorted(n.id for n in self.session.query(self.Node)), [1, 3])
+        self.session.add(self.Node(id=5))
+        self.session.commit()
+        assert_equal(self.session.query(self.Node).get(5).size, 1)
+
+    def test_restore_from_path(self):
+        """ restore takes a snapshot path too """
+        dest = snapshot(self.engine, os.path.join(self.tmpdir, "copy.db"))
+        self.session.query(self.Edge).delete()
+        self.session.commit()
+        restore(self.engine, dest)
+        assert_equal(self.edges(self.session), [(1, 2), (2, 3)])
+
+class TestInMemory(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "graph.db")
+        open(self.path, "a").close()
+        Base = declarative_base()
+        self.Node, self.Edge = create_base_classes("Node", "Edge", Base=Base)
+        engine, session = sqlite_connect(self.path, Base.metadata)
+        session.add_all([self.Node(id=1), self.Node(id=2)])
+        session.commit()
+        session.close()
+        engine.dispose()
+        self.engine, self.session = sqlite_connect(self.path, Base.metadata,
+                in_memory=True, checkpoint_commits=2)
+        self.checkpointer = self.engine.checkpointer
+
+    def tearDown(self):
+        self.checkpointer.active = False
+        self.session.close()
+        shutil.rmtree(self.tmpdir)
+
+    def on_disk(self):
+        """ what a process starting after a crash would find """
+        engine = create_engine("sqlite:///" + self.path)
+        try:
+            return sorted(row[0] for row in engine.execute("SELECT id FROM node"))
+        finally:
+            engine.dispose()
+
+    def add(self, node_id):
+        self.session.add(self.Node(id=node_id))
+        self.session.commit()
+
+    def test_checkpoints(self):
+        """ the file is written every `checkpoint_commits` commits """
+        assert_equal(self.session.query(self.Node).count(), 2)
+        self.add(3)
+        assert_equal(self.on_disk(), [1, 2])
+        self.add(4)
+        assert_equal(self.on_disk(), [1, 2, 3, 4])
+        self.add(5)
+        assert_equal(self.on_disk(), [1, 2, 3, 4])
+        self.checkpointer.close()
+        assert_equal(self.on_disk(), [1, 2, 3, 4, 5])
+        assert_equal(self.checkpointer.checkpoints, 2)
+
+    def test_interval(self):
+        """ interval=0 checkpoints after every commit """
+        self.checkpointer.commits = None
+        self.checkpointer.interval = 0
+        self.add(3)
+        assert_equal(self.on_disk(), [1, 2, 3])
+
+    def test_crash_during_checkpoint(self):
+        """ a checkpoint that dies half way leaves the last one intact """
+        import graphalchemy.backup as backup
+        def crash(engine, dest):
+            open(dest, "wb").write(b"half a database")
+            raise KeyboardInterrupt
+        original, backup.snapshot = backup.snapshot, crash
+        try:
+            self.add(3)
+            self.add(4)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            backup.snapshot = original
+        assert_equal(self.on_disk(), [1, 2])
+        # the next checkpoint cleans up after it
+        self.session.close()
+        self.session = orm.sessionmaker(bind=self.engine)()
+        self.add(5)
+        self.checkpointer.checkpoint()
+        assert_equal(self.on_disk(), [1, 2, 3, 4, 5])
+        assert not os.path.exists(self.path + ".checkpoint")
+
+    def test_failed_checkpoint_is_retried(self):
+        """ a checkpoint error doesn't fail the commit, and the commits
+        stay pending until a later checkpoint succeeds """
+        self.checkpointer.commits = 1
+        self.checkpointer.dbpath = os.path.join(self.tmpdir, "missing", "graph.db")
+        self.add(3)
+        assert_equal(self.checkpointer.failures, 1)
+        assert_equal(self.checkpointer.pending, 1)
+        assert_equal(self.on_disk(), [1, 2])
+        self.checkpointer.dbpath = self.path
+        self.add(4)
+        assert_equal(self.checkpointer.pending, 0)
+        assert_equal(self.on_disk(), [1, 2, 3, 4])
+
+@raises(ValueError)
+def test_in_memory_needs_path():
+    sqlite_connect("", None, in_memory=True)
@@ -0,0 +1,98 @@
+from graphalchemy.bloom import BloomFilter, EdgeIndex
+from sqlmodelutils import create_memory_graph
+from nose.tools import assert_equal, assert_true, assert_false
+import os
+import random
+import shutil
+import tempfile
+
+def test_bloom_filter_rate():
+    """ no false negatives, and false positives near the error rate """
+    bloom = BloomFilter(2000, 0.01)
+    rng = random.Random(0)
+    added = [(rng.randint(1, 10 ** 6), rng.randint(1, 10 ** 6)) for _ in range(2000)]
+    bloom.add(*zip(*added))
+    assert_true(bloom.might_contain(*zip(*added)).all())
+    others = [(s, t + 2 * 10 ** 6) for s, t in added]
+    assert_true(bloom.might_contain(*zip(*others)).sum() < 60)
+
+def test_edge_index():
+    """ exact answers, and flushed edges are picked up """
+    db = create_memory_graph([(1, 2), (2, 3), (3, 1)], nodes=5)
+    session = db.Session()
+    index = EdgeIndex(session, db.Edge, target=db.Session)
+    candidates = [(s, t) for s in range(1, 6) for t in range(1, 6)]
+    assert_equal(index.existing(candidates), set([(1, 2), (2, 3), (3, 1)]))
+    assert_true(index.negatives > 15)
+    assert_equal(index.negatives + index.lookups, 25)
+    assert_true((1, 2) in index)
+    assert_false((2, 1) in index)
+    session.add(db.Edge(source_id=4, target_id=5))
+    session.flush()
+    assert_true(index.filter.might_contain([4], [5])[0])
+    assert_true((4, 5) in index)
+    # set-based writes are only seen after add()
+    session.execute(db.Edge.__table__.insert(), [dict(source_id=5, target_id=1)])
+    index.add([(5, 1)])
+    assert_equal(index.existing([(5, 1), (1, 5)]), set([(5, 1)]))
+    # deletes leave stale bits, but answers stay exact
+    session.query(db.Edge).filter_by(source_id=1, target_id=2).delete()
+    assert_false((1, 2) in index)
+    index.close()
+
+def test_edge_index_grows():
+    """ the filter is rebuilt larger once it's over capacity """
+    db = create_memory_graph([(1, 2)], nodes=2)
+    session = db.Session()
+    index = EdgeIndex(session, db.Edge, target=db.Session)
+    capacity = index.filter.capacity
+    pairs = [(i, i + 1) for i in range(capacity + 1)]
+    index.add(pairs)
+    assert_true(index.filter.capacity > capacity)
+    # the rebuild comes from the table, which holds just the one edge
+    assert_equal(index.existing(pairs + [(1, 2)]), set([(1, 2)]))
+
+def test_edge_index_undirected():
+    """ undirected pairs are checked in either order """
+    db = create_memory_graph([(2, 1)], undirected=True)
+    session = db.Session()
+    index = EdgeIndex(session, db.Edge, target=db.Session)
+    assert_equal(index.existing([(2, 1), (1, 2), (2, 2)]), set([(1, 2)]))
+    index.close()
+
+def test_edge_index_grows_during_other_flush():
+    """ edges flushed by another session survive the rebuild they trigger """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db = create_memory_graph([(1, 2)], nodes=2,
+                dbpath="sqlite:///" + os.path.join(tmpdir, "graph.db"))
+        index = EdgeIndex(db.Session(), db.Edge, target=db.Session)
+        other = db.Session()
+        pairs = [(1, i) for i in range(3, index.filter.capacity + 3)]
+        other.add_all([db.Edge(source_id=s, target_id=t) for s, t in pairs])
+        other.flush()
+        other.commit()
+        assert_equal(index.existing(pairs), set(pairs))
+        index.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_edge_index_grows_after_earlier_flush():
+    """ pairs flushed earlier in an open transaction survive a rebuild """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db = create_memory_graph([(1, 2)], nodes=2,
+                dbpath="sqlite:///" + os.path.join(tmpdir, "graph.db"))
+        index = EdgeIndex(db.Session(), db.Edge, target=db.Session)
+        other = db.Session()
+        other.add(db.Edge(source_id=5, target_id=6))
+        other.flush()
+        pairs = [(1, i) for i in range(3, index.filter.capacity + 3)]
+        other.add_all([db.Edge(source_id=s, target_id=t) for s, t in pairs])
+        other.flush()
+        other.commit()
+        assert_equal(index.existing([(5, 6)]), set([(5, 6)]))
+        assert_equal(index.uncommitted.get(other), None)
+        index.close()
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,55 @@
+from graphalchemy.explain import explain, check_queries, assert_indexed, report
+from graphalchemy.traversal import scoped
+from sqlmodelutils import create_memory_graph
+from nose.tools import assert_equal, raises
+
+def test_graph_queries_use_indexes():
+    """ every query shape searches the edge table through an index """
+    db = create_memory_graph([(1, 2), (2, 3)])
+    plans = check_queries(db.session, db.Node, db.Edge)
+    assert_equal(len(plans), 10)
+    assert all(plan.ok for plan in plans), report(plans)
+    assert_indexed(db.engine, db.Node, db.Edge, "out")
+
+@raises(AssertionError)
+def test_dropped_index_is_flagged():
+    """ without the source_id index, out-edge lookups scan the table """
+    db = create_memory_graph([(1, 2)])
+    db.session.execute("DROP INDEX ix_edge_source_id")
+    assert_indexed(db.session, db.Node, db.Edge)
+
+def test_multi_graph_needs_scoping():
+    """ graph_id-prefixed indexes only help queries scoped to a graph """
+    db = create_memory_graph(multi_graph=True)
+    plans = dict((plan.name, plan) for plan in check_queries(db.session, db.Node, db.Edge))
+    assert plans["lazy_out_edges"].ok
+    assert not plans["frontier_out"].ok
+    assert_indexed(db.session, db.Node, scoped(db.Edge, db.Edge.in_graph(1)))
+
+def test_explain_sql_string():
+    db = create_memory_graph()
+    plan = explain(db.session, "SELECT * FROM edge WHERE weight > 1", tables=["edge"])
+    assert_equal(plan.scans, ["SCAN edge"])
+
+def test_dropped_far_index_is_flagged_with_where():
+    """ without the target_id index, the filtered in-edge frontier is
+    flagged (not hidden behind a range over the other index) """
+    db = create_memory_graph([(1, 2)])
+    db.session.execute("DROP INDEX ix_edge_target_id")
+    plans = dict((plan.name, plan) for plan in check_queries(db.session, db.Node, db.Edge))
+    assert not plans["frontier_in_where"].ok, report([plans["frontier_in_where"]])
+    assert plans["frontier_out_where"].ok
+
+def test_range_search_is_flagged():
+    db = create_memory_graph()
+    plan = explain(db.session, "SELECT * FROM edge WHERE source_id > 1", tables=["edge"])
+    assert_equal(len(plan.scans), 1)
+    assert plan.scans[0].startswith("SEARCH edge USING INDEX ix_edge_source_id"), plan.scans
+
+def test_automatic_index_is_flagged():
+    """ an automatic index is built from a full scan of the table """
+    db = create_memory_graph()
+    plan = explain(db.session, "SELECT node.id FROM node JOIN edge ON edge.weight = node.size",
+            tables=["edge"])
+    assert_equal(len(plan.scans), 1)
+    assert plan.scans[0].startswith("SEARCH edge USING AUTOMATIC"), plan.scans
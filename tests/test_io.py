@@ -0,0 +1,178 @@
+from sqlmodelutils import create_memory_graph
+from graphalchemy.io import load_edgelist, checkpoints, write_gexf, write_graphml
+from nose.tools import assert_equal, raises
+from StringIO import StringIO
+from xml.etree import cElementTree as etree
+from xml.dom import minidom
+import sqlalchemy as sqla
+
+EDGELIST = "a,b,1.5,likes\nb,c,,\na,c,2\n\nc,a\n"
+
+def edges_by_key(db):
+    """ returns sorted (source label, target label, weight, label) tuples """
+    return sorted((e.source.label, e.target.label, e.weight, e.label)
+            for e in db.session.query(db.Edge))
+
+def test_load_edgelist():
+    """ load_edgelist creates unseen nodes and every edge """
+    db = create_memory_graph()
+    assert_equal(load_edgelist(StringIO(EDGELIST), db.session, db.Node, db.Edge, chunk=2), (3, 4))
+    assert_equal(edges_by_key(db), [
+        (u"a", u"b", 1.5, u"likes"),
+        (u"a", u"c", 2.0, None),
+        (u"b", u"c", None, None),
+        (u"c", u"a", None, None)])
+    # the scratch key table is gone afterwards
+    assert_equal([t for t in db.engine.table_names() if "keymap" in t], [])
+
+def test_load_edgelist_matches_existing_nodes():
+    """ keys that already exist as node labels are reused, with a header line """
+    db = create_memory_graph([(1, 2)])
+    data = "src\tdst\nnode1\tnew\n"
+    assert_equal(load_edgelist(StringIO(data), db.session, db.Node, db.Edge,
+        delimiter="\t", header=True), (1, 1))
+    assert_equal(db.session.query(db.Node).count(), 3)
+    assert_equal(db.session.query(db.Node).get(1).out_edges[-1].target.label, u"new")
+
+def test_load_edgelist_spills_keys():
+    """ keys beyond max_keys go to the scratch table and still resolve """
+    db = create_memory_graph()
+    assert_equal(load_edgelist(StringIO(EDGELIST), db.session, db.Node, db.Edge,
+        chunk=1, max_keys=1), (3, 4))
+    assert_equal(len(edges_by_key(db)), 4)
+    assert_equal(db.session.query(db.Node).count(), 3)
+
+@raises(ValueError)
+def test_load_edgelist_bad_line():
+    """ lines without a target raise ValueError """
+    db = create_memory_graph()
+    load_edgelist(StringIO("a,b\nc\n"), db.session, db.Node, db.Edge)
+
+def test_load_edgelist_drops_keymap_on_error():
+    """ a failed load drops its spilled scratch table too """
+    db = create_memory_graph()
+    try:
+        load_edgelist(StringIO("a,b\nb,c\nc\n"), db.session, db.Node, db.Edge,
+                chunk=1, max_keys=1)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("the bad line should fail")
+    assert_equal([t for t in db.engine.table_names() if "keymap" in t], [])
+
+def test_load_edgelist_resumes_from_checkpoint():
+    """ a failed load resumes after the last committed chunk """
+    db = create_memory_graph()
+    broken = "a,b\nb,c\nc\nd,a\n"
+    try:
+        load_edgelist(StringIO(broken), db.session, db.Node, db.Edge, chunk=2, checkpoint="daily")
+    except ValueError:
+        pass
+    assert_equal(len(edges_by_key(db)), 2)
+    position = db.session.execute(sqla.select([checkpoints.c.position])).scalar()
+    assert_equal(position, 2)
+    fixed = "a,b\nb,c\nc,d\nd,a\n"
+    assert_equal(load_edgelist(StringIO(fixed), db.session, db.Node, db.Edge, chunk=2,
+        checkpoint="daily"), (1, 2))
+    assert_equal(edges_by_key(db), [
+        (u"a", u"b", None, None),
+        (u"b", u"c", None, None),
+        (u"c", u"d", None, None),
+        (u"d", u"a", None, None)])
+    # running it again is a no-op
+    assert_equal(load_edgelist(StringIO(fixed), db.session, db.Node, db.Edge, chunk=2,
+        checkpoint="daily"), (0, 0))
+
+GEXF = "{http://www.gexf.net/1.2draft}"
+VIZ = "{http://www.gexf.net/1.2draft/viz}"
+GRAPHML = "{http://graphml.graphdrawing.org/xmlns}"
+
+def create_styled_graph():
+    db = create_memory_graph([(1, 2, 2.5), (2, 3)])
+    node = db.session.query(db.Node).get(1)
+    node.label, node.size, node.color = u"caf\xe9 <&\">", 4, u"#ff8000"
+    edge = node.out_edges[0]
+    edge.label, edge.directed, edge.color = u"heavy", False, u"blue"
+    db.session.commit()
+    return db
+
+def test_write_gexf():
+    """ write_gexf streams nodes and edges with gephi attributes """
+    db = create_styled_graph()
+    out = StringIO()
+    assert_equal(write_gexf(db.session, db.Node, db.Edge, out, chunk=1), (3, 2))
+    root = etree.fromstring(out.getvalue())
+    nodes = root.findall("%sgraph/%snodes/%snode" % (GEXF, GEXF, GEXF))
+    assert_equal([n.get("id") for n in nodes], ["1", "2", "3"])
+    assert_equal(nodes[0].get("label"), u"caf\xe9 <&\">")
+    assert_equal(nodes[0].find(VIZ + "size").get("value"), "4.0")
+    assert_equal(nodes[0].find(VIZ + "color").attrib, dict(r="255", g="128", b="0"))
+    edges = root.findall("%sgraph/%sedges/%sedge" % (GEXF, GEXF, GEXF))
+    assert_equal([(e.get("source"), e.get("target"), e.get("weight")) for e in edges],
+            [("1", "2", "2.5"), ("2", "3", None)])
+    assert_equal((edges[0].get("type"), edges[0].get("label")), ("undirected", "heavy"))
+    assert edges[0].find(VIZ + "color") is None
+
+def test_write_graphml():
+    """ write_graphml streams nodes and edges with data keys """
+    db = create_styled_graph()
+    out = StringIO()
+    assert_equal(write_graphml(db.session, db.Node, db.Edge, out), (3, 2))
+    root = etree.fromstring(out.getvalue())
+    graph = root.find(GRAPHML + "graph")
+    nodes = graph.findall(GRAPHML + "node")
+    assert_equal(dict((d.get("key"), d.text) for d in nodes[0]),
+            {"label": u"caf\xe9 <&\">", "size": "4", "color": "#ff8000"})
+    edges = graph.findall(GRAPHML + "edge")
+    assert_equal([(e.get("source"), e.get("target"), e.get("directed")) for e in edges],
+            [("n1", "n2", "false"), ("n2", "n3", None)])
+    assert_equal(dict((d.get("key"), d.text) for d in edges[0]),
+            {"e_label": "heavy", "e_weight": "2.5", "e_color": "blue"})
+
+def test_write_undirected():
+    """ undirected edge classes default to undirected edges """
+    db = create_memory_graph([(1, 2), (2, 3)], undirected=True)
+    out = StringIO()
+    write_gexf(db.session, db.Node, db.Edge, out)
+    graph = etree.fromstring(out.getvalue()).find(GEXF + "graph")
+    assert_equal(graph.get("defaultedgetype"), "undirected")
+    assert_equal(set(e.get("type") for e in graph.iter(GEXF + "edge")), set(["undirected"]))
+    graphml = StringIO()
+    write_graphml(db.session, db.Node, db.Edge, graphml)
+    assert_equal(etree.fromstring(graphml.getvalue()).find(GRAPHML + "graph").get("edgedefault"),
+            "undirected")
+    try:
+        import networkx
+    except ImportError:
+        return
+    out.seek(0)
+    read = networkx.read_gexf(out)
+    assert not read.is_directed()
+    assert_equal(read.number_of_edges(), 2)
+
+def test_write_xml_strips_invalid_characters():
+    """ control characters can't be written to XML 1.0, even escaped """
+    db = create_styled_graph()
+    node = db.session.query(db.Node).get(1)
+    node.label, node.color = u"a\x01b\x1f", u"#ff\x0b8000"
+    node.out_edges[0].label = u"he\x00avy"
+    db.session.commit()
+    for write in (write_gexf, write_graphml):
+        out = StringIO()
+        write(db.session, db.Node, db.Edge, out)
+        text = minidom.parseString(out.getvalue()).toxml()
+        assert u"ab" in text and u"heavy" in text and u"#ff8000" in text
+
+def test_load_edgelist_undirected():
+    """ undirected edges are stored low id first """
+    db = create_memory_graph(undirected=True)
+    load_edgelist(StringIO("a,b\nb,a\n"), db.session, db.Node, db.Edge)
+    assert_equal(sorted((e.source_id, e.target_id) for e in db.session.query(db.Edge)),
+            [(1, 2), (1, 2)])
+
+def test_load_edgelist_unique_edges():
+    """ with unique_edges, unlabeled lines load and re-sent edges merge """
+    db = create_memory_graph(unique_edges=True)
+    assert_equal(load_edgelist(StringIO("a,b,1\na,b,2\nb,c\n"), db.session, db.Node, db.Edge,
+        chunk=1), (3, 3))
+    assert_equal(edges_by_key(db), [(u"a", u"b", 3.0, u""), (u"b", u"c", None, u"")])
@@ -0,0 +1,130 @@
+from graphalchemy.live import ChangeFeed, LiveGraph, DeltaCSR, NetworkXTarget
+from sqlmodelutils import create_memory_graph
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equal
+
+def live_graph(edges, target, nodes=0):
+    db = create_memory_graph(edges, nodes=nodes)
+    feed = ChangeFeed(db.Node, db.Edge, target=db.Session)
+    return db, feed, LiveGraph(feed, db.Session(), target)
+
+def test_feed_publishes_committed_changes():
+    """ commits publish inserts/updates/deletes, rollbacks publish nothing """
+    db = create_memory_graph([(1, 2)])
+    feed = ChangeFeed(db.Node, db.Edge, target=db.Session)
+    published = []
+    feed.subscribe(published.extend)
+    session = db.Session()
+    session.add(db.Edge(source_id=2, target_id=1))
+    session.flush()
+    session.rollback()
+    assert_equal(published, [])
+    edge = session.query(db.Edge).get(1)
+    edge.weight = 3.0
+    session.add(db.Node(id=3))
+    session.commit()
+    assert_equal(sorted((c.op, c.kind, c.id) for c in published),
+            [("insert", "node", 3), ("update", "edge", 1)])
+    assert_equal(published[[c.kind for c in published].index("edge")].values["source_id"], 1)
+    del published[:]
+    session.delete(session.query(db.Edge).get(1))
+    session.commit()
+    assert_equal([(c.op, c.kind, c.id) for c in published], [("delete", "edge", 1)])
+    feed.close()
+    session.add(db.Node(id=4))
+    session.commit()
+    assert_equal(len(published), 1)
+
+def test_live_delta_csr():
+    """ a DeltaCSR follows commits through its delta buffer """
+    target = DeltaCSR(min_buffer=2, rebuild_fraction=0)
+    db, feed, live = live_graph([(1, 2, 2.0), (2, 3)], target)
+    assert_equal(target.neighbors(1), [(2, 2.0)])
+    session = db.Session()
+    session.add(db.Node(id=4))
+    session.add(db.Edge(source_id=1, target_id=4, weight=5.0))
+    session.commit()
+    assert_equal(sorted(target.neighbors(1)), [(2, 2.0), (4, 5.0)])
+    assert_equal(target.buffered, 1)
+    session.delete(session.query(db.Edge).filter_by(source_id=1, target_id=2).one())
+    session.commit()
+    assert_equal(target.neighbors(1), [(4, 5.0)])
+    # moving an edge is a removal (the third buffered change, which
+    # rebuilds the snapshot) and an addition
+    edge = session.query(db.Edge).filter_by(source_id=2).one()
+    edge.target_id = 4
+    session.commit()
+    assert_equal(target.buffered, 1)
+    assert_equal(target.csr.num_edges, 1)
+    assert_equal(target.neighbors(2), [(4, 1.0)])
+    snapshot = target.snapshot()
+    assert_equal(snapshot.ids.tolist(), [1, 2, 3, 4])
+    assert_equal(snapshot.num_edges, 2)
+    assert_equal(live.applied, 4)
+
+def test_live_node_delete_drops_edges():
+    """ deleting a node drops its edges from the live graph """
+    target = DeltaCSR()
+    db, feed, live = live_graph([(1, 2), (2, 3), (3, 1)], target)
+    session = db.Session()
+    # set-based deletes aren't published, the node delete is
+    session.query(db.Edge).filter(db.Edge.target_id == 3).delete()
+    session.query(db.Edge).filter(db.Edge.source_id == 3).delete()
+    session.delete(session.query(db.Node).get(3))
+    session.commit()
+    assert_equal(target.neighbors(2), [])
+    assert_equal(target.snapshot().ids.tolist(), [1, 2])
+    assert_equal(target.snapshot().num_edges, 1)
+
+def test_live_networkx():
+    """ a networkx multigraph follows commits """
+    try:
+        import networkx
+    except ImportError:
+        raise SkipTest("networkx is not available")
+    target = NetworkXTarget()
+    db, feed, live = live_graph([(1, 2), (1, 2)], target)
+    assert_equal(target.graph.number_of_edges(1, 2), 2)
+    session = db.Session()
+    session.delete(session.query(db.Edge).get(1))
+    session.add(db.Edge(source_id=2, target_id=1, weight=2.0))
+    session.commit()
+    assert_equal(target.graph.number_of_edges(1, 2), 1)
+    assert_equal(target.graph[2][1][3]["weight"], 2.0)
+
+def test_live_delta_csr_node_swap():
+    """ removing one node and adding another rebuilds the snapshot """
+    target = DeltaCSR()
+    db, feed, live = live_graph([(1, 2)], target, nodes=3)
+    session = db.Session()
+    session.delete(session.query(db.Node).get(3))
+    session.add(db.Node(id=7))
+    session.commit()
+    assert_equal(target.snapshot().ids.tolist(), [1, 2, 7])
+
+def test_live_delta_csr_nodes_and_edges_past_rebuild():
+    """ nodes and their edges committed together can trigger a rebuild """
+    target = DeltaCSR(min_buffer=0)
+    db, feed, live = live_graph([(1, 2)], target)
+    session = db.Session()
+    for i in range(10, 60):
+        node = db.Node(id=i)
+        session.add(node)
+        session.add(db.Edge(source=node, target_id=1))
+    session.commit()
+    assert_equal(len(target.neighbors(10)), 1)
+    assert_equal(target.snapshot().num_edges, 51)
+
+def test_feed_subscriber_errors_are_logged():
+    """ a failing subscriber doesn't break commit() or the other subscribers """
+    db = create_memory_graph([(1, 2)])
+    feed = ChangeFeed(db.Node, db.Edge, target=db.Session)
+    published = []
+    def fail(changes):
+        raise ValueError("boom")
+    feed.subscribe(fail)
+    feed.subscribe(published.extend)
+    session = db.Session()
+    session.add(db.Node(id=3))
+    session.commit()
+    assert_equal([(c.op, c.kind, c.id) for c in published], [("insert", "node", 3)])
@@ -0,0 +1,136 @@
+from graphalchemy.packed import encode, decode, read_neighbors
+from graphalchemy.sqlmodels import create_base_classes, ensure_indexes
+from sqlmodelutils import create_memory_graph
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from nose.tools import assert_equal, raises
+import numpy as np
+import datetime
+import os
+import shutil
+import tempfile
+
+def test_encode_roundtrip():
+    """ ids come back sorted with their weights, whatever their size """
+    ids = [300, 5, 0, 2 ** 40, 300, 127, 128]
+    neighbors, weights = encode(ids, [float(i) for i in range(7)])
+    decoded, decoded_weights = decode(neighbors, weights)
+    assert_equal(decoded.tolist(), sorted(ids))
+    assert_equal(decoded_weights.tolist(), [2.0, 1.0, 5.0, 6.0, 0.0, 4.0, 3.0])
+    # dense ids take a byte each
+    assert_equal(len(encode(range(1000, 2000))[0]), 1001)
+    assert_equal(decode(*encode([]))[0].tolist(), [])
+
+def test_packed_adjacency():
+    """ packed rows follow flushes and rebuilds """
+    db = create_memory_graph([(1, 2, 2.0), (1, 3), (2, 1)], nodes=4, packed_adjacency=True)
+    session = db.Session()
+    get = session.query(db.Node).get
+    ids, weights = get(1).packed_neighbors()
+    assert_equal(ids.tolist(), [2, 3])
+    assert np.isnan(weights[1]) and weights[0] == 2.0
+    assert_equal(get(1).packed_neighbors("both")[0].tolist(), [2, 2, 3])
+    assert_equal(get(4).packed_neighbors()[0].tolist(), [])
+    # inserts, moves and deletes
+    session.add(db.Edge(source_id=1, target_id=2, weight=7.0))
+    edge = session.query(db.Edge).filter_by(source_id=1, target_id=3).one()
+    edge.target_id = 4
+    session.delete(session.query(db.Edge).filter_by(source_id=1, weight=2.0).one())
+    session.commit()
+    ids, weights = get(1).packed_neighbors()
+    assert_equal(ids.tolist(), [2, 4])
+    assert weights[0] == 7.0 and np.isnan(weights[1])
+    assert_equal(get(3).packed_neighbors("in")[0].tolist(), [])
+    assert_equal(get(4).packed_neighbors("in")[0].tolist(), [1])
+    # set-based writes show up after a rebuild
+    session.execute(db.Edge.__table__.insert(), [dict(source_id=4, target_id=3, weight=1.0)])
+    assert_equal(get(4).packed_neighbors()[0].tolist(), [])
+    db.Edge.rebuild_packed(session, [4, 3])
+    assert_equal(get(4).packed_neighbors()[0].tolist(), [3])
+    rows = session.execute("SELECT * FROM edge_packed ORDER BY node_id, direction").fetchall()
+    db.Edge.rebuild_packed(session)
+    assert_equal(session.execute("SELECT * FROM edge_packed ORDER BY node_id, direction").fetchall(), rows)
+    found = read_neighbors(session, db.Edge, [1, 4], "in")
+    assert_equal(dict((k, v[0].tolist()) for k, v in found.items()), {1: [2], 4: [1]})
+
+@raises(ValueError)
+def test_packed_neighbors_requires_packed_adjacency():
+    db = create_memory_graph([(1, 2)])
+    db.session.query(db.Node).get(1).packed_neighbors()
+
+def test_packed_adjacency_on_existing_database():
+    """ flushes work before the packed table exists, and rebuild_packed
+    creates and fills it """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        dbpath = "sqlite:///" + os.path.join(tmpdir, "graph.db")
+        create_memory_graph([(1, 2)], nodes=3, dbpath=dbpath)
+        Base = declarative_base()
+        Node, Edge = create_base_classes("Node", "Edge", Base=Base, packed_adjacency=True)
+        session = sessionmaker(bind=create_engine(dbpath))()
+        session.add(Edge(source_id=1, target_id=3))
+        session.commit()
+        Edge.rebuild_packed(session, [2])
+        session.commit()
+        assert_equal(session.query(Node).get(1).packed_neighbors()[0].tolist(), [2, 3])
+        session.add(Edge(source_id=3, target_id=1))
+        session.commit()
+        assert_equal(session.query(Node).get(1).packed_neighbors("in")[0].tolist(), [3])
+        assert_equal(ensure_indexes(session.connection(), Edge), [])
+    finally:
+        shutil.rmtree(tmpdir)
+
+def packed(db, node_id, direction="both"):
+    return db.session.query(db.Node).get(node_id).packed_neighbors(direction)[0].tolist()
+
+def test_packed_bulk_delete():
+    """ bulk_delete refreshes the rows of the deleted nodes' neighbors """
+    db = create_memory_graph([(1, 2), (1, 3), (3, 1)], packed_adjacency=True)
+    assert_equal(packed(db, 1), [2, 3, 3])
+    db.Node.bulk_delete(db.session, [3])
+    assert_equal(packed(db, 1), [2])
+    assert_equal(db.session.execute("SELECT count(*) FROM edge_packed WHERE node_id = 3").scalar(), 0)
+
+def test_packed_bulk_upsert():
+    """ bulk_upsert refreshes the rows of both ends """
+    db = create_memory_graph([(1, 2)], nodes=3, packed_adjacency=True, unique_edges=True)
+    db.Edge.bulk_upsert(db.session, [dict(source_id=1, target_id=3, weight=2.0),
+        dict(source_id=1, target_id=2, weight=1.0)])
+    assert_equal(packed(db, 1, "out"), [2, 3])
+    assert_equal(packed(db, 3, "in"), [1])
+
+def test_packed_compact():
+    """ compact refreshes the rows of the expired edges' ends """
+    old = datetime.datetime(2020, 1, 1)
+    db = create_memory_graph(nodes=3, packed_adjacency=True, temporal=True)
+    db.session.add_all([db.Edge(source_id=1, target_id=2, valid_from=old, valid_to=old),
+        db.Edge(source_id=1, target_id=3, valid_from=old)])
+    db.session.commit()
+    db.Edge.compact(db.session, datetime.datetime(2021, 1, 1))
+    assert_equal(packed(db, 1), [3])
+    assert_equal(packed(db, 2), [])
+
+def test_packed_collapse_parallel_edges():
+    """ collapse_parallel_edges refreshes the rows of the merged edges' ends """
+    db = create_memory_graph([(1, 2, 1.0), (1, 2, 2.0), (2, 3)], packed_adjacency=True)
+    db.Edge.collapse_parallel_edges(db.session)
+    ids, weights = db.session.query(db.Node).get(1).packed_neighbors()
+    assert_equal((ids.tolist(), weights.tolist()), ([2], [3.0]))
+    assert_equal(packed(db, 2, "in"), [1])
+
+def test_packed_copy_and_drop_graph():
+    """ copy_graph and drop_graph refresh the rows of the graph's nodes """
+    db = create_memory_graph(multi_graph=True, packed_adjacency=True)
+    a, b = db.Node(graph_id=1), db.Node(graph_id=1)
+    db.session.add_all([a, b])
+    db.session.flush()
+    db.session.add(db.Edge(source=a, target=b))
+    db.session.commit()
+    ids = a.id, b.id
+    db.Node.copy_graph(db.session, 1, 2)
+    copies = [n.id for n in db.session.query(db.Node).filter(db.Node.in_graph(2)).order_by(db.Node.id)]
+    assert_equal(packed(db, copies[0], "out"), [copies[1]])
+    db.Node.drop_graph(db.session, 1)
+    assert_equal(db.session.execute("SELECT count(*) FROM edge_packed WHERE node_id IN (%d, %d)"
+        % ids).scalar(), 0)
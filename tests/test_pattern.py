@@ -0,0 +1,63 @@
+from sqlmodelutils import create_memory_graph
+from graphalchemy.pattern import match
+from nose.tools import assert_equal, raises
+
+# 1 -> 2 -> 3, 1 -> 4 -> 3, 3 -> 5, 2 -> 1
+EDGES = [(1, 2, 1.0), (2, 3, 1.0), (1, 4, 5.0), (4, 3, 1.0), (3, 5, 1.0), (2, 1, 1.0)]
+
+def rows(db, query):
+    return sorted(tuple(row) for row in db.session.execute(query))
+
+def test_two_step_path():
+    """ a -> b -> c compiles to a single select over edge aliases """
+    db = create_memory_graph(EDGES)
+    m = match(db.Node, db.Edge).path("a", "->", "b", "->", "c")
+    m.where(m["a"].id == 1)
+    assert_equal(rows(db, m.select()), [(1, 2, 1), (1, 2, 3), (1, 4, 3)])
+    assert_equal(rows(db, m.select("c", distinct=True)), [(1,), (3,)])
+    assert_equal(m.count(db.session), 3)
+
+def test_distinct_edges_and_nodes():
+    """ edges are never reused within a match; distinct_nodes also keeps nodes apart """
+    db = create_memory_graph([(1, 2)])
+    m = match(db.Node, db.Edge).path("a", "-", "b", "-", "c")
+    assert_equal(rows(db, m.select()), [])
+    db = create_memory_graph(EDGES)
+    m = match(db.Node, db.Edge).path("a", "->", "b", "->", "c")
+    assert (1, 2, 1) in rows(db, m.select())
+    m = match(db.Node, db.Edge, distinct_nodes=True).path("a", "->", "b", "->", "c")
+    assert (1, 2, 1) not in rows(db, m.select())
+
+def test_node_and_edge_conditions():
+    """ where clauses on node labels and edge weights join only what they need """
+    db = create_memory_graph(EDGES)
+    m = match(db.Node, db.Edge).path("a", "->", "b", "->", "c")
+    m.where(m["c"].label == u"node3", m.edge(0).c.weight < 2)
+    assert_equal(rows(db, m.select("a", "b")), [(1, 2)])
+    assert "node AS a" not in str(m.select())
+
+def test_reverse_and_undirected_arrows():
+    """ '<-' follows edges backwards, '-' either way """
+    db = create_memory_graph(EDGES)
+    m = match(db.Node, db.Edge).path("a", "<-", "b")
+    m.where(m["a"].id == 3)
+    assert_equal(rows(db, m.select("b")), [(2,), (4,)])
+    m = match(db.Node, db.Edge).path("a", "-", "b")
+    m.where(m["a"].id == 3)
+    assert_equal(rows(db, m.select("b")), [(2,), (4,), (5,)])
+
+def test_branching_pattern_query():
+    """ reusing a name across paths, and querying Node instances """
+    db = create_memory_graph(EDGES)
+    m = match(db.Node, db.Edge)
+    m.path("a", "->", "b", "->", "c").path("a", "->", "d", "->", "c")
+    m.where(m["b"].id < m["d"].id)
+    results = m.query(db.session, "a", "c").all()
+    assert_equal([(a.id, c.id) for a, c in results], [(1, 3)])
+    assert isinstance(results[0][0], db.Node)
+
+@raises(ValueError)
+def test_bad_arrow():
+    """ only ->, <- and - are arrows """
+    db = create_memory_graph(EDGES)
+    match(db.Node, db.Edge).path("a", "=>", "b")
@@ -0,0 +1,129 @@
+from graphalchemy.csr import CSRGraph
+from graphalchemy.sampling import NeighborSampler, random_walks
+from sqlmodelutils import create_memory_graph
+from nose.tools import assert_equal, raises
+import numpy as np
+
+# star around 1 (2..7), chain 2 -> 8 -> 9
+EDGES = [(1, i) for i in range(2, 8)] + [(2, 8), (8, 9)]
+
+def star():
+    return CSRGraph.from_arrays(range(1, 10), [s for s, t in EDGES],
+            [t for s, t in EDGES], direction="out")
+
+def test_blocks_are_consistent():
+    """ blocks chain from inputs to seeds and index real edges """
+    sampler = NeighborSampler(star(), [3, 2], seed=0)
+    blocks = sampler.sample([1, 2])
+    assert_equal(len(blocks), 2)
+    assert_equal(blocks[-1].dst_ids.tolist(), [1, 2])
+    assert_equal(blocks[0].dst_ids.tolist(), blocks[1].src_ids.tolist())
+    for block in blocks:
+        n = len(block.dst_ids)
+        assert_equal(block.src_ids[:n].tolist(), block.dst_ids.tolist())
+        for s, d in zip(block.edge_src, block.edge_dst):
+            assert (block.dst_ids[d], block.src_ids[s]) in EDGES
+    # at most 3 neighbors of 1, and 2 has its only one
+    top = blocks[-1]
+    assert_equal((top.edge_dst == 0).sum(), 3)
+    assert_equal(top.src_ids[top.edge_src[top.edge_dst == 1]].tolist(), [8])
+
+def test_sampling_without_replacement():
+    """ without replacement neighbors never repeat, -1 takes them all """
+    sampler = NeighborSampler(star(), [4], seed=1)
+    which, neighbors = sampler.sample_neighbors(np.array([0]), 4)
+    assert_equal(len(set(neighbors.tolist())), 4)
+    which, neighbors = sampler.sample_neighbors(np.array([0, 8]), -1)
+    assert_equal(sorted(neighbors.tolist()), range(1, 7))
+    assert_equal(which.tolist(), [0] * 6)
+
+def test_seeded_sampling_is_reproducible():
+    """ the same seed gives the same blocks """
+    first = NeighborSampler(star(), [2], seed=5).sample([1])[0]
+    second = NeighborSampler(star(), [2], seed=5).sample([1])[0]
+    assert_equal(first.src_ids.tolist(), second.src_ids.tolist())
+
+def test_weighted_sampling():
+    """ zero-weight edges are never picked, with or without replacement """
+    weights = [0.0, 0.0, 0.0, 0.0, 1.0, 2.0, 1.0, 1.0]
+    csr = CSRGraph.from_arrays(range(1, 10), [s for s, t in EDGES],
+            [t for s, t in EDGES], weights)
+    for replace in (False, True):
+        sampler = NeighborSampler(csr, [2], weighted=True, replace=replace, seed=2)
+        which, neighbors = sampler.sample_neighbors(np.array([0] * 20), 2)
+        assert set(csr.ids[neighbors].tolist()) <= set([6, 7])
+    sampler = NeighborSampler(csr, [50], weighted=True, replace=True, seed=2)
+    which, neighbors = sampler.sample_neighbors(np.array([0]), 3000)
+    counts = np.bincount(csr.ids[neighbors], minlength=8)
+    assert 1.5 < counts[7] / float(counts[6]) < 2.5
+
+@raises(ValueError)
+def test_weighted_needs_weights():
+    """ weighted sampling needs a weighted snapshot """
+    NeighborSampler(star(), [2], weighted=True)
+
+def test_iter_batches_from_session():
+    """ iter_batches covers every seed once, prefetching in the background """
+    db = create_memory_graph(EDGES)
+    sampler = NeighborSampler.from_session(db.session, db.Node, db.Edge, [2, 2], seed=3)
+    seen = []
+    for blocks in sampler.iter_batches(range(1, 10), 4, prefetch=2):
+        seen.extend(blocks[-1].dst_ids.tolist())
+        assert len(blocks[-1].dst_ids) <= 4
+    assert_equal(sorted(seen), range(1, 10))
+    # stopping early doesn't hang
+    batches = sampler.iter_batches(range(1, 10), 1)
+    next(batches)
+    batches.close()
+
+@raises(KeyError)
+def test_iter_batches_reraises():
+    """ errors while sampling surface in the consumer """
+    for blocks in NeighborSampler(star(), [1]).iter_batches([1, 100], 1, shuffle=False):
+        pass
+
+def test_random_walks_follow_edges():
+    """ every step of a walk follows an out-edge, dead ends pad with -1 """
+    walks = random_walks(star(), [1, 1, 2, 9], 4, seed=0)
+    assert_equal(walks.shape, (4, 4))
+    assert_equal(walks[:, 0].tolist(), [1, 1, 2, 9])
+    assert_equal(walks[2].tolist(), [2, 8, 9, -1])
+    assert_equal(walks[3].tolist(), [9, -1, -1, -1])
+    for walk in walks:
+        for s, t in zip(walk, walk[1:]):
+            assert t == -1 or (s, t) in EDGES
+
+def test_random_walks_seeded_across_processes():
+    """ the same seed gives the same walks, whatever the number of processes """
+    import graphalchemy.sampling as sampling
+    db = create_memory_graph(EDGES)
+    chunk, sampling.WALK_CHUNK = sampling.WALK_CHUNK, 3
+    try:
+        args = (db.session, range(1, 10) * 2, 5)
+        kwargs = dict(seed=7, Node=db.Node, Edge=db.Edge, direction="both")
+        one = random_walks(*args, **kwargs)
+        two = random_walks(*args, processes=2, **kwargs)
+        biased = random_walks(*args, p=0.5, q=2, **kwargs)
+        biased_two = random_walks(*args, p=0.5, q=2, processes=2, **kwargs)
+    finally:
+        sampling.WALK_CHUNK = chunk
+    assert_equal(one.tolist(), two.tolist())
+    assert_equal(biased.tolist(), biased_two.tolist())
+
+def test_node2vec_bias():
+    """ small p returns to the previous node, small q moves away from it """
+    # triangle 1-2-3 with a tail 3-4, undirected
+    csr = CSRGraph.from_arrays(range(1, 5), [1, 2, 3, 3], [2, 3, 1, 4], direction="both")
+    starts = [1] * 2000
+    back = random_walks(csr, starts, 3, p=0.01, q=1, seed=1)
+    assert (back[:, 2] == 1).mean() > 0.9
+    away = random_walks(csr, starts, 3, p=100, q=0.01, seed=1)
+    # from 3 (having come from 1) the only node not next to 1 is 4
+    from_three = away[away[:, 1] == 3]
+    assert (from_three[:, 2] == 4).mean() > 0.9
+
+@raises(ValueError)
+def test_random_walks_need_classes():
+    """ snapshotting a session needs Node and Edge """
+    db = create_memory_graph(EDGES)
+    random_walks(db.session, [1], 3)
@@ -0,0 +1,64 @@
+from graphalchemy.sqlmodels import create_base_classes
+from graphalchemy.sharding import sqlite_connect_shards, ShardedGraph
+from graphalchemy.traversal import expand_frontier
+from sqlalchemy.ext.declarative import declarative_base
+from nose.tools import assert_equal, raises
+import shutil
+import tempfile
+import os
+
+class TestShardedGraph(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.tmpdir, "shard%d.db" % i) for i in range(3)]
+        for path in self.paths[:2]:
+            open(path, "a").close()
+        Base = declarative_base()
+        self.Node, self.Edge = create_base_classes("Node", "Edge", Base=Base)
+        self.graph = sqlite_connect_shards(self.paths[:2], Base.metadata, self.Node, self.Edge)
+        # chain 1 -> 2 -> ... -> 6
+        self.graph.add_all([self.Node(label=u"node%d" % i) for i in range(1, 7)])
+        self.graph.add_all([self.Edge(source_id=i, target_id=i + 1) for i in range(1, 6)])
+        self.graph.commit()
+
+    def tearDown(self):
+        self.graph.close()
+        shutil.rmtree(self.tmpdir)
+
+    def counts(self):
+        return ([s.query(self.Node).count() for s in self.graph.sessions],
+                [s.query(self.Edge).count() for s in self.graph.sessions])
+
+    def test_writes_are_routed(self):
+        """ nodes and their out-edges go to the shard that owns the node """
+        assert_equal(self.counts(), ([3, 3], [2, 3]))
+        assert_equal(self.graph.get(4).label, u"node4")
+        assert_equal([e.source_id for e in self.graph.sessions[1].query(self.Edge)], [1, 3, 5])
+
+    def test_reads_fan_out(self):
+        """ in-edges, k-hop and table-level helpers see every shard """
+        assert_equal(self.graph.neighbors(3), set([2, 4]))
+        assert_equal(self.graph.neighbors(3, "in"), set([2]))
+        assert_equal(self.graph.k_hop(1, 3), {2: 1, 3: 2, 4: 3})
+        assert_equal(expand_frontier(self.graph, self.graph.edges, [1, 6]), set([2, 5]))
+
+    def test_rebalance(self):
+        """ rebalance moves rows onto new shards and keeps the graph whole """
+        assert_equal(self.graph.rebalance(self.paths), (4, 4))
+        assert_equal(self.counts(), ([2, 2, 2], [1, 2, 2]))
+        assert_equal(self.graph.k_hop(1, 10, "out"), {2: 1, 3: 2, 4: 3, 5: 4, 6: 5})
+        self.graph.rebalance(self.paths[2:])
+        assert_equal(self.counts(), ([6], [5]))
+        self.graph.add(self.Node())
+        self.graph.commit()
+        assert_equal(self.graph.get(7).id, 7)
+
+    @raises(ValueError)
+    def test_edges_need_source(self):
+        """ edges without a source_id can't be routed """
+        self.graph.add(self.Edge(target_id=1))
+
+@raises(ValueError)
+def test_too_many_shards():
+    """ SQLite can only attach a limited number of shards """
+    ShardedGraph([None] * 11, None, None)
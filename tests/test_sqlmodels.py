@@ -1,20 +1,25 @@
 from sqlmodelutils import (
         # DBObject, make_DBObject,
         DBSetup, check_object_characteristics,
-        limit_tests_to, show_tables)
+        limit_tests_to, show_tables, create_memory_graph)
 from graphalchemy.sqlmodels import (
         sqlite_connect,
         class_to_tablename,
-        create_base_classes
+        create_base_classes,
+        ensure_indexes,
         )
 from graphalchemy.basemodels import BaseNode, BaseEdge
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
 # TODO: add flask-sqlalchemy tests
 from nose.tools import assert_equal, raises
 from sqlalchemy.exc import (
         IntegrityError)
 import unittest
 import os
+import shutil
+import tempfile
 
 @raises(ValueError)
 def test_sqlite_connect_error():
@@ -416,3 +421,411 @@ class TestPassingBaseClass(TestSpecialMethods):
         cls.delete_items()
         if os.path.exists(cls.dbpath):
             os.remove(cls.dbpath)
+
+
+def edge_weights(db):
+    """ sorted (source_id, target_id, label, weight) for every edge """
+    return sorted((e.source_id, e.target_id, e.label, e.weight) for e in db.session.query(db.Edge))
+
+@raises(IntegrityError)
+def test_unique_edges_rejects_duplicates():
+    """ unique_edges: a second unlabeled edge between the same nodes fails """
+    db = create_memory_graph([(1, 2)], unique_edges=True)
+    try:
+        db.session.add(db.Edge(source_id=1, target_id=2))
+        db.session.commit()
+    finally:
+        db.session.rollback()
+
+def test_bulk_upsert_merges():
+    """ bulk_upsert merges weights of existing edges by sum, max or replace """
+    for merge, expected in [("sum", 5.0), ("max", 3.0), ("replace", 2.0)]:
+        db = create_memory_graph([(1, 2, 3.0)], unique_edges=True)
+        rows = [dict(source_id=1, target_id=2, weight=2.0),
+                dict(source_id=2, target_id=1, weight=1.0, label=u"back")]
+        assert_equal(db.Edge.bulk_upsert(db.session, rows, merge=merge, chunk=1), 2)
+        db.session.commit()
+        assert_equal(edge_weights(db), [(1, 2, u"", expected), (2, 1, u"back", 1.0)])
+
+@raises(ValueError)
+def test_bulk_upsert_requires_unique_edges():
+    """ bulk_upsert refuses to run without the unique index """
+    db = create_memory_graph([(1, 2)])
+    db.Edge.bulk_upsert(db.session, [dict(source_id=1, target_id=2)])
+
+def test_collapse_parallel_edges():
+    """ collapse_parallel_edges merges duplicates and then adds the unique index """
+    db = create_memory_graph([(1, 2, 1.0), (1, 2, 2.0), (1, 2, 4.0), (2, 1, 1.0), (1, 3)])
+    assert_equal(db.Edge.collapse_parallel_edges(db.session), 2)
+    db.session.commit()
+    assert_equal(edge_weights(db), [(1, 2, None, 7.0), (1, 3, None, None), (2, 1, None, 1.0)])
+    db = create_memory_graph([(1, 2, 1.0), (1, 2, 4.0), (1, 2, 2.0)])
+    db.Edge.collapse_parallel_edges(db.session, merge="replace")
+    assert_equal(edge_weights(db), [(1, 2, None, 2.0)])
+
+def test_collapse_parallel_edges_migrates_to_unique():
+    """ collapse_parallel_edges + unique_edges on an existing table creates the index """
+    db = create_memory_graph([(1, 2, 1.0), (1, 2, 2.0)])
+    Base = declarative_base()
+    Node, Edge = create_base_classes("Node", "Edge", Base=Base, unique_edges=True)
+    assert_equal(Edge.collapse_parallel_edges(db.session, merge="max"), 1)
+    db.session.commit()
+    assert_equal(edge_weights(db), [(1, 2, u"", 2.0)])
+    assert_equal(ensure_indexes(db.engine, Edge), [])
+    assert_equal(ensure_indexes(db.engine, db.Edge), [])
+
+def test_bulk_delete_cascades_edges():
+    """ bulk_delete removes nodes and their edges, and syncs the session """
+    db = create_memory_graph([(1, 2), (2, 3), (3, 4), (4, 1)], nodes=5, enforce_fk=True)
+    node1 = db.session.query(db.Node).get(1)
+    node4 = db.session.query(db.Node).get(4)
+    edge = node1.out_edges[0]
+    assert_equal(len(node4.out_edges), 1)
+    assert_equal(db.Node.bulk_delete(db.session, [2, 5]), (2, 2))
+    db.session.commit()
+    assert node1 in db.session
+    assert edge not in db.session
+    assert_equal(node1.out_edges, [])
+    assert_equal(sorted(n.id for n in db.session.query(db.Node)), [1, 3, 4])
+    assert_equal(sorted(map(tuple, db.session.query(db.Edge))), [(3, 4), (4, 1)])
+    assert_equal(db.Node.bulk_delete(db.session, []), (0, 0))
+
+def test_bulk_delete_chunks():
+    """ bulk_delete splits long id lists into chunks """
+    edges = [(i, i + 1) for i in range(1, 30)]
+    db = create_memory_graph(edges, enforce_fk=True)
+    assert_equal(db.Node.bulk_delete(db.session, range(1, 30, 2), chunk=4), (15, 29))
+    assert_equal(db.Node.bulk_delete(db.session, range(2, 31, 2), chunk=4), (15, 0))
+    db.session.commit()
+    assert_equal(db.session.query(db.Node).count(), 0)
+
+def test_bulk_delete_rolls_back():
+    """ a long bulk_delete stays in the caller's transaction """
+    db = create_memory_graph([(i, i + 1) for i in range(1, 30)], enforce_fk=True)
+    db.session.add(db.Node(id=100))
+    db.session.flush()
+    db.Node.bulk_delete(db.session, range(1, 20), chunk=4)
+    db.session.rollback()
+    assert_equal(db.session.query(db.Node).count(), 30)
+    assert_equal(db.session.query(db.Edge).count(), 29)
+
+@raises(IntegrityError)
+def test_bulk_delete_without_cascade():
+    """ bulk_delete without cascade_edges fails on nodes that still have edges """
+    db = create_memory_graph([(1, 2)], enforce_fk=True)
+    try:
+        db.Node.bulk_delete(db.session, [1], cascade_edges=False)
+    finally:
+        db.session.rollback()
+
+def test_cascade_deletes_option():
+    """ cascade_deletes declares ON DELETE CASCADE on the edge foreign keys """
+    db = create_memory_graph([(1, 2), (2, 3)], enforce_fk=True, cascade_deletes=True)
+    assert_equal(db.Node.bulk_delete(db.session, [1], cascade_edges=False), (1, 0))
+    db.session.commit()
+    assert_equal(map(tuple, db.session.query(db.Edge)), [(2, 3)])
+    # and through the ORM
+    db.session.delete(db.session.query(db.Node).get(3))
+    db.session.commit()
+    assert_equal(db.session.query(db.Edge).count(), 0)
+
+def create_two_graphs(**options):
+    """ graph 1: a -> b -> c, graph 2: d -> e, all through the ORM """
+    db = create_memory_graph(multi_graph=True, **options)
+    nodes = {}
+    for graph_id, label in [(1, u"a"), (1, u"b"), (1, u"c"), (2, u"d"), (2, u"e")]:
+        nodes[label] = db.Node(graph_id=graph_id, label=label)
+        db.session.add(nodes[label])
+        db.session.flush()
+    for source, target in [(u"a", u"b"), (u"b", u"c"), (u"d", u"e")]:
+        db.session.add(db.Edge(source=nodes[source], target=nodes[target]))
+    db.session.commit()
+    return db
+
+def test_multi_graph_scopes_queries():
+    """ multi_graph: edges inherit graph_id, in_graph filters, indexes lead with graph_id """
+    from graphalchemy.traversal import scoped, k_hop
+    db = create_two_graphs()
+    assert_equal(sorted((e.graph_id, e.source.label) for e in db.session.query(db.Edge)),
+            [(1, u"a"), (1, u"b"), (2, u"d")])
+    assert_equal(db.session.query(db.Node).filter(db.Node.in_graph(2)).count(), 2)
+    a = db.session.query(db.Node).filter_by(label=u"a").one()
+    assert_equal([n.label for n in a.neighbors], [u"b"])
+    assert_equal(k_hop(db.session, scoped(db.Edge, db.Edge.in_graph(1)), a.id, 2, "out"), {2: 1, 3: 2})
+    assert_equal(k_hop(db.session, scoped(db.Edge, db.Edge.in_graph(2)), a.id, 2), {})
+    indexes = dict((index.name, [c.name for c in index.columns]) for index in db.Edge.__table__.indexes)
+    assert_equal(indexes["ix_edge_source_id"], ["graph_id", "source_id"])
+
+def test_multi_graph_copy_and_drop():
+    """ copy_graph duplicates a graph under new ids, drop_graph removes one """
+    db = create_two_graphs(unique_edges=True)
+    assert_equal(db.Node.copy_graph(db.session, 1, 3), (3, 2))
+    assert_equal(db.Node.copy_graph(db.session, 7, 8), (0, 0))
+    db.session.commit()
+    copies = db.session.query(db.Node).filter(db.Node.in_graph(3)).order_by(db.Node.id).all()
+    assert_equal([(n.id, n.label) for n in copies], [(6, u"a"), (7, u"b"), (8, u"c")])
+    assert_equal([n.label for n in copies[0].neighbors], [u"b"])
+    # the unique index is per graph
+    db.Edge.bulk_upsert(db.session, [dict(graph_id=3, source_id=6, target_id=7, weight=1.0)])
+    assert_equal(db.session.query(db.Edge).count(), 5)
+    assert_equal(db.Node.drop_graph(db.session, 1), (3, 2))
+    db.session.commit()
+    assert_equal(sorted(set(n.graph_id for n in db.session.query(db.Node))), [2, 3])
+    assert_equal(db.session.query(db.Edge).filter(db.Edge.in_graph(1)).count(), 0)
+
+@raises(ValueError)
+def test_in_graph_requires_multi_graph():
+    """ graph helpers refuse to run without multi_graph """
+    db = create_memory_graph()
+    db.Node.in_graph(1)
+
+def test_temporal_edges_as_of():
+    """ temporal: neighbors, k-hop and export only see edges valid at t """
+    import datetime
+    from StringIO import StringIO
+    from graphalchemy.traversal import k_hop
+    from graphalchemy.io import write_gexf
+    day = lambda d: datetime.datetime(2020, 1, d)
+    db = create_memory_graph(nodes=4, temporal=True, unique_edges=True)
+    for source, target, start, end in [(1, 2, 1, None), (2, 3, 1, 5), (2, 3, 8, None), (1, 4, 3, 4)]:
+        db.session.add(db.Edge(source_id=source, target_id=target, valid_from=day(start),
+            valid_to=end and day(end)))
+    db.session.commit()
+    node1 = db.session.query(db.Node).get(1)
+    assert_equal(sorted(n.id for n in node1.neighbors_as_of(day(3))), [2, 4])
+    assert_equal([n.id for n in node1.neighbors_as_of(day(4), "in")], [])
+    assert_equal(k_hop(db.session, db.Edge.as_of(day(2)), 1, 2, "out"), {2: 1, 3: 2})
+    assert_equal(k_hop(db.session, db.Edge.as_of(day(6)), 1, 2, "out"), {2: 1})
+    assert_equal(write_gexf(db.session, db.Node, db.Edge.as_of(day(9)), StringIO()), (4, 2))
+    indexes = dict((index.name, [c.name for c in index.columns]) for index in db.Edge.__table__.indexes)
+    assert_equal(indexes["ix_edge_source_id"], ["source_id", "valid_from"])
+    # edges without a start are valid from when they were added
+    db.session.add(db.Edge(source_id=3, target_id=4))
+    db.session.commit()
+    assert_equal([n.id for n in db.session.query(db.Node).get(3).neighbors_as_of(
+        datetime.datetime.utcnow() + datetime.timedelta(seconds=1), "out")], [4])
+
+def test_temporal_compact():
+    """ compact deletes the edges that expired before a cutoff """
+    import datetime
+    db = create_memory_graph(nodes=3, temporal=True)
+    old = datetime.datetime(2020, 1, 1)
+    db.session.add_all([db.Edge(source_id=1, target_id=2, valid_from=old, valid_to=old),
+        db.Edge(source_id=2, target_id=3, valid_from=old)])
+    db.session.commit()
+    assert_equal(db.Edge.compact(db.session, datetime.datetime(2021, 1, 1)), 1)
+    db.session.commit()
+    assert_equal(map(tuple, db.session.query(db.Edge)), [(2, 3)])
+
+@raises(ValueError)
+def test_as_of_requires_temporal():
+    """ time slicing refuses to run without temporal """
+    create_memory_graph().Edge.as_of(0)
+
+def test_find_by_label_prefix():
+    """ prefix lookups use the label index, in label order """
+    db = create_memory_graph(nodes=12, label_index="btree")
+    db.session.add(db.Node(id=13, label=u"nodf"))
+    db.session.commit()
+    assert_equal(db.Node.find_by_label(db.session, prefix=u"node1"), [1, 10, 11, 12])
+    assert_equal(db.Node.find_by_label(db.session, prefix=u"node1", limit=2), [1, 10])
+    assert_equal(len(db.Node.find_by_label(db.session, prefix=u"")), 13)
+    plan = " ".join(str(row) for row in db.session.execute("EXPLAIN QUERY PLAN SELECT id FROM node "
+        "WHERE label >= 'a' AND label < 'b' ORDER BY label, id"))
+    assert "ix_node_label" in plan, plan
+
+def test_find_by_label_fts():
+    """ FTS queries see inserts, updates and deletes through the triggers """
+    db = create_memory_graph(label_index="fts")
+    db.session.add_all([db.Node(id=1, label=u"alpha beta"), db.Node(id=2, label=u"beta gamma"),
+        db.Node(id=3, label=u"alphabet"), db.Node(id=4)])
+    db.session.commit()
+    assert_equal(sorted(db.Node.find_by_label(db.session, match=u"beta")), [1, 2])
+    assert_equal(sorted(db.Node.find_by_label(db.session, match=u"alpha*")), [1, 3])
+    assert_equal(db.Node.find_by_label(db.session, prefix=u"alpha", match=u"beta"), [1])
+    node = db.session.query(db.Node).get(2)
+    node.label = u"delta"
+    db.session.delete(db.session.query(db.Node).get(1))
+    db.session.commit()
+    assert_equal(db.Node.find_by_label(db.session, match=u"beta"), [])
+    assert_equal(db.Node.find_by_label(db.session, match=u"delta"), [2])
+    db.Node.rebuild_label_index(db.session)
+    assert_equal(db.Node.find_by_label(db.session, match=u"alphabet"), [3])
+    db.Base.metadata.drop_all()
+
+def test_rebuild_label_index_on_existing_database():
+    """ rebuild_label_index creates the FTS table for a node table that
+    predates `label_index='fts'` """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        dbpath = "sqlite:///" + os.path.join(tmpdir, "graph.db")
+        db = create_memory_graph(dbpath=dbpath)
+        db.session.add_all([db.Node(id=1, label=u"red apple"), db.Node(id=2, label=u"pear")])
+        db.session.commit()
+        Node, Edge = create_base_classes("Node", "Edge", Base=declarative_base(), label_index="fts")
+        session = sessionmaker(bind=create_engine(dbpath))()
+        Node.rebuild_label_index(session)
+        session.commit()
+        session.add(Node(id=3, label=u"green apple"))
+        session.commit()
+        assert_equal(sorted(Node.find_by_label(session, match=u"apple")), [1, 3])
+        # only the btree index is left to create
+        assert_equal(ensure_indexes(session.connection(), Node), ["ix_node_label"])
+    finally:
+        shutil.rmtree(tmpdir)
+
+@raises(ValueError)
+def test_find_by_label_match_requires_fts():
+    """ match needs the FTS table """
+    db = create_memory_graph(label_index="btree")
+    db.Node.find_by_label(db.session, match=u"x")
+
+def property_graph():
+    """ star around node 1, with typed properties on nodes and edges """
+    import sqlalchemy as sqla
+    db = create_memory_graph(nodes=5, node_properties=dict(kind=sqla.Unicode(10), score=sqla.Float),
+            edge_properties=dict(kind=sqla.Unicode(10)), index_properties=("kind",))
+    for node_id, kind in [(2, u"person"), (3, u"person"), (4, u"place"), (5, u"person")]:
+        db.session.query(db.Node).get(node_id).kind = kind
+        db.session.add(db.Edge(source_id=1, target_id=node_id, kind=u"knows" if node_id < 4 else u"visits"))
+    db.session.add(db.Edge(source_id=5, target_id=1, kind=u"knows"))
+    db.session.commit()
+    return db
+
+def test_property_columns_and_indexes():
+    """ declared properties become typed, indexable columns """
+    db = property_graph()
+    assert_equal(db.session.query(db.Node).filter(db.Node.kind == u"person").count(), 3)
+    node_indexes = sorted(index.name for index in db.Node.__table__.indexes)
+    assert_equal(node_indexes, ["ix_node_kind"])
+    edge_indexes = dict((index.name, [c.name for c in index.columns]) for index in db.Edge.__table__.indexes)
+    assert_equal(edge_indexes["ix_edge_source_id_kind"], ["source_id", "kind"])
+    assert "score" not in db.Edge.__table__.c
+
+def test_find_neighbors_where():
+    """ node and edge predicates are pushed into the adjacency selects """
+    from graphalchemy.traversal import expand_frontier
+    db = property_graph()
+    Node, Edge = db.Node, db.Edge
+    node = db.session.query(Node).get(1)
+    ids = lambda nodes: sorted(n.id for n in nodes)
+    assert_equal(ids(node.find_neighbors()), [2, 3, 4, 5])
+    assert_equal(ids(node.find_neighbors(Node.kind == u"person")), [2, 3, 5])
+    assert_equal(ids(node.find_neighbors(Node.kind == u"person", Edge.kind == u"knows")), [2, 3, 5])
+    assert_equal(ids(node.find_neighbors(Node.kind == u"person", Edge.kind == u"knows", "out")), [2, 3])
+    assert_equal(ids(node.find_neighbors(edge_where=Edge.kind == u"visits")), [4, 5])
+    assert_equal(expand_frontier(db.session, Edge, [1], "in", Node=Node, where=Node.kind == u"place"),
+            set())
+
+@raises(ValueError)
+def test_properties_cant_shadow_columns():
+    import sqlalchemy as sqla
+    create_memory_graph(edge_properties=dict(weight=sqla.Integer))
+
+@raises(ValueError)
+def test_index_properties_must_be_declared():
+    create_memory_graph(index_properties=("kind",))
+
+def test_create_base_classes_is_memoized():
+    """ the same arguments give back the same (not yet configured) classes """
+    Base = declarative_base()
+    Node, Edge = create_base_classes("Node", "Edge", Base=Base)
+    assert not Node.__mapper__.configured
+    assert create_base_classes("Node", "Edge", Base=Base) == (Node, Edge)
+    assert create_base_classes("Node", "Edge", Base=declarative_base())[0] is not Node
+    mixins = create_base_classes("Node", "Edge")
+    assert mixins is create_base_classes("Node", "Edge")
+    assert create_base_classes("Node", "Edge", unique_edges=True) is not mixins
+    assert "BaseNode ABC" in mixins[0].__doc__
+
+def test_undirected_canonical_storage():
+    """ undirected edges are stored low id first, however they were made """
+    db = create_memory_graph([(2, 1), (1, 3)], nodes=3, undirected=True)
+    assert_equal(sorted(map(tuple, db.session.query(db.Edge))), [(1, 2), (1, 3)])
+    node1, node3 = db.session.query(db.Node).get(1), db.session.query(db.Node).get(3)
+    edge = db.Edge(source=node3, target=node1)
+    db.session.add(edge)
+    db.session.flush()
+    assert_equal((edge.source_id, edge.target_id), (1, 3))
+    assert edge.source is node1 and edge.target is node3
+    assert edge.directed is False
+    db.session.commit()
+    assert_equal(db.session.query(db.Edge).filter(db.Edge.between(3, 1)).count(), 2)
+    try:
+        db.session.execute(db.Edge.__table__.insert().values(source_id=3, target_id=2))
+    except IntegrityError:
+        db.session.rollback()
+    else:
+        raise AssertionError("non-canonical edge was accepted")
+
+def test_undirected_adjacency():
+    """ neighbors, degree and existence come from the adjacency table """
+    from graphalchemy.traversal import k_hop
+    from graphalchemy.explain import explain
+    db = create_memory_graph([(2, 1), (1, 2), (2, 3), (4, 4)], nodes=5, undirected=True)
+    get = db.session.query(db.Node).get
+    assert_equal(get(2).neighbor_ids(), [1, 3])
+    assert_equal(get(2).degree(), 3)
+    assert_equal(get(4).neighbor_ids(), [4])
+    assert_equal(get(4).degree(), 1)
+    assert get(3).is_adjacent(2) and get(2).is_adjacent(get(3))
+    assert not get(1).is_adjacent(3)
+    assert_equal(k_hop(db.session, db.Edge.symmetric(), 3, 2, "out"), {2: 1, 1: 2})
+    # updates and deletes keep it in sync
+    edge = db.session.query(db.Edge).filter(db.Edge.between(2, 3)).one()
+    edge.source_id = 5
+    db.session.delete(db.session.query(db.Edge).filter(db.Edge.between(4, 4)).one())
+    db.session.commit()
+    assert_equal(get(2).neighbor_ids(), [1])
+    assert_equal(get(3).neighbor_ids(), [5])
+    assert_equal(get(4).degree(), 0)
+    adjacency = db.session.execute("SELECT count(*) FROM edge_adjacency").scalar()
+    db.Edge.rebuild_adjacency(db.session)
+    assert_equal(db.session.execute("SELECT count(*) FROM edge_adjacency").scalar(), adjacency)
+    plan = explain(db.session, "SELECT DISTINCT other_id FROM edge_adjacency WHERE node_id = 1")
+    assert_equal(len(plan.details), 1)
+    assert plan.details[0].startswith("SEARCH edge_adjacency USING PRIMARY KEY"), plan.details
+
+def test_rebuild_adjacency_on_existing_database():
+    """ rebuild_adjacency creates the adjacency table (and its triggers) for
+    a database that predates `undirected` """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        dbpath = "sqlite:///" + os.path.join(tmpdir, "graph.db")
+        create_memory_graph([(1, 2)], nodes=3, dbpath=dbpath)
+        Node, Edge = create_base_classes("Node", "Edge", Base=declarative_base(), undirected=True)
+        session = sessionmaker(bind=create_engine(dbpath))()
+        Edge.rebuild_adjacency(session)
+        session.commit()
+        session.add(Edge(source_id=3, target_id=2))
+        session.commit()
+        assert_equal(session.query(Node).get(2).neighbor_ids(), [1, 3])
+    finally:
+        shutil.rmtree(tmpdir)
+
+@raises(ValueError)
+def test_adjacency_requires_undirected():
+    db = create_memory_graph([(1, 2)])
+    db.session.query(db.Node).get(1).neighbor_ids()
+
+def test_multi_graph_lookups_seek_indexes():
+    """ multi_graph: node helpers and bulk_delete stay on the graph_id indexes """
+    from sqlalchemy import event
+    import datetime
+    import re
+    db = create_two_graphs(temporal=True)
+    plans = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "DELETE")):
+            plans.append((statement, cursor.connection.execute(
+                "EXPLAIN QUERY PLAN " + statement, parameters).fetchall()))
+    event.listen(db.engine, "before_cursor_execute", record)
+    b = db.session.query(db.Node).filter_by(label=u"b").one()
+    b.top_neighbors(1)
+    b.find_neighbors(db.Node.label != None)
+    b.neighbors_as_of(datetime.datetime.utcnow())
+    db.Node.bulk_delete(db.session, [b.id])
+    scans = [(statement, row[-1]) for statement, rows in plans for row in rows
+            if re.match(r"SCAN (TABLE )?edge\b", row[-1])]
+    assert_equal(scans, [])
+    assert any("DELETE FROM edge" in statement for statement, rows in plans)
@@ -0,0 +1,112 @@
+from sqlmodelutils import create_memory_graph
+from graphalchemy.traversal import (chunked, expand_frontier, k_hop,
+        Adjacency, dijkstra, astar)
+from nose.tools import assert_equal, raises
+
+# 1 -> 2 -> 3 -> 4, 5 -> 1, 6 isolated
+EDGES = [(1, 2), (2, 3), (3, 4), (5, 1)]
+
+def test_chunked():
+    """ chunked splits into lists of at most size items """
+    assert_equal(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+    assert_equal(list(chunked([], 2)), [])
+
+def test_expand_frontier_directions():
+    """ expand_frontier follows out, in or both directions """
+    db = create_memory_graph(EDGES, nodes=6)
+    assert_equal(expand_frontier(db.session, db.Edge, [1], "out"), set([2]))
+    assert_equal(expand_frontier(db.session, db.Edge, [1], "in"), set([5]))
+    assert_equal(expand_frontier(db.session, db.Edge, [1, 3], "both"), set([2, 4, 5]))
+    assert_equal(expand_frontier(db.session, db.Edge, [6]), set())
+
+def test_expand_frontier_large_id_list():
+    """ expand_frontier handles more ids than SQLite allows parameters """
+    db = create_memory_graph([(1, 2)])
+    assert_equal(expand_frontier(db.session, db.Edge, range(1, 2000), "out"), set([2]))
+
+def test_k_hop():
+    """ k_hop returns hop counts for everything within k hops """
+    db = create_memory_graph(EDGES, nodes=6)
+    assert_equal(k_hop(db.session, db.Edge, 1, 2), {2: 1, 5: 1, 3: 2})
+    assert_equal(k_hop(db.session, db.Edge, 1, 5, direction="out"), {2: 1, 3: 2, 4: 3})
+    node = db.session.query(db.Node).get(6)
+    assert_equal(k_hop(db.session, db.Edge, node, 3), {})
+
+@raises(ValueError)
+def test_bad_direction():
+    """ only 'out', 'in' and 'both' are valid directions """
+    db = create_memory_graph(EDGES)
+    expand_frontier(db.session, db.Edge, [1], "sideways")
+
+#      2      1
+#  1 -----> 2 ---> 4
+#  |        ^      ^
+# 5|       1|      | 10
+#  v        |      |
+#  3 -------+      5
+WEIGHTED = [(1, 2, 2.0), (1, 3, 5.0), (3, 2, 1.0), (2, 4, 1.0), (5, 4, 10.0)]
+
+def test_dijkstra_single_source():
+    """ dijkstra returns distances and paths to everything reachable """
+    db = create_memory_graph(WEIGHTED)
+    distances, paths = dijkstra(db.session, db.Edge, 1)
+    assert_equal(distances, {1: 0, 2: 2.0, 3: 5.0, 4: 3.0})
+    assert_equal(paths[4], [1, 2, 4])
+    distances, paths = dijkstra(db.session, db.Edge, 1, cutoff=4)
+    assert_equal(sorted(distances), [1, 2, 4])
+
+def test_dijkstra_target_and_directions():
+    """ dijkstra with a target stops there, and follows the given direction """
+    db = create_memory_graph(WEIGHTED)
+    assert_equal(dijkstra(db.session, db.Edge, 3, 4), (2.0, [3, 2, 4]))
+    assert_equal(dijkstra(db.session, db.Edge, 4, 1), (None, None))
+    assert_equal(dijkstra(db.session, db.Edge, 4, 1, direction="in"), (3.0, [4, 2, 1]))
+    assert_equal(dijkstra(db.session, db.Edge, 5, 3, direction="both"), (12.0, [5, 4, 2, 3]))
+
+def test_dijkstra_default_weight():
+    """ NULL weights count as default_weight """
+    db = create_memory_graph([(1, 2), (2, 3), (1, 3, 3.0)])
+    assert_equal(dijkstra(db.session, db.Edge, 1, 3), (2.0, [1, 2, 3]))
+    assert_equal(dijkstra(db.session, db.Edge, 1, 3, default_weight=2.0), (3.0, [1, 3]))
+
+@raises(ValueError)
+def test_dijkstra_negative_weight():
+    """ negative weights raise ValueError """
+    db = create_memory_graph([(1, 2, -1.0)])
+    dijkstra(db.session, db.Edge, 1)
+
+def test_astar_with_shared_cache():
+    """ astar uses the heuristic, and an Adjacency can be shared between queries """
+    db = create_memory_graph(WEIGHTED)
+    adjacency = Adjacency(db.session, db.Edge, cache_size=3)
+    seen = []
+    def heuristic(node_id, target_id):
+        seen.append((node_id, target_id))
+        return 0
+    assert_equal(astar(db.session, db.Edge, 1, 4, heuristic, adjacency=adjacency), (3.0, [1, 2, 4]))
+    assert (2, 4) in seen
+    assert len(adjacency.cache) <= 3
+    assert_equal(adjacency[5], [(4, 10.0)])
+    assert_equal(astar(db.session, db.Edge, 1, 5, heuristic, adjacency=adjacency), (None, None))
+    # a cache smaller than a batch still works
+    tiny = Adjacency(db.session, db.Edge, cache_size=1)
+    assert_equal(dijkstra(db.session, db.Edge, 1, 4, adjacency=tiny), (3.0, [1, 2, 4]))
+
+def test_top_neighbors():
+    """ top_neighbors ranks each node's edges by weight, NULLs last """
+    from graphalchemy.explain import explain
+    from graphalchemy.traversal import top_neighbors, _top_queries
+    edges = [(1, 2, 5.0), (1, 3, 1.0), (1, 4, 9.0), (1, 5), (2, 1, 7.0), (3, 1, 2.0)]
+    db = create_memory_graph(edges, weight_index=True)
+    node = db.session.query(db.Node).get(1)
+    assert_equal(node.top_neighbors(2), [(4, 9.0), (2, 5.0)])
+    assert_equal(node.top_neighbors(5), [(4, 9.0), (2, 5.0), (3, 1.0), (5, None)])
+    assert_equal(node.top_neighbors(1, direction="in"), [(2, 7.0)])
+    assert_equal(node.top_neighbors(3, direction="both"), [(4, 9.0), (2, 7.0), (2, 5.0)])
+    assert_equal(top_neighbors(db.session, db.Edge, [1, 2, 5], 1),
+            {1: [(4, 9.0)], 2: [(1, 7.0)], 5: []})
+    assert_equal(len(top_neighbors(db.session, db.Edge, range(1000), 1)), 1000)
+    query = _top_queries(db.Edge.__table__, [1], 2, "weight", "out")[0]
+    plan = explain(db.session, query)
+    assert any("ix_edge_source_id_weight" in detail for detail in plan.details), plan.details
+    assert not any("TEMP B-TREE" in detail for detail in plan.details), plan.details